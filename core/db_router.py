@@ -0,0 +1,126 @@
+"""
+Read-replica routing.
+
+Every database alias listed in ``DATABASE_REPLICAS`` is a read-only copy
+of ``default``. ``ReplicaRoutingMiddleware`` decides per request whether
+reads may go to a replica: only GET/HEAD requests outside
+``DATABASE_PRIMARY_PATHS``, and only while the session isn't pinned to
+the primary. A session gets pinned for ``DATABASE_REPLICA_PIN_SECONDS``
+after any request that wrote to the database, so a customer always sees
+their own changes (an order right after checkout, a new stock level right
+after saving it) even while the replicas lag behind.
+
+Outside a request (management commands, shells) everything stays on the
+primary unless the code opts in with ``read_from_replica()``.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_SESSION_KEY = '_db_primary_until'
+
+# Replica alias chosen for the current request, or None for the primary
+_replica = ContextVar('db_replica', default=None)
+_wrote = ContextVar('db_wrote', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in getattr(settings, 'DATABASE_REPLICAS', []) if alias in settings.DATABASES]
+
+
+def _pick_replica():
+    aliases = replica_aliases()
+    return random.choice(aliases) if aliases else None
+
+
+@contextmanager
+def read_from_primary():
+    """Send every read inside the block to the primary"""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+@contextmanager
+def read_from_replica():
+    """Send reads inside the block to a replica (when one is configured)"""
+    token = _replica.set(_pick_replica())
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    # Session and auth rows are read right after being written on login
+    PRIMARY_APPS = {'sessions', 'auth'}
+    # Rows only ever read back by whoever wrote them: always read from the
+    # primary, and writing them doesn't pin the session
+    PRIMARY_MODELS = {'inventory.cartline', 'inventory.stockreservation'}
+
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica is None or _wrote.get() or model._meta.app_label in self.PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        if model._meta.label_lower in self.PRIMARY_MODELS:
+            return DEFAULT_DB_ALIAS
+        # Reads inside a transaction must see its uncommitted writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        # Once a request writes, its remaining reads go to the primary too
+        if model._meta.label_lower not in self.PRIMARY_MODELS:
+            _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
+
+
+def _is_pinned(request):
+    pinned_until = request.session.get(PIN_SESSION_KEY)
+    return pinned_until is not None and pinned_until > time.time()
+
+
+def _replica_allowed(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    primary_paths = getattr(settings, 'DATABASE_PRIMARY_PATHS', ())
+    if any(request.path.startswith(prefix) for prefix in primary_paths):
+        return False
+    return not _is_pinned(request)
+
+
+class ReplicaRoutingMiddleware:
+    """Choose primary or replica reads per request; must follow SessionMiddleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replica = _pick_replica() if _replica_allowed(request) else None
+        replica_token = _replica.set(replica)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            pin_seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 0)
+            if _wrote.get() and pin_seconds and replica_aliases():
+                request.session[PIN_SESSION_KEY] = time.time() + pin_seconds
+                # The session middleware runs after us on the way out and
+                # persists the pin along with the response
+            return response
+        finally:
+            _replica.reset(replica_token)
+            _wrote.reset(wrote_token)
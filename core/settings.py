@@ -66,9 +66,11 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # WhiteNoise для обслуживания статических файлов
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'core.db_router.ReplicaRoutingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'inventory.cart.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -85,6 +87,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'inventory.context_processors.cart',
             ],
         },
     },
@@ -116,6 +119,76 @@ DATABASES = {
     }
 }
 
+# Cart storage (see inventory.cart): SessionCartStorage, CookieCartStorage
+# or DatabaseCartStorage. The database backend writes one cart row per click
+# instead of the whole session.
+CART_STORAGE = os.getenv('CART_STORAGE', 'inventory.cart.DatabaseCartStorage')
+# Seconds a cart holds its stock after it was last changed or viewed
+# (inventory.reservations); run release_expired_reservations periodically
+STOCK_RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', '900'))
+# Seconds a checkout / order API idempotency key is remembered
+# (orders.idempotency); run clear_idempotency_keys periodically
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', '86400'))
+# 'direct' places orders during checkout; 'queued' stores them for the
+# process_orders worker (orders.intake), for flash-sale traffic
+ORDER_INTAKE_MODE = os.getenv('ORDER_INTAKE_MODE', 'direct')
+# Completed/cancelled orders older than this many days are moved to the
+# order archive by archive_orders (orders.archive)
+ORDER_ARCHIVE_DAYS = int(os.getenv('ORDER_ARCHIVE_DAYS', '365'))
+
+# Read replicas
+# Comma-separated host[:port] list of streaming replicas of the database
+# above. GET requests read from a replica (see core.db_router) unless the
+# path needs read-your-writes or the session wrote something in the last
+# DATABASE_REPLICA_PIN_SECONDS seconds.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')), start=1):
+    host, _, port = replica.strip().partition(':')
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DATABASE_REPLICA_PIN_SECONDS', '10'))
+# Always served from the primary: checkout, cart and order pages show rows
+# the customer has just written
+DATABASE_PRIMARY_PATHS = (
+    '/cart/',
+    '/checkout/',
+    '/orders/',
+    '/api/orders/',
+    '/panel/orders/',
+)
+
+
+# Cache
+# The storefront page cache (inventory.page_cache) has to be shared by every
+# worker so that purges reach all of them. Set REDIS_URL in production
+# (needs the `redis` package); without it each process keeps its own
+# local-memory cache and pages expire after STOREFRONT_CACHE_TIMEOUT.
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
+STOREFRONT_CACHE_TIMEOUT = int(os.getenv('STOREFRONT_CACHE_TIMEOUT', '60'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -4,18 +4,14 @@ from .models import Category, Product
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'product_count']
+    list_display = ['name', 'product_count', 'in_stock_count', 'out_of_stock_count']
     search_fields = ['name']
-    
-    def product_count(self, obj):
-        return obj.products.count()
-    product_count.short_description = 'Products'
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['image_preview', 'name', 'category', 'price', 'stock_status']
     list_filter = ['category', 'created_at']
-    search_fields = ['name', 'description']
+    search_fields = ['name', 'sku', 'description']
     list_editable = ['price']
     readonly_fields = ['image_preview_large']
 
@@ -34,7 +30,7 @@ class ProductAdmin(admin.ModelAdmin):
     def stock_status(self, obj):
         if obj.stock_quantity == 0:
             return format_html('<span style="color: red; font-weight: bold;">Out of Stock</span>')
-        elif obj.stock_quantity < 10:
+        elif obj.is_low_stock:
             return format_html('<span style="color: orange; font-weight: bold;">Low Stock ({})</span>', obj.stock_quantity)
         return format_html('<span style="color: green;">In Stock ({})</span>', obj.stock_quantity)
     stock_status.short_description = 'Stock'
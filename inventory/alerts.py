@@ -0,0 +1,54 @@
+"""
+Low-stock monitoring.
+
+A product is low on stock while its stock is below its reorder threshold:
+``Product.reorder_threshold`` if set, otherwise its category's. The
+products that are form a small maintained set, ``is_low_stock=True``
+(with ``low_stock_since``), covered by a partial index, so the alerts
+feed and the dashboard read that set instead of scanning the catalog.
+
+``refresh`` re-evaluates some products with two conditional UPDATEs that
+only touch rows crossing their threshold; it runs after every stock
+change (see inventory.signals) and whenever a threshold is edited.
+"""
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Category, Product
+
+
+def threshold():
+    """Expression for a product's effective reorder threshold"""
+    return Coalesce(
+        F('reorder_threshold'),
+        Subquery(Category.objects.filter(pk=OuterRef('category_id')).values('reorder_threshold')[:1]),
+    )
+
+
+def low_stock():
+    """The maintained low-stock set, most recently dropped below threshold first"""
+    return Product.objects.filter(is_low_stock=True).order_by('-low_stock_since', '-id')
+
+
+def refresh(product_ids=None, category_ids=None):
+    """
+    Flag products of ``product_ids`` / ``category_ids`` (everything when
+    both are None) that went below their threshold and unflag those back
+    above it. Returns how many products changed state.
+    """
+    products = Product.objects.all()
+    if product_ids is not None or category_ids is not None:
+        scope = Q(pk__in=product_ids or []) | Q(category_id__in=category_ids or [])
+        products = products.filter(scope)
+
+    products = products.alias(threshold=threshold())
+    now = timezone.now()
+    # updated_at moves too: is_low_stock is part of the API representation
+    dropped = products.filter(is_low_stock=False, stock_quantity__lt=F('threshold')).update(
+        is_low_stock=True, low_stock_since=now, updated_at=now
+    )
+    recovered = products.filter(is_low_stock=True, stock_quantity__gte=F('threshold')).update(
+        is_low_stock=False, low_stock_since=None, updated_at=now
+    )
+    return dropped + recovered
@@ -1,14 +1,136 @@
-from rest_framework import viewsets
-from .models import Product, Category
-from .serializers import ProductSerializer, CategorySerializer
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from . import facets, ledger
+from .models import Product, Category, StockMovement
+from .serializers import ProductSerializer, CategorySerializer, StockMovementSerializer
+from .conditional import ConditionalGetMixin
+from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    # category_name is part of the representation
+    validator_fields = ('updated_at', 'category__updated_at')
 
-class CategoryViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        ledger.attribute(serializer.instance, StockMovement.ADJUSTMENT, user=self.request.user)
+        serializer.save()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = facets.filter_products(queryset, facets.parse_filters(self.request.query_params))
+        return queryset
+
+    @action(detail=False, url_path='facets')
+    def facet_counts(self, request):
+        """Facet counts for ?category=&price=&in_stock= from the precomputed cube"""
+        filters = facets.parse_filters(request.query_params)
+        counts = facets.facet_counts(filters)
+        return Response({
+            'filters': filters,
+            'total': counts['total'],
+            'categories': [
+                {'id': category_id, 'count': count}
+                for category_id, count in sorted(counts['categories'].items())
+            ],
+            'prices': counts['prices'],
+            'in_stock': counts['in_stock'],
+        })
+
+    @action(detail=False, methods=['patch'], url_path='stock', permission_classes=[IsAdminUser])
+    def bulk_stock(self, request):
+        """
+        Set the stock of many products at once from a list of
+        ``{"id", "stock_quantity", "original_stock"}``. The rows are
+        validated together and applied in one transaction only if all of
+        them are valid. A row whose ``original_stock`` (optional) is no
+        longer the product's stock, because it sold since it was read, is
+        not applied but reported as a conflict with the current figure.
+        The response has one result per row, in order.
+        """
+        rows = request.data
+        if not isinstance(rows, list) or not 0 < len(rows) <= ledger.STOCK_BATCH_LIMIT:
+            return Response(
+                {'detail': f'Expected a list of 1 to {ledger.STOCK_BATCH_LIMIT} {{"id", "stock_quantity"}} objects.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        entries = [
+            (row.get('id'), row.get('stock_quantity'), row.get('original_stock'))
+            if isinstance(row, dict) else (None, None, None)
+            for row in rows
+        ]
+        levels, expected, errors = ledger.validate_levels(entries)
+        if any(errors):
+            return Response({'updated': 0, 'conflicts': 0, 'results': [
+                {'index': index, 'id': product_id, 'success': error is None, 'error': error}
+                for index, ((product_id, _, _), error) in enumerate(zip(entries, errors))
+            ]}, status=status.HTTP_400_BAD_REQUEST)
+
+        changes, conflicts = ledger.set_stock(levels, user=request.user, expected=expected)
+        results = []
+        for index, (product_id, _, _) in enumerate(entries):
+            product_id = int(product_id)
+            if product_id in conflicts:
+                results.append({
+                    'index': index, 'id': product_id, 'success': False, 'conflict': True,
+                    'stock_quantity': conflicts[product_id],
+                    'error': f'Stock changed to {conflicts[product_id]} since it was read.',
+                })
+            else:
+                results.append({
+                    'index': index, 'id': product_id, 'success': True,
+                    'old_stock': changes[product_id][0], 'stock_quantity': changes[product_id][1],
+                })
+        return Response({
+            'updated': sum(1 for old, new in changes.values() if old != new),
+            'conflicts': len(conflicts),
+            'results': results,
+        })
+
+    @action(detail=True, methods=['get', 'post'], url_path='stock', permission_classes=[IsAdminUser])
+    def stock(self, request, pk=None):
+        """
+        The product's stock ledger: current figures and the latest
+        movements, plus the stock at ``?at=`` (ISO datetime). POST
+        ``{"quantity", "note"}`` appends a goods receipt without locking
+        the product; it reaches stock_quantity once apply_stock_movements runs.
+        """
+        product = self.get_object()
+        if request.method == 'POST':
+            quantity = request.data.get('quantity')
+            if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+                return Response({'quantity': ['Expected a positive integer.']}, status=status.HTTP_400_BAD_REQUEST)
+            movement = ledger.receive(
+                product.pk, quantity, user=request.user, note=str(request.data.get('note', ''))[:200]
+            )
+            return Response(StockMovementSerializer(movement).data, status=status.HTTP_202_ACCEPTED)
+
+        data = {
+            'product': product.pk,
+            'stock_quantity': product.stock_quantity,
+            'ledger_stock': ledger.ledger_stock([product.pk]).get(product.pk, 0),
+        }
+        if request.query_params.get('at'):
+            try:
+                at = parse_datetime(request.query_params['at'])
+            except ValueError:
+                at = None
+            if at is None:
+                return Response({'at': ['Expected an ISO 8601 datetime.']}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+            data['at'] = at
+            data['stock_at'] = ledger.stock_as_of([product.pk], at).get(product.pk, 0)
+        movements = product.stock_movements.select_related('user').order_by('-pk')[:50]
+        data['movements'] = StockMovementSerializer(movements, many=True).data
+        return Response(data)
+
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'inventory'
\ No newline at end of file
+    name = 'inventory'
+
+    def ready(self):
+        from . import signals  # noqa: F401
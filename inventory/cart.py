@@ -0,0 +1,482 @@
+"""
+Shopping cart.
+
+A cart is a mapping of product id (str) to quantity kept by one of the
+storage backends below, chosen with the ``CART_STORAGE`` setting:
+
+``SessionCartStorage``
+    The cart dict in the session; every change rewrites the session row.
+``CookieCartStorage``
+    A signed, compact ``id:qty,id:qty`` cookie; no database writes at all.
+``DatabaseCartStorage``
+    One ``CartLine`` row per product, keyed by user or by an anonymous
+    cart id cookie; a click updates a single row by a relative delta.
+
+``CartMiddleware`` attaches a ``CartService`` as ``request.cart``. Badge
+counts come straight from the stored mapping, and ``lines`` resolves the
+whole cart with a single ``in_bulk`` query, working out subtotals, stock
+issues and products that no longer exist in the same pass. Changes to the
+cart keep its stock reservations (inventory.reservations) in step.
+"""
+import secrets
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from . import reservations
+from .models import CartLine, Product
+
+SESSION_KEY = "cart"
+COOKIE_NAME = "cart"
+CART_ID_COOKIE = "cart_id"
+COOKIE_SALT = "inventory.cart"
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+
+
+def _set_cart_id_cookie(response, cart_id):
+    response.set_cookie(
+        CART_ID_COOKIE,
+        cart_id,
+        max_age=COOKIE_MAX_AGE,
+        httponly=True,
+        samesite="Lax",
+        secure=settings.SESSION_COOKIE_SECURE,
+    )
+
+
+class SessionCartStorage:
+    def __init__(self, request):
+        self.request = request
+
+    def load(self):
+        return dict(self.request.session.get(SESSION_KEY, {}))
+
+    def _save(self, items):
+        self.request.session[SESSION_KEY] = items
+        self.request.session.modified = True
+
+    def add(self, product_id, delta):
+        items = self.load()
+        quantity = items.get(product_id, 0) + delta
+        if quantity > 0:
+            items[product_id] = quantity
+        else:
+            items.pop(product_id, None)
+        self._save(items)
+
+    def remove(self, product_ids):
+        items = self.load()
+        for product_id in product_ids:
+            items.pop(product_id, None)
+        self._save(items)
+
+    def clear(self):
+        self._save({})
+
+    def owner_key(self, create=False):
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        session = self.request.session
+        if session.session_key is None:
+            if not create:
+                return None
+            session.save()
+        return f"session:{session.session_key}"
+
+    def commit(self, response):
+        pass
+
+
+class CookieCartStorage:
+    def __init__(self, request):
+        self.request = request
+        self.items = None
+        self.changed = False
+        self.new_cart_id = None
+
+    def owner_key(self, create=False):
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        cart_id = self.new_cart_id or self.request.COOKIES.get(CART_ID_COOKIE)
+        if cart_id is None and create:
+            cart_id = self.new_cart_id = secrets.token_urlsafe(24)
+        return f"anon:{cart_id}" if cart_id else None
+
+    def load(self):
+        if self.items is None:
+            self.items = {}
+            value = self.request.get_signed_cookie(
+                COOKIE_NAME, default="", salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE
+            )
+            for entry in value.split(","):
+                product_id, _, quantity = entry.partition(":")
+                if product_id.isdigit() and quantity.isdigit() and int(quantity) > 0:
+                    self.items[product_id] = int(quantity)
+        return dict(self.items)
+
+    def add(self, product_id, delta):
+        self.load()
+        quantity = self.items.get(product_id, 0) + delta
+        if quantity > 0:
+            self.items[product_id] = quantity
+        else:
+            self.items.pop(product_id, None)
+        self.changed = True
+
+    def remove(self, product_ids):
+        self.load()
+        for product_id in product_ids:
+            self.items.pop(product_id, None)
+        self.changed = True
+
+    def clear(self):
+        self.items = {}
+        self.changed = True
+
+    def commit(self, response):
+        if self.new_cart_id:
+            _set_cart_id_cookie(response, self.new_cart_id)
+        if not self.changed:
+            return
+        if self.items:
+            value = ",".join(f"{product_id}:{quantity}" for product_id, quantity in self.items.items())
+            response.set_signed_cookie(
+                COOKIE_NAME,
+                value,
+                salt=COOKIE_SALT,
+                max_age=COOKIE_MAX_AGE,
+                httponly=True,
+                samesite="Lax",
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        else:
+            response.delete_cookie(COOKIE_NAME, samesite="Lax")
+
+
+class DatabaseCartStorage:
+    def __init__(self, request):
+        self.request = request
+        self.new_cart_id = None
+        self.drop_cart_id = False
+        self._cart_key = None
+
+    def _cart_key_or_none(self, create=False):
+        if self._cart_key is not None:
+            return self._cart_key
+        cart_id = self.request.COOKIES.get(CART_ID_COOKIE)
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            self._cart_key = f"user:{user.pk}"
+            if cart_id:
+                self._merge(f"anon:{cart_id}", self._cart_key)
+                self.drop_cart_id = True
+        elif cart_id:
+            self._cart_key = f"anon:{cart_id}"
+        elif create:
+            self.new_cart_id = secrets.token_urlsafe(24)
+            self._cart_key = f"anon:{self.new_cart_id}"
+        return self._cart_key
+
+    def _lines(self):
+        return CartLine.objects.filter(cart_key=self._cart_key_or_none())
+
+    def _merge(self, source_key, target_key):
+        """Fold a visitor's cart into their account's cart after logging in"""
+        with transaction.atomic():
+            for line in CartLine.objects.filter(cart_key=source_key):
+                updated = CartLine.objects.filter(
+                    cart_key=target_key, product_id=line.product_id
+                ).update(quantity=F("quantity") + line.quantity)
+                if not updated:
+                    CartLine.objects.create(
+                        cart_key=target_key, product_id=line.product_id, quantity=line.quantity
+                    )
+            CartLine.objects.filter(cart_key=source_key).delete()
+        # The account's cart places its own holds the next time it's used
+        reservations.release(source_key)
+
+    def load(self):
+        # Carts kept in the session before switching to this backend
+        legacy = self.request.session.pop(SESSION_KEY, None)
+        if legacy:
+            existing = Product.objects.filter(
+                pk__in=[product_id for product_id in legacy if str(product_id).isdigit()]
+            ).values_list("pk", flat=True)
+            for product_id in existing:
+                self.add(str(product_id), legacy[str(product_id)])
+        if self._cart_key_or_none() is None:
+            return {}
+        return {
+            str(product_id): quantity
+            for product_id, quantity in self._lines().values_list("product_id", "quantity")
+        }
+
+    def add(self, product_id, delta):
+        lines = CartLine.objects.filter(cart_key=self._cart_key_or_none(create=True), product_id=product_id)
+        if delta < 0:
+            lines.filter(quantity__lte=-delta).delete()
+        if lines.update(quantity=F("quantity") + delta) or delta <= 0:
+            return
+        try:
+            with transaction.atomic():
+                CartLine.objects.create(cart_key=self._cart_key, product_id=product_id, quantity=delta)
+        except IntegrityError:
+            # Added concurrently (double click); apply the delta to that line
+            lines.update(quantity=F("quantity") + delta)
+
+    def remove(self, product_ids):
+        if self._cart_key_or_none() is not None:
+            self._lines().filter(product_id__in=product_ids).delete()
+
+    def clear(self):
+        if self._cart_key_or_none() is not None:
+            self._lines().delete()
+
+    def owner_key(self, create=False):
+        return self._cart_key_or_none(create=create)
+
+    def commit(self, response):
+        if self.new_cart_id:
+            _set_cart_id_cookie(response, self.new_cart_id)
+        elif self.drop_cart_id:
+            response.delete_cookie(CART_ID_COOKIE, samesite="Lax")
+
+
+def get_storage_class():
+    return import_string(getattr(settings, "CART_STORAGE", "inventory.cart.SessionCartStorage"))
+
+
+class CartService:
+    def __init__(self, storage):
+        self.storage = storage
+        self._items = None
+        self._lines = None
+        self._removed_ids = []
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._items = self.storage.load()
+        return self._items
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, product_id):
+        return str(product_id) in self.items
+
+    @property
+    def line_count(self):
+        return len(self.items)
+
+    @property
+    def item_count(self):
+        return sum(self.items.values())
+
+    def quantity(self, product_id):
+        return self.items.get(str(product_id), 0)
+
+    @property
+    def holder(self):
+        """Key this cart's stock reservations are held under"""
+        return self.storage.owner_key(create=True)
+
+    # Resolution
+
+    def _resolve(self):
+        # Available stock discounts other carts' holds, not this one's
+        products = reservations.with_available(
+            Product.objects.all(), self.storage.owner_key()
+        ).in_bulk([int(product_id) for product_id in self.items if str(product_id).isdigit()])
+        lines = []
+        removed_ids = []
+        for product_id, quantity in self.items.items():
+            product = products.get(int(product_id)) if str(product_id).isdigit() else None
+            if product is None:
+                removed_ids.append(product_id)
+                continue
+            available_stock = max(product.stock_quantity - product.held_quantity, 0)
+            lines.append(
+                {
+                    "product": product,
+                    "quantity": quantity,
+                    "available_stock": available_stock,
+                    "subtotal": product.price * min(quantity, available_stock),
+                    "has_stock_issue": quantity > available_stock,
+                }
+            )
+        self._lines = lines
+        self._removed_ids = removed_ids
+
+    @property
+    def lines(self):
+        """Cart lines with their products, loaded in one query"""
+        if self._lines is None:
+            self._resolve()
+        return self._lines
+
+    @property
+    def removed_ids(self):
+        """Ids in the cart whose products no longer exist"""
+        if self._lines is None:
+            self._resolve()
+        return self._removed_ids
+
+    @property
+    def stock_issues(self):
+        return [line for line in self.lines if line["has_stock_issue"]]
+
+    @property
+    def has_stock_issues(self):
+        return bool(self.stock_issues)
+
+    @property
+    def total_price(self):
+        return sum((line["subtotal"] for line in self.lines), Decimal("0"))
+
+    def prune(self):
+        """Drop products that no longer exist; returns their ids"""
+        removed = list(self.removed_ids)
+        if removed:
+            self.storage.remove(removed)
+            self._changed()
+        return removed
+
+    def reserve(self):
+        """Renew the holds on everything in the cart"""
+        if self.items:
+            reservations.hold(self.holder, self.items)
+            self._lines = None
+
+    # Changes
+
+    def _changed(self):
+        self._items = None
+        self._lines = None
+
+    def add(self, product, quantity=1):
+        """
+        Add ``quantity`` of ``product`` and hold the stock for it, unless
+        that would exceed what other carts leave available.
+        Returns ``(success, message)``.
+        """
+        current = self.quantity(product.pk)
+        wanted = current + quantity
+        available = reservations.hold(self.holder, {product.pk: wanted}).get(product.pk, 0)
+        if wanted > available:
+            if quantity > 1:
+                # Don't keep a partial hold for a refused add
+                reservations.hold(self.holder, {product.pk: current})
+            return (
+                False,
+                f"Only {available} items available in stock. Cannot add more.",
+            )
+        self.storage.add(str(product.pk), quantity)
+        self._changed()
+        return True, "Item added to cart"
+
+    def decrease(self, product_id, quantity=1):
+        current = self.quantity(product_id)
+        if not current:
+            return False
+        self.storage.add(str(product_id), -quantity)
+        reservations.hold(self.holder, {product_id: max(current - quantity, 0)})
+        self._changed()
+        return True
+
+    def remove(self, product_id):
+        if str(product_id) not in self:
+            return False
+        self.storage.remove([str(product_id)])
+        reservations.release(self.holder, [product_id])
+        self._changed()
+        return True
+
+    def clear(self):
+        self.storage.clear()
+        holder = self.storage.owner_key()
+        if holder:
+            reservations.release(holder)
+        self._changed()
+
+    def apply(self, operations):
+        """
+        Apply a batch of ``{"product_id", "quantity" | "delta"}`` operations.
+        Operations on the same product are folded together first, holds for
+        every product are placed in one locked pass, and each product's line
+        is written once. Quantities over what's available are capped.
+        Returns one result dict per product touched.
+        """
+        targets = {}
+        for operation in operations:
+            product_id = str(operation["product_id"])
+            current = targets.get(product_id, self.quantity(product_id))
+            if operation.get("quantity") is not None:
+                targets[product_id] = operation["quantity"]
+            else:
+                targets[product_id] = current + operation.get("delta", 0)
+
+        available = reservations.hold(
+            self.holder, {product_id: max(target, 0) for product_id, target in targets.items()}
+        )
+        results = []
+        for product_id, target in targets.items():
+            current = self.quantity(product_id)
+            if int(product_id) not in available:
+                if current:
+                    self.storage.remove([product_id])
+                results.append(
+                    {
+                        "product_id": int(product_id),
+                        "success": False,
+                        "message": "This product no longer exists.",
+                        "quantity": 0,
+                        "stock_quantity": 0,
+                    }
+                )
+                continue
+
+            limit = available[int(product_id)]
+            quantity = min(max(target, 0), limit)
+            if quantity != current:
+                self.storage.add(product_id, quantity - current)
+            success = quantity == max(target, 0)
+            results.append(
+                {
+                    "product_id": int(product_id),
+                    "success": success,
+                    "message": "Cart updated"
+                    if success
+                    else f"Only {limit} items available in stock. Cannot add more.",
+                    "quantity": quantity,
+                    "stock_quantity": limit,
+                }
+            )
+        self._changed()
+        return results
+
+    def as_json(self):
+        """Badge counts for AJAX responses"""
+        return {"cart_count": self.line_count, "cart_items": self.item_count}
+
+
+class CartMiddleware:
+    """Attach ``request.cart``; must come after the auth middleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.storage_class = get_storage_class()
+
+    def __call__(self, request):
+        request.cart = CartService(self.storage_class(request))
+        response = self.get_response(request)
+        request.cart.storage.commit(response)
+        return response
@@ -0,0 +1,134 @@
+"""
+Conditional GET support (ETag / Last-Modified).
+
+Validators come from a single aggregate over the rows a response is built
+from: the row count plus the newest ``updated_at``. Any insert, delete or
+save changes one of the two, so a client holding a matching ETag can be
+answered with 304 before anything is rendered or serialized.
+"""
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def aggregate_validators(queryset, fields=('updated_at',)):
+    """(row count, newest timestamp) over ``queryset`` in one query"""
+    aggregates = {f'newest_{position}': Max(field) for position, field in enumerate(fields)}
+    stats = queryset.order_by().aggregate(row_count=Count('pk'), **aggregates)
+    row_count = stats.pop('row_count')
+    stamps = [stamp for stamp in stats.values() if stamp is not None]
+    return row_count, max(stamps) if stamps else None
+
+
+def build_validators(stats, variant):
+    """
+    Turn aggregate stats into an (ETag, Last-Modified timestamp) pair.
+    ``variant`` holds everything else the representation depends on.
+    """
+    parts = [str(part) for part in variant]
+    last_modified = None
+    for row_count, newest in stats:
+        parts.append(f'{row_count}:{newest.isoformat() if newest else "-"}')
+        if newest and (last_modified is None or newest > last_modified):
+            last_modified = newest
+    etag = '"%s"' % hashlib.md5('|'.join(parts).encode()).hexdigest()
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+    return etag, timestamp
+
+
+def not_modified_response(request, etag, last_modified):
+    """A 304 response if the request's validators still match, otherwise None"""
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified, private=False):
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    # Let clients keep the copy but always ask before reusing it
+    patch_cache_control(response, no_cache=True, private=private)
+    return response
+
+
+def conditional_storefront_page(get_querysets):
+    """
+    Decorate a storefront view with ETag/Last-Modified handling.
+
+    ``get_querysets(request, *args, **kwargs)`` returns a list of
+    ``(queryset, timestamp_fields)`` pairs describing the data on the page.
+    The user and their cart are folded into the ETag since the header and
+    cart buttons depend on them.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or len(get_messages(request)) > 0:
+                return view(request, *args, **kwargs)
+
+            variant = (
+                request.get_full_path(),
+                request.headers.get('X-Requested-With', ''),
+                request.user.pk or '',
+                sorted(request.cart.items.items()),
+            )
+            stats = [
+                aggregate_validators(queryset, fields)
+                for queryset, fields in get_querysets(request, *args, **kwargs)
+            ]
+            etag, last_modified = build_validators(stats, variant)
+
+            response = not_modified_response(request, etag, last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                set_validators(response, etag, last_modified, private=request.user.is_authenticated)
+            return response
+
+        return wrapped
+
+    return decorator
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin answering ``list`` and ``retrieve`` with 304 Not Modified
+    when the client's ETag or Last-Modified still matches.
+    """
+    validator_fields = ('updated_at',)
+
+    def _validators(self, request, queryset):
+        variant = (
+            request.get_full_path(),
+            request.headers.get('Accept', ''),
+            request.user.pk or '',
+        )
+        stats = aggregate_validators(queryset, self.validator_fields)
+        etag, last_modified = build_validators([stats], variant)
+        return stats[0], etag, last_modified
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        _, etag, last_modified = self._validators(request, queryset)
+        response = not_modified_response(request, etag, last_modified)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified, private=True)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: kwargs[lookup_url_kwarg]}
+        )
+        row_count, etag, last_modified = self._validators(request, queryset)
+        if not row_count:
+            # Let the normal lookup raise the 404
+            return super().retrieve(request, *args, **kwargs)
+        response = not_modified_response(request, etag, last_modified)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified, private=True)
@@ -0,0 +1,3 @@
+def cart(request):
+    """Expose the cart as ``cart_summary`` for the header badge"""
+    return {"cart_summary": getattr(request, "cart", None)}
@@ -0,0 +1,80 @@
+"""
+Denormalized per-category product counters.
+
+``Category.product_count``, ``in_stock_count`` and ``out_of_stock_count``
+are adjusted with relative ``F()`` updates whenever a product is created,
+deleted, moved to another category or crosses zero stock, so category
+listings never have to join or count products.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import page_cache
+from .models import Category, Product
+
+
+def _stock_counter(stock_quantity):
+    return 'in_stock_count' if stock_quantity > 0 else 'out_of_stock_count'
+
+
+def apply_product_change(old_category_id, old_stock, new_category_id, new_stock):
+    """
+    Move one product's contribution from (old category, old stock) to
+    (new category, new stock). Pass ``None`` as the category for a product
+    that didn't exist before or doesn't exist any more.
+    """
+    deltas = defaultdict(Counter)
+    if old_category_id is not None:
+        deltas[old_category_id]['product_count'] -= 1
+        deltas[old_category_id][_stock_counter(old_stock)] -= 1
+    if new_category_id is not None:
+        deltas[new_category_id]['product_count'] += 1
+        deltas[new_category_id][_stock_counter(new_stock)] += 1
+
+    changed = False
+    for category_id, counter in deltas.items():
+        updates = {field: F(field) + delta for field, delta in counter.items() if delta}
+        if updates:
+            Category.objects.filter(pk=category_id).update(updated_at=timezone.now(), **updates)
+            changed = True
+    if changed:
+        page_cache.purge('category-counts')
+
+
+def rebuild(category_ids=None):
+    """Recount products for the given categories (all of them by default)"""
+    categories = Category.objects.all()
+    if category_ids is not None:
+        categories = categories.filter(pk__in=category_ids)
+
+    counts = {
+        row['category']: row
+        for row in Product.objects.filter(category__in=categories)
+        .values('category')
+        .annotate(
+            total=Count('pk'),
+            in_stock=Count('pk', filter=Q(stock_quantity__gt=0)),
+        )
+        .order_by()
+    }
+
+    now = timezone.now()
+    changed = []
+    for category in categories:
+        row = counts.get(category.pk, {'total': 0, 'in_stock': 0})
+        values = (row['total'], row['in_stock'], row['total'] - row['in_stock'])
+        if values != (category.product_count, category.in_stock_count, category.out_of_stock_count):
+            category.product_count, category.in_stock_count, category.out_of_stock_count = values
+            category.updated_at = now
+            changed.append(category)
+
+    Category.objects.bulk_update(
+        changed,
+        ['product_count', 'in_stock_count', 'out_of_stock_count', 'updated_at'],
+        batch_size=500,
+    )
+    if changed:
+        page_cache.purge('category-counts')
+    return len(changed)
@@ -0,0 +1,189 @@
+"""
+Faceted catalog navigation.
+
+Product counts per facet value are read from ``FacetCount``, a small cube
+with one row per (category, price bucket, in stock) cell. Each product
+save or delete moves a single unit between two cells, and answering a
+facet request means reading the cube (categories x buckets x 2 rows) and
+summing it in Python, never grouping over the product table.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, F, IntegerField, Q, When
+
+from . import page_cache
+from .models import Category, FacetCount, Product
+
+# (id, label, lower bound inclusive, upper bound exclusive)
+PRICE_BUCKETS = [
+    (0, 'Under $25', None, Decimal('25')),
+    (1, '$25 to $100', Decimal('25'), Decimal('100')),
+    (2, '$100 to $500', Decimal('100'), Decimal('500')),
+    (3, '$500 and over', Decimal('500'), None),
+]
+
+
+def price_bucket(price):
+    for bucket_id, _, lower, upper in PRICE_BUCKETS:
+        if (lower is None or price >= lower) and (upper is None or price < upper):
+            return bucket_id
+    return PRICE_BUCKETS[-1][0]
+
+
+def parse_filters(params):
+    """Read category / price / in_stock filters from GET parameters"""
+    category = params.get('category', '')
+    price = params.get('price', '')
+    return {
+        'category': int(category) if category.isdigit() else None,
+        'price': int(price) if price.isdigit() and int(price) < len(PRICE_BUCKETS) else None,
+        'in_stock': params.get('in_stock') in ('1', 'true', 'on'),
+    }
+
+
+def filter_products(queryset, filters):
+    if filters['category'] is not None:
+        queryset = queryset.filter(category_id=filters['category'])
+    if filters['price'] is not None:
+        _, _, lower, upper = PRICE_BUCKETS[filters['price']]
+        if lower is not None:
+            queryset = queryset.filter(price__gte=lower)
+        if upper is not None:
+            queryset = queryset.filter(price__lt=upper)
+    if filters['in_stock']:
+        queryset = queryset.filter(stock_quantity__gt=0)
+    return queryset
+
+
+def facet_counts(filters):
+    """
+    Counts for every facet value. Each facet is counted with the other
+    facets' filters applied but not its own, so the numbers show what
+    choosing that value would return.
+    """
+    cells = FacetCount.objects.filter(product_count__gt=0).values_list(
+        'category_id', 'price_bucket', 'in_stock', 'product_count'
+    )
+    categories = Counter()
+    prices = Counter()
+    in_stock = 0
+    total = 0
+
+    for category_id, bucket, stocked, count in cells:
+        category_match = filters['category'] is None or category_id == filters['category']
+        price_match = filters['price'] is None or bucket == filters['price']
+        stock_match = not filters['in_stock'] or stocked
+
+        if price_match and stock_match:
+            categories[category_id] += count
+        if category_match and stock_match:
+            prices[bucket] += count
+        if category_match and price_match:
+            in_stock += count if stocked else 0
+            if stock_match:
+                total += count
+
+    return {
+        'categories': categories,
+        'prices': [
+            {'id': bucket_id, 'label': label, 'count': prices[bucket_id]}
+            for bucket_id, label, _, _ in PRICE_BUCKETS
+        ],
+        'in_stock': in_stock,
+        'total': total,
+    }
+
+
+def _cell(category_id, price, stock_quantity):
+    return (category_id, price_bucket(Decimal(str(price))), stock_quantity > 0)
+
+
+def _adjust(cell, delta):
+    category_id, bucket, stocked = cell
+    cells = FacetCount.objects.filter(category_id=category_id, price_bucket=bucket, in_stock=stocked)
+    if cells.update(product_count=F('product_count') + delta) or delta < 0:
+        # A decrement never creates a cell: a missing one means the cube is
+        # being rebuilt or the category deleted (its cells cascade first)
+        return
+    try:
+        with transaction.atomic():
+            FacetCount.objects.create(
+                category_id=category_id, price_bucket=bucket, in_stock=stocked, product_count=delta
+            )
+    except IntegrityError:
+        # Created concurrently; apply the delta to that row instead
+        cells.update(product_count=F('product_count') + delta)
+
+
+def apply_product_change(old, new):
+    """
+    Move one product from its old (category_id, price, stock) to its new
+    one; ``None`` stands for "no product" on either side.
+    """
+    old_cell = _cell(*old) if old else None
+    new_cell = _cell(*new) if new else None
+    if old_cell == new_cell:
+        return
+    if old_cell:
+        _adjust(old_cell, -1)
+    if new_cell:
+        _adjust(new_cell, 1)
+    page_cache.purge('facets')
+
+
+def rebuild(category_ids=None):
+    """Recompute the cube (or the cells of some categories) in one grouped query"""
+    products = Product.objects.all()
+    cells = FacetCount.objects.all()
+    if category_ids is not None:
+        products = products.filter(category_id__in=category_ids)
+        cells = cells.filter(category_id__in=category_ids)
+
+    bucket = Case(
+        *[
+            When(
+                Q(price__gte=lower) if upper is None else
+                Q(price__lt=upper) if lower is None else
+                Q(price__gte=lower, price__lt=upper),
+                then=bucket_id,
+            )
+            for bucket_id, _, lower, upper in PRICE_BUCKETS
+        ],
+        output_field=IntegerField(),
+    )
+    rows = (
+        products.annotate(
+            bucket=bucket,
+            stocked=ExpressionWrapper(Q(stock_quantity__gt=0), output_field=BooleanField()),
+        )
+        .values('category_id', 'bucket', 'stocked')
+        .annotate(total=Count('pk'))
+        .order_by()
+    )
+
+    with transaction.atomic():
+        cells.delete()
+        FacetCount.objects.bulk_create(
+            [
+                FacetCount(
+                    category_id=row['category_id'],
+                    price_bucket=row['bucket'],
+                    in_stock=row['stocked'],
+                    product_count=row['total'],
+                )
+                for row in rows
+            ],
+            batch_size=1000,
+        )
+    page_cache.purge('facets')
+
+
+def category_options(filters):
+    """Category list for the catalog sidebar with facet counts attached"""
+    counts = facet_counts(filters)
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.facet_count = counts['categories'][category.pk]
+    return categories, counts
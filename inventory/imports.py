@@ -0,0 +1,259 @@
+"""
+Streaming catalog imports (CSV and NDJSON).
+
+Supplier feeds are read one row at a time and upserted by ``sku`` in
+batches: each batch costs one read of the existing rows (locked, so
+concurrent orders can't slip between the read and the write), one
+``bulk_create(update_conflicts=True)`` and one insert of stock ledger
+movements, whatever the batch size. Categories are resolved by name from
+an in-memory map, new ones created on first sight. Memory use stays flat
+however long the feed is.
+
+Columns: ``sku`` (required), ``name``, ``category``, ``price``,
+``stock_quantity`` and ``description``. Only the columns present in the
+file are updated on existing products, so a feed of just ``sku`` and
+``stock_quantity`` is a stock update; new products need a name, category
+and price.
+
+The per-row signal handlers don't run for bulk writes, so counters,
+facets, low-stock flags and (when names or categories changed) the
+search index of the categories touched are rebuilt once at the end.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import alerts, counters, facets, ledger, page_cache, search
+from .models import Category, Product, StockMovement
+
+BATCH_SIZE = 5000
+FORMATS = ('csv', 'ndjson')
+COLUMNS = ('sku', 'name', 'category', 'price', 'stock_quantity', 'description')
+REQUIRED_FOR_NEW = ('name', 'category', 'price')
+# Rejected rows reported back in full; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def read_rows(stream, import_format):
+    """(line number, dict) for every row of an open text stream"""
+    if import_format == 'csv':
+        reader = csv.DictReader(stream)
+        missing = {'sku'} - set(reader.fieldnames or ())
+        if missing:
+            raise ImportFormatError('The CSV header has no sku column.')
+        for row in reader:
+            yield reader.line_num, row
+    elif import_format == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as error:
+                    yield line_number, ImportFormatError(f'Invalid JSON: {error.msg}')
+    else:
+        raise ImportFormatError(f'Unknown format: {import_format}')
+
+
+def _clean(row):
+    """The known, non-empty columns of a row with their values parsed"""
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ImportFormatError('Expected an object.')
+    values = {}
+    for column in COLUMNS:
+        value = row.get(column)
+        if value is None or (isinstance(value, str) and not value.strip() and column != 'description'):
+            continue
+        values[column] = value.strip() if isinstance(value, str) else value
+
+    if not values.get('sku'):
+        raise ImportFormatError('sku is required.')
+    values['sku'] = str(values['sku'])
+    if len(values['sku']) > 64:
+        # Cutting it down could match, and overwrite, a different product
+        raise ImportFormatError('sku must be at most 64 characters.')
+    if 'name' in values:
+        values['name'] = str(values['name'])[:200]
+    if 'category' in values:
+        values['category'] = str(values['category'])[:100]
+    if 'price' in values:
+        try:
+            values['price'] = Decimal(str(values['price'])).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise ImportFormatError(f'Invalid price: {values["price"]}')
+        if values['price'] < 0 or values['price'] >= 10 ** 8:
+            raise ImportFormatError(f'Invalid price: {values["price"]}')
+    if 'stock_quantity' in values:
+        try:
+            values['stock_quantity'] = int(values['stock_quantity'])
+        except (TypeError, ValueError):
+            raise ImportFormatError(f'Invalid stock_quantity: {values["stock_quantity"]}')
+        if values['stock_quantity'] < 0:
+            raise ImportFormatError('stock_quantity must not be negative.')
+    return values
+
+
+class CatalogImport:
+    """
+    One import run. Feed it ``(line number, row)`` pairs with ``run``;
+    ``created``, ``updated``, ``rejected`` and ``errors`` describe the
+    outcome.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.categories = {}
+        for pk, name in Category.objects.order_by('-pk').values_list('pk', 'name'):
+            self.categories[name] = pk
+        self.touched_categories = set()
+        # Only names, descriptions and categories are in the search document
+        self.reindex = False
+        self.created = self.updated = self.rejected = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def processed(self):
+        return self.created + self.updated + self.rejected
+
+    def reject(self, line_number, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+    def run(self, rows):
+        batch = {}
+        for line_number, row in rows:
+            try:
+                values = _clean(row)
+            except ImportFormatError as error:
+                self.reject(line_number, str(error))
+                continue
+            if values['sku'] in batch:
+                # Later rows for the same SKU win, column by column
+                values = {**batch.pop(values['sku'])[1], **values}
+            batch[values['sku']] = (line_number, values)
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = {}
+        if batch:
+            self._import_batch(batch)
+        self._refresh_derived()
+        return self
+
+    def _resolve_categories(self, names):
+        """Create the categories not seen before"""
+        missing = [name for name in names if name not in self.categories]
+        if not missing:
+            return
+        created = Category.objects.bulk_create([Category(name=name) for name in missing])
+        if all(category.pk for category in created):
+            self.categories.update((category.name, category.pk) for category in created)
+            return
+        # Backends that don't return ids from bulk inserts
+        for pk, name in Category.objects.filter(name__in=missing).order_by('-pk').values_list('pk', 'name'):
+            self.categories[name] = pk
+
+    def _import_batch(self, batch):
+        with transaction.atomic():
+            existing = {
+                product.sku: product
+                for product in Product.objects.select_for_update()
+                .filter(sku__in=batch)
+                .order_by('pk')
+                .only('pk', 'sku', 'category_id', 'name', 'price', 'stock_quantity', 'description')
+            }
+            self._resolve_categories({values['category'] for _, values in batch.values() if 'category' in values})
+
+            now = timezone.now()
+            products = []
+            update_fields = {'updated_at'}
+            for sku, (line_number, values) in batch.items():
+                current = existing.get(sku)
+                if current is None:
+                    missing = [column for column in REQUIRED_FOR_NEW if column not in values]
+                    if missing:
+                        self.reject(line_number, f'New product {sku} needs {", ".join(missing)}.')
+                        continue
+                product = Product(
+                    sku=sku,
+                    name=values.get('name', current and current.name),
+                    category_id=(
+                        self.categories[values['category']] if 'category' in values else current.category_id
+                    ),
+                    price=values.get('price', current and current.price),
+                    stock_quantity=values.get('stock_quantity', current.stock_quantity if current else 0),
+                    description=values.get('description', current.description if current else ''),
+                    created_at=now,
+                    updated_at=now,
+                )
+                update_fields.update(
+                    'category' if column == 'category' else column for column in values if column != 'sku'
+                )
+                products.append(product)
+                if current is None or {'name', 'category', 'description'} & values.keys():
+                    self.reindex = True
+            if not products:
+                return
+
+            Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=['sku'],
+                update_fields=sorted(update_fields),
+            )
+            new_skus = [product.sku for product in products if product.sku not in existing]
+            ids = dict(Product.objects.filter(sku__in=new_skus).values_list('sku', 'pk')) if new_skus else {}
+
+            movements = []
+            for product in products:
+                current = existing.get(product.sku)
+                if current is None:
+                    movements.append(StockMovement(
+                        product_id=ids[product.sku], quantity=product.stock_quantity, reason=StockMovement.IMPORT,
+                    ))
+                    self.created += 1
+                else:
+                    movements.append(StockMovement(
+                        product_id=current.pk, quantity=product.stock_quantity - current.stock_quantity,
+                        reason=StockMovement.IMPORT,
+                    ))
+                    self.touched_categories.add(current.category_id)
+                    self.updated += 1
+                self.touched_categories.add(product.category_id)
+            ledger.record(movements)
+
+        if self.progress:
+            self.progress(self)
+
+    def _refresh_derived(self):
+        if not self.touched_categories:
+            return
+        category_ids = sorted(self.touched_categories)
+        counters.rebuild(category_ids)
+        facets.rebuild(category_ids)
+        alerts.refresh(category_ids=category_ids)
+        if self.reindex:
+            for category in Category.objects.filter(pk__in=category_ids):
+                search.index_products(category)
+        page_cache.purge('catalog', 'categories', *[f'category:{pk}' for pk in category_ids])
+
+    @property
+    def rate(self):
+        """Rows per second so far"""
+        return self.processed / max(time.monotonic() - self.started, 1e-6)
+
+
+def import_catalog(rows, batch_size=BATCH_SIZE, progress=None):
+    """Upsert ``(line number, row)`` pairs into the catalog; returns the CatalogImport"""
+    return CatalogImport(batch_size, progress).run(rows)
@@ -0,0 +1,365 @@
+"""
+Append-only stock ledger.
+
+Every stock change is a ``StockMovement`` row: a signed quantity, a
+reason and, where there is one, the order and the user behind it.
+``compact`` periodically folds the movements into a ``StockSnapshot`` per
+product, so a product's stock is always its latest snapshot plus the
+short tail of movements after it, and the stock on any past date is the
+snapshot taken before it plus the movements up to it. Neither needs to
+read the whole history.
+
+``Product.stock_quantity`` stays the figure everything else reads; it is
+a cache of the ledger, written in the same transaction as the movement.
+Changes made with ``save()`` are recorded by a post_save receiver (call
+``attribute`` first to give them a reason and a user); bulk
+``update()`` paths (orders.services) record their own movements.
+
+Writers that only add stock (goods receipts) can ``receive`` instead:
+that appends an unapplied movement without locking the product row, and
+``apply_pending`` later moves all pending quantities into the cache with
+one UPDATE per batch.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import signals
+from .models import Product, StockMovement, StockSnapshot
+
+APPLY_BATCH_SIZE = 1000
+# Most products one set_stock call may change
+STOCK_BATCH_LIMIT = 5000
+# Products written per conditional UPDATE of set_stock
+STOCK_UPDATE_BATCH_SIZE = 1000
+COMPACT_BATCH_SIZE = 1000
+# Movements younger than this are left out of new snapshots, so a
+# transaction that committed late with a lower id isn't skipped
+SNAPSHOT_LAG = timedelta(minutes=5)
+
+
+def attribute(product, reason, user=None, order_id=None, note=''):
+    """Reason (and user/order) recorded for the stock change of the product's next save()"""
+    product._stock_movement = {'reason': reason, 'user': user, 'order_id': order_id, 'note': note}
+
+
+def record(movements):
+    """Append movements, leaving out those that don't change anything"""
+    movements = [movement for movement in movements if movement.quantity]
+    if movements:
+        StockMovement.objects.bulk_create(movements)
+    return movements
+
+
+def _tail(when=None, upto=None):
+    """Subquery: sum of the product's movements after its snapshot cut"""
+    movements = StockMovement.objects.filter(product=OuterRef('pk'), pk__gt=OuterRef('snapshot_cut'))
+    if when is not None:
+        movements = movements.filter(created_at__lte=when)
+    if upto is not None:
+        movements = movements.filter(pk__lte=upto)
+    return Subquery(
+        movements.order_by().values('product').annotate(total=Sum('quantity')).values('total'),
+        output_field=IntegerField(),
+    )
+
+
+def with_ledger_stock(queryset, when=None, upto=None):
+    """
+    Annotate products with ``ledger_stock``: their latest snapshot plus
+    the movements after it. ``when`` gives the stock as of that moment;
+    ``upto`` only counts movements up to that id. ``tail_quantity`` is
+    None for products with no movements past their snapshot.
+    """
+    snapshots = StockSnapshot.objects.filter(product=OuterRef('pk'))
+    if when is not None:
+        snapshots = snapshots.filter(taken_at__lte=when)
+    if upto is not None:
+        snapshots = snapshots.filter(last_movement_id__lte=upto)
+    latest = snapshots.order_by('-taken_at', '-last_movement_id')
+    return queryset.annotate(
+        snapshot_cut=Coalesce(Subquery(latest.values('last_movement_id')[:1]), Value(0)),
+        snapshot_quantity=Coalesce(
+            Subquery(latest.values('quantity')[:1]), Value(0), output_field=IntegerField()
+        ),
+    ).annotate(
+        tail_quantity=_tail(when, upto),
+    ).annotate(
+        ledger_stock=F('snapshot_quantity') + Coalesce(F('tail_quantity'), Value(0)),
+    )
+
+
+def ledger_stock(product_ids):
+    """{product id: stock according to the ledger, pending receipts included}"""
+    return dict(
+        with_ledger_stock(Product.objects.filter(pk__in=product_ids)).values_list('pk', 'ledger_stock')
+    )
+
+
+def stock_as_of(product_ids, when):
+    """{product id: stock at ``when``}"""
+    return dict(
+        with_ledger_stock(Product.objects.filter(pk__in=product_ids), when=when)
+        .values_list('pk', 'ledger_stock')
+    )
+
+
+def record_saved(product, created):
+    """Record the stock change of a product saved with save()"""
+    context = product.__dict__.pop('_stock_movement', None) or {}
+    reason = context.pop('reason', StockMovement.INITIAL if created else StockMovement.ADJUSTMENT)
+    if created:
+        quantity = product.stock_quantity
+    elif 'stock_quantity' in getattr(product, '_loaded_values', {}):
+        quantity = product.stock_quantity - product.loaded_value('stock_quantity')
+    else:
+        # Saved without being loaded first: make the ledger agree with what was written
+        pending = StockMovement.objects.filter(product=product, applied=False).aggregate(total=Sum('quantity'))
+        quantity = (
+            product.stock_quantity + (pending['total'] or 0) - ledger_stock([product.pk]).get(product.pk, 0)
+        )
+    record([StockMovement(product=product, quantity=quantity, reason=reason, **context)])
+
+
+def _whole_number(value):
+    """``value`` (an int or a string of digits) as an int of at least 0, None otherwise"""
+    if isinstance(value, str):
+        return int(value) if value.strip().isdigit() else None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        return None
+    return value
+
+
+def validate_levels(entries):
+    """
+    Check ``(product id, stock, original stock)`` triples as a whole. The
+    original is the stock the new figure was based on (None to set it
+    regardless). Returns ``({product id: stock}, {product id: original
+    stock}, errors)``; ``errors`` has one entry per triple, None for the
+    good ones, so nothing should be applied unless all are.
+    """
+    errors = [None] * len(entries)
+    levels = {}
+    expected = {}
+    for index, (product_id, stock, original) in enumerate(entries):
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            errors[index] = 'Invalid product id.'
+            continue
+        stock = _whole_number(stock)
+        if stock is None:
+            errors[index] = 'Stock must be a whole number of at least 0.'
+        elif original is not None and _whole_number(original) is None:
+            errors[index] = 'Original stock must be a whole number of at least 0.'
+        elif product_id in levels:
+            errors[index] = f'Product {product_id} is listed more than once.'
+        else:
+            levels[product_id] = stock
+            if original is not None:
+                expected[product_id] = _whole_number(original)
+
+    known = set(Product.objects.filter(pk__in=levels).values_list('pk', flat=True))
+    for index, (product_id, _, _) in enumerate(entries):
+        if errors[index] is None and int(product_id) not in known:
+            errors[index] = f'Product {product_id} not found.'
+    return levels, expected, errors
+
+
+def set_stock(levels, user=None, reason=StockMovement.ADJUSTMENT, expected=None):
+    """
+    Set the stock of many products (``{product id: stock}``) in one
+    transaction: one locking read, one conditional UPDATE per batch and
+    one insert of movements. A product listed in ``expected`` (``{product
+    id: stock the new figure was based on}``) whose stock has moved on
+    since, typically through a sale, is left alone rather than
+    overwritten, as is any row the conditional UPDATE finds changed.
+    Returns ``({product id: (old stock, new stock)},
+    {product id: current stock})``: the products set and the conflicts.
+    """
+    expected = expected or {}
+    with transaction.atomic():
+        products = list(
+            Product.objects.select_for_update(of=('self',))
+            .filter(pk__in=levels)
+            .order_by('pk')
+            .only('pk', 'category_id', 'price', 'stock_quantity')
+        )
+        result = {}
+        conflicts = {}
+        for product in products:
+            if expected.get(product.pk, product.stock_quantity) != product.stock_quantity:
+                conflicts[product.pk] = product.stock_quantity
+            else:
+                result[product.pk] = (product.stock_quantity, levels[product.pk])
+        changed = [
+            product for product in products
+            if product.pk in result and product.stock_quantity != levels[product.pk]
+        ]
+        if not changed:
+            return result, conflicts
+
+        now = timezone.now()
+        for start in range(0, len(changed), STOCK_UPDATE_BATCH_SIZE):
+            batch = changed[start:start + STOCK_UPDATE_BATCH_SIZE]
+            # Each row is only written while it still holds the stock read above
+            unchanged = Q()
+            for product in batch:
+                unchanged |= Q(pk=product.pk, stock_quantity=product.stock_quantity)
+            updated = Product.objects.filter(unchanged).update(
+                stock_quantity=Case(
+                    *[When(pk=product.pk, then=Value(levels[product.pk])) for product in batch],
+                    output_field=IntegerField(),
+                ),
+                updated_at=now,
+            )
+            if updated < len(batch):
+                # Rows the guard skipped are conflicts: no movement, no signal
+                for pk, stock in Product.objects.filter(
+                    pk__in=[product.pk for product in batch]
+                ).values_list('pk', 'stock_quantity'):
+                    if stock != levels[pk]:
+                        del result[pk]
+                        conflicts[pk] = stock
+        changed = [product for product in changed if product.pk in result]
+        record([
+            StockMovement(
+                product_id=product.pk, quantity=levels[product.pk] - product.stock_quantity,
+                reason=reason, user=user,
+            )
+            for product in changed
+        ])
+        signals.stock_changed.send(sender=Product, changes=[
+            signals.StockChange(
+                product.pk, product.category_id, product.price, product.stock_quantity, levels[product.pk],
+            )
+            for product in changed
+        ])
+    return result, conflicts
+
+
+def receive(product_id, quantity, user=None, note=''):
+    """
+    Append a goods receipt without touching the product row. It counts in
+    the ledger at once and reaches ``stock_quantity`` on the next
+    ``apply_pending``.
+    """
+    if quantity <= 0:
+        raise ValueError('Only stock receipts (positive quantities) can be appended.')
+    return StockMovement.objects.create(
+        product_id=product_id, quantity=quantity, reason=StockMovement.RECEIPT,
+        user=user, note=note, applied=False,
+    )
+
+
+def _apply_batch(batch_size):
+    with transaction.atomic():
+        pending = list(
+            StockMovement.objects.select_for_update(skip_locked=True)
+            .filter(applied=False)
+            .order_by('pk')
+            .values_list('pk', 'product_id', 'quantity')[:batch_size]
+        )
+        if not pending:
+            return 0
+        deltas = defaultdict(int)
+        for _, product_id, quantity in pending:
+            deltas[product_id] += quantity
+
+        products = list(
+            Product.objects.select_for_update(of=('self',))
+            .filter(pk__in=deltas)
+            .order_by('pk')
+            .only('pk', 'category_id', 'price', 'stock_quantity')
+        )
+        per_product = Case(
+            *[When(pk=product_id, then=Value(delta)) for product_id, delta in deltas.items()],
+            output_field=IntegerField(),
+        )
+        Product.objects.filter(pk__in=deltas).update(
+            stock_quantity=F('stock_quantity') + per_product, updated_at=timezone.now()
+        )
+        StockMovement.objects.filter(pk__in=[pk for pk, _, _ in pending]).update(applied=True)
+
+        signals.stock_changed.send(sender=Product, changes=[
+            signals.StockChange(
+                product.pk, product.category_id, product.price,
+                product.stock_quantity, product.stock_quantity + deltas[product.pk],
+            )
+            for product in products
+        ])
+    return len(pending)
+
+
+def apply_pending(batch_size=APPLY_BATCH_SIZE):
+    """Add pending receipts to ``stock_quantity``; returns how many movements were applied"""
+    applied = 0
+    while True:
+        count = _apply_batch(batch_size)
+        applied += count
+        if count < batch_size:
+            return applied
+
+
+def compact(batch_size=COMPACT_BATCH_SIZE):
+    """
+    Snapshot every product with movements since its last snapshot, up to
+    the newest movement older than SNAPSHOT_LAG. Returns how many
+    snapshots were written.
+    """
+    horizon = timezone.now() - SNAPSHOT_LAG
+    cut = StockMovement.objects.filter(created_at__lte=horizon).aggregate(cut=Max('pk'))['cut']
+    if cut is None:
+        return 0
+
+    written = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            with_ledger_stock(Product.objects.filter(pk__gt=last_pk), upto=cut)
+            .order_by('pk')
+            .values_list('pk', 'tail_quantity', 'ledger_stock')[:batch_size]
+        )
+        if not batch:
+            return written
+        last_pk = batch[-1][0]
+        snapshots = StockSnapshot.objects.bulk_create([
+            StockSnapshot(product_id=product_id, quantity=stock, last_movement_id=cut, taken_at=horizon)
+            for product_id, tail, stock in batch
+            if tail is not None
+        ])
+        written += len(snapshots)
+
+
+def drift(queryset=None):
+    """
+    {product id: (cached stock, ledger stock)} for products whose
+    ``stock_quantity`` plus pending receipts disagrees with the ledger.
+    """
+    pending = (
+        StockMovement.objects.filter(product=OuterRef('pk'), applied=False)
+        .order_by()
+        .values('product')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    queryset = with_ledger_stock(queryset if queryset is not None else Product.objects.all()).annotate(
+        expected_stock=F('stock_quantity') + Coalesce(Subquery(pending, output_field=IntegerField()), Value(0)),
+    )
+    return {
+        product_id: (expected, stock)
+        for product_id, expected, stock in queryset.exclude(ledger_stock=F('expected_stock'))
+        .values_list('pk', 'expected_stock', 'ledger_stock')
+    }
+
+
+def repair(drifted):
+    """Record corrections bringing the ledger in line with ``drift()`` results"""
+    return record([
+        StockMovement(product_id=product_id, quantity=expected - stock, reason=StockMovement.CORRECTION)
+        for product_id, (expected, stock) in drifted.items()
+    ])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from inventory import ledger
+
+
+class Command(BaseCommand):
+    help = 'Add stock receipts appended to the stock ledger to the products\' stock quantity'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=ledger.APPLY_BATCH_SIZE,
+            help='Movements applied per transaction',
+        )
+
+    def handle(self, *args, **options):
+        applied = ledger.apply_pending(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Applied {applied} stock movements'))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from inventory.models import CartLine
+
+
+class Command(BaseCommand):
+    help = 'Delete stored cart lines that have not been touched for a while'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Age in days after which a cart line is stale')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = CartLine.objects.filter(updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} stale cart lines'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from inventory import ledger
+
+
+class Command(BaseCommand):
+    help = 'Write stock snapshots for products with new stock movements, optionally checking the stock cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=ledger.COMPACT_BATCH_SIZE,
+            help='Products snapshotted per query',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Report products whose stock_quantity disagrees with the ledger',
+        )
+        parser.add_argument(
+            '--repair', action='store_true',
+            help='Record corrections so the ledger matches stock_quantity (implies --check)',
+        )
+
+    def handle(self, *args, **options):
+        if options['check'] or options['repair']:
+            drifted = ledger.drift()
+            for product_id, (expected, stock) in sorted(drifted.items()):
+                self.stdout.write(self.style.WARNING(
+                    f'Product {product_id}: cached {expected}, ledger {stock}'
+                ))
+            if drifted and options['repair']:
+                ledger.repair(drifted)
+                self.stdout.write(self.style.SUCCESS(f'Recorded {len(drifted)} corrections'))
+
+        written = ledger.compact(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} stock snapshots'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from inventory import renditions
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Create the resized WebP/JPEG renditions for product images that have none recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate renditions that already exist',
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only('id', 'category_id', 'image')
+        if not options['force']:
+            products = products.filter(image_renditions={})
+        generated = failed = 0
+
+        for product in products.iterator(chunk_size=500):
+            if renditions.build_renditions(product):
+                generated += 1
+            else:
+                failed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Generated renditions for {generated} images'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} images could not be read'))
@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import imports
+
+
+class Command(BaseCommand):
+    help = 'Upsert categories, products, prices and stock from a CSV or NDJSON feed, keyed by SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='File to read; "-" for standard input')
+        parser.add_argument(
+            '--format', choices=imports.FORMATS,
+            help='Input format (default: from the file extension, csv for standard input)',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=imports.BATCH_SIZE,
+            help='Rows upserted per transaction',
+        )
+
+    def _progress(self, run):
+        self.stderr.write(
+            f'{run.processed} rows ({run.created} created, {run.updated} updated, '
+            f'{run.rejected} rejected), {run.rate:.0f} rows/s'
+        )
+
+    def handle(self, *args, **options):
+        path = options['input']
+        import_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        try:
+            if path == '-':
+                run = imports.import_catalog(
+                    imports.read_rows(sys.stdin, import_format), options['batch_size'], self._progress
+                )
+            else:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    run = imports.import_catalog(
+                        imports.read_rows(stream, import_format), options['batch_size'], self._progress
+                    )
+        except (OSError, imports.ImportFormatError) as error:
+            raise CommandError(error)
+
+        for line_number, message in run.errors:
+            self.stdout.write(self.style.WARNING(f'Line {line_number}: {message}'))
+        if run.rejected > len(run.errors):
+            self.stdout.write(self.style.WARNING(f'... and {run.rejected - len(run.errors)} more rejected rows'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {run.created + run.updated} products ({run.created} created, {run.updated} updated, '
+            f'{run.rejected} rejected) at {run.rate:.0f} rows/s'
+        ))
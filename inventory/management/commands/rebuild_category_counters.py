@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory import counters
+
+
+class Command(BaseCommand):
+    help = 'Recount the per-category product counters'
+
+    def handle(self, *args, **options):
+        changed = counters.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Updated counters for {changed} categories'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from inventory import facets
+from inventory.models import FacetCount
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed catalog facet counts'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {FacetCount.objects.count()} facet cells'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from inventory import search
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index'
+
+    def handle(self, *args, **options):
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Product.objects.count()} products'))
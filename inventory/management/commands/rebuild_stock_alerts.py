@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from inventory import alerts
+
+
+class Command(BaseCommand):
+    help = 'Re-evaluate every product against its reorder threshold'
+
+    def handle(self, *args, **options):
+        changed = alerts.refresh()
+        self.stdout.write(self.style.SUCCESS(
+            f'{changed} products changed state; {alerts.low_stock().count()} are low on stock'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from inventory import reservations
+
+
+class Command(BaseCommand):
+    help = 'Delete stock reservations whose hold has lapsed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=reservations.SWEEP_BATCH_SIZE,
+            help='Reservations deleted per statement',
+        )
+
+    def handle(self, *args, **options):
+        removed = reservations.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {removed} expired reservations'))
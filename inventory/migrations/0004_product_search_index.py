@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-17 06:52
+
+import django.contrib.postgres.search
+from django.db import migrations
+from django.db.models import Value
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    Category = apps.get_model('inventory', 'Category')
+    Product = apps.get_model('inventory', 'Product')
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchVector
+
+        schema_editor.execute(
+            'CREATE INDEX product_search_gin ON inventory_product USING GIN (search_vector)'
+        )
+        for category in Category.objects.all():
+            Product.objects.filter(category=category).update(
+                search_vector=(
+                    SearchVector('name', weight='A', config='english')
+                    + SearchVector(Value(category.name), weight='B', config='english')
+                    + SearchVector('description', weight='C', config='english')
+                )
+            )
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE inventory_product_fts USING fts5('
+            "name, description, category, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            'INSERT INTO inventory_product_fts (rowid, name, description, category) '
+            'SELECT p.id, p.name, p.description, c.name FROM inventory_product p '
+            'JOIN inventory_category c ON c.id = p.category_id'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS product_search_gin')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS inventory_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
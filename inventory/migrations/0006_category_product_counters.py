@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-17 06:57
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_products(apps, schema_editor):
+    Category = apps.get_model('inventory', 'Category')
+    for category in Category.objects.annotate(
+        total=Count('products'),
+        in_stock=Count('products', filter=Q(products__stock_quantity__gt=0)),
+    ):
+        category.product_count = category.total
+        category.in_stock_count = category.in_stock
+        category.out_of_stock_count = category.total - category.in_stock
+        category.save(update_fields=['product_count', 'in_stock_count', 'out_of_stock_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_conditional_get_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='in_stock_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='out_of_stock_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-17 06:58
+
+import django.db.models.deletion
+from collections import Counter
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def fill_facet_counts(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    FacetCount = apps.get_model('inventory', 'FacetCount')
+    bounds = (Decimal('25'), Decimal('100'), Decimal('500'))
+
+    cells = Counter()
+    for category_id, price, stock in Product.objects.values_list('category_id', 'price', 'stock_quantity').iterator():
+        bucket = sum(1 for bound in bounds if price >= bound)
+        cells[(category_id, bucket, stock > 0)] += 1
+
+    FacetCount.objects.bulk_create([
+        FacetCount(category_id=category_id, price_bucket=bucket, in_stock=in_stock, product_count=count)
+        for (category_id, bucket, in_stock), count in cells.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_category_product_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('in_stock', models.BooleanField()),
+                ('product_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='inventory.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'price_bucket', 'in_stock'), name='unique_facet_cell')],
+            },
+        ),
+        migrations.RunPython(fill_facet_counts, migrations.RunPython.noop),
+    ]
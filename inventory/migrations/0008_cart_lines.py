@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 07:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_facet_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_key', models.CharField(max_length=64)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_lines', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='cartline_updated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('cart_key', 'product'), name='unique_cart_line')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-17 07:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def open_ledger(apps, schema_editor):
+    # Existing stock becomes each product's opening snapshot
+    Product = apps.get_model('inventory', 'Product')
+    StockSnapshot = apps.get_model('inventory', 'StockSnapshot')
+    now = timezone.now()
+    StockSnapshot.objects.bulk_create(
+        (
+            StockSnapshot(product_id=product_id, quantity=stock, last_movement_id=0, taken_at=now)
+            for product_id, stock in Product.objects.values_list('pk', 'stock_quantity').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_stock_reservations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('reason', models.CharField(choices=[('initial', 'Initial stock'), ('adjustment', 'Manual adjustment'), ('receipt', 'Goods received'), ('sale', 'Sold'), ('cancellation', 'Order cancelled'), ('reopen', 'Order reopened'), ('order_edit', 'Removed from order'), ('correction', 'Ledger correction')], max_length=20)),
+                ('order_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('applied', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='inventory.product')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='stock_movement_tail_idx'), models.Index(fields=['order_id'], name='stock_movement_order_idx'), models.Index(condition=models.Q(('applied', False)), fields=['id'], name='stock_movement_pending_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('last_movement_id', models.BigIntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-taken_at'], name='stock_snapshot_latest_idx')],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='reason',
+            field=models.CharField(choices=[('initial', 'Initial stock'), ('adjustment', 'Manual adjustment'), ('receipt', 'Goods received'), ('sale', 'Sold'), ('cancellation', 'Order cancelled'), ('reopen', 'Order reopened'), ('order_edit', 'Removed from order'), ('correction', 'Ledger correction'), ('import', 'Catalog import')], max_length=20),
+        ),
+    ]
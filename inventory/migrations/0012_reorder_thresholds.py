@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-17 07:40
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def flag_low_stock(apps, schema_editor):
+    Category = apps.get_model('inventory', 'Category')
+    Product = apps.get_model('inventory', 'Product')
+    Product.objects.alias(
+        threshold=Coalesce(
+            F('reorder_threshold'),
+            Subquery(Category.objects.filter(pk=OuterRef('category_id')).values('reorder_threshold')[:1]),
+        ),
+    ).filter(stock_quantity__lt=F('threshold')).update(is_low_stock=True, low_stock_since=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='reorder_threshold',
+            field=models.PositiveIntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='is_low_stock',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='low_stock_since',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reorder_threshold',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_low_stock', True)), fields=['-low_stock_since', '-id'], name='product_low_stock_idx'),
+        ),
+        migrations.RunPython(flag_low_stock, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,17 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by inventory.counters
+    product_count = models.IntegerField(default=0, editable=False)
+    in_stock_count = models.IntegerField(default=0, editable=False)
+    out_of_stock_count = models.IntegerField(default=0, editable=False)
+    # Products with less stock than this are low on stock, unless they set their own
+    reorder_threshold = models.PositiveIntegerField(default=10)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -14,19 +22,196 @@ class Category(models.Model):
 class Product(models.Model):
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
+    # Supplier / catalog code; the key import_catalog upserts on
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.PositiveIntegerField(default=0)
+    # Overrides the category's reorder threshold when set
+    reorder_threshold = models.PositiveIntegerField(null=True, blank=True)
+    # Maintained by inventory.alerts: stock below the reorder threshold
+    is_low_stock = models.BooleanField(default=False, editable=False)
+    low_stock_since = models.DateTimeField(null=True, blank=True, editable=False)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Maintained by inventory.renditions: {rendition: [width, height]} of the image's renditions
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted tsvector over name/category/description, maintained by inventory.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination indexes for the storefront catalog sort orders
+            models.Index(fields=['-created_at', '-id'], name='product_newest_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_cat_newest_idx'),
+            models.Index(fields=['category', 'name', 'id'], name='product_cat_name_idx'),
+            # Conditional GET validators: max(updated_at) per listing
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+            models.Index(fields=['category', 'updated_at'], name='product_cat_updated_idx'),
+            # The low-stock set read by the alerts feed and the dashboard
+            models.Index(
+                fields=['-low_stock_since', '-id'], condition=models.Q(is_low_stock=True),
+                name='product_low_stock_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
-    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so signal handlers can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
         # Ensure stock_quantity is never negative
         if self.stock_quantity < 0:
             self.stock_quantity = 0
         super().save(*args, **kwargs)
+        self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__:
+                value = self.__dict__[field.attname]
+                # A FieldFile changes along with the instance; keep the stored name
+                self._loaded_values[field.attname] = getattr(value, 'name', value)
+
+    def loaded_value(self, attname):
+        """Value of a field as last loaded from or saved to the database"""
+        return getattr(self, '_loaded_values', {}).get(attname)
+
+class FacetCount(models.Model):
+    """
+    Precomputed catalog facet cube: how many products fall into each
+    (category, price bucket, in stock) cell. Maintained by inventory.facets.
+    """
+    category = models.ForeignKey(Category, related_name='facet_counts', on_delete=models.CASCADE)
+    price_bucket = models.PositiveSmallIntegerField()
+    in_stock = models.BooleanField()
+    product_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'price_bucket', 'in_stock'], name='unique_facet_cell'),
+        ]
+
+    def __str__(self):
+        return f'{self.category_id}/{self.price_bucket}/{self.in_stock}: {self.product_count}'
+
+class CartLine(models.Model):
+    """
+    One product in a stored cart, used by inventory.cart.DatabaseCartStorage.
+    ``cart_key`` is ``user:<id>`` for customers and an anonymous cart id
+    (kept in a cookie) for visitors.
+    """
+    cart_key = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, related_name='cart_lines', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart_key', 'product'], name='unique_cart_line'),
+        ]
+        indexes = [
+            models.Index(fields=['updated_at'], name='cartline_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.cart_key}: {self.quantity} x {self.product_id}'
 
+class StockReservation(models.Model):
+    """
+    A time-limited hold on stock for one cart, maintained by
+    inventory.reservations. Holds past ``expires_at`` no longer count.
+    """
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    holder = models.CharField(max_length=64)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['holder', 'product'], name='unique_reservation_holder'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'expires_at'], name='reservation_active_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.holder}: {self.quantity} x {self.product_id} until {self.expires_at}'
+
+class StockMovement(models.Model):
+    """
+    One entry of the append-only stock ledger (inventory.ledger). A
+    product's stock is its latest StockSnapshot plus the movements after
+    it; ``Product.stock_quantity`` is a cache of that figure. ``order_id``
+    is a plain id so that movements outlive archived orders. Movements
+    with ``applied=False`` were appended without touching the product row
+    and are not in the cache yet.
+    """
+    INITIAL = 'initial'
+    ADJUSTMENT = 'adjustment'
+    RECEIPT = 'receipt'
+    SALE = 'sale'
+    CANCELLATION = 'cancellation'
+    REOPEN = 'reopen'
+    ORDER_EDIT = 'order_edit'
+    CORRECTION = 'correction'
+    IMPORT = 'import'
+    REASON_CHOICES = [
+        (INITIAL, 'Initial stock'),
+        (ADJUSTMENT, 'Manual adjustment'),
+        (RECEIPT, 'Goods received'),
+        (SALE, 'Sold'),
+        (CANCELLATION, 'Order cancelled'),
+        (REOPEN, 'Order reopened'),
+        (ORDER_EDIT, 'Removed from order'),
+        (CORRECTION, 'Ledger correction'),
+        (IMPORT, 'Catalog import'),
+    ]
+
+    product = models.ForeignKey(Product, related_name='stock_movements', on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    order_id = models.PositiveBigIntegerField(null=True, blank=True)
+    user = models.ForeignKey(User, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    note = models.CharField(max_length=200, blank=True)
+    applied = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The tail after a product's latest snapshot
+            models.Index(fields=['product', 'id'], name='stock_movement_tail_idx'),
+            models.Index(fields=['order_id'], name='stock_movement_order_idx'),
+            models.Index(
+                fields=['id'], condition=models.Q(applied=False), name='stock_movement_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.quantity:+d} ({self.reason})'
+
+class StockSnapshot(models.Model):
+    """
+    A product's stock once every movement up to ``last_movement_id`` is
+    counted, written by inventory.ledger.compact.
+    """
+    product = models.ForeignKey(Product, related_name='stock_snapshots', on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    last_movement_id = models.BigIntegerField()
+    taken_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-taken_at'], name='stock_snapshot_latest_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.quantity} at {self.taken_at}'
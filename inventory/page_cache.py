@@ -0,0 +1,128 @@
+"""
+Full-page cache for anonymous storefront traffic.
+
+Views wrapped with ``cache_storefront_page`` tag their response with
+surrogate keys (``catalog``, ``categories``, ``product:<id>``,
+``category:<id>``) via ``tag_response``. Purging a key only records the
+time of the purge; a cached page is served while none of its keys has
+been purged since the page was rendered, so invalidation never needs to
+know which pages carry a key.
+
+The same keys are sent in a ``Surrogate-Key`` header so a CDN in front of
+the site can be purged with the same vocabulary.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'STOREFRONT_CACHE_TIMEOUT', 300)
+# A purge only has to outlive the pages rendered before it; the margin
+# covers pages stored a little after their render started
+PURGE_TIMEOUT = PAGE_CACHE_TIMEOUT + 60
+KEY_PREFIX = 'storefront'
+SURROGATE_KEY_HEADER = 'Surrogate-Key'
+# Validator headers kept with the page so cached hits can still answer 304s
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control')
+
+
+def _cache():
+    return caches[getattr(settings, 'STOREFRONT_CACHE_ALIAS', 'default')]
+
+
+def _page_key(request):
+    variant = request.headers.get('X-Requested-With', '')
+    raw = f'{request.get_host()}|{request.get_full_path()}|{variant}'
+    return f'{KEY_PREFIX}:page:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def _purge_key(surrogate_key):
+    return f'{KEY_PREFIX}:purged:{surrogate_key}'
+
+
+def tag_response(response, *surrogate_keys):
+    """Attach surrogate keys to a response"""
+    existing = response.headers.get(SURROGATE_KEY_HEADER, '').split()
+    response[SURROGATE_KEY_HEADER] = ' '.join(dict.fromkeys(existing + list(surrogate_keys)))
+    return response
+
+
+def purge(*surrogate_keys):
+    """Invalidate every cached page tagged with any of the given keys"""
+    if surrogate_keys:
+        now = time.time()
+        _cache().set_many({_purge_key(key): now for key in surrogate_keys}, timeout=PURGE_TIMEOUT)
+
+
+def is_cacheable_request(request):
+    """Only anonymous visitors with nothing in their cart get shared pages"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    if request.cart:
+        return False
+    return len(get_messages(request)) == 0
+
+
+def _is_cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.session.modified
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        and SURROGATE_KEY_HEADER in response.headers
+    )
+
+
+def _cached_response(request, entry):
+    headers = entry['headers']
+    response = None
+    if 'ETag' in headers:
+        response = get_conditional_response(
+            request,
+            etag=headers['ETag'],
+            last_modified=parse_http_date_safe(headers.get('Last-Modified')),
+        )
+    if response is None:
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    for name, value in headers.items():
+        response[name] = value
+    return tag_response(response, *entry['keys'])
+
+
+def cache_storefront_page(view):
+    """Serve anonymous requests for ``view`` from the page cache"""
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not is_cacheable_request(request):
+            return view(request, *args, **kwargs)
+
+        cache = _cache()
+        page_key = _page_key(request)
+        entry = cache.get(page_key)
+        if entry is not None:
+            purged = cache.get_many([_purge_key(key) for key in entry['keys']])
+            if all(purged_at < entry['rendered_at'] for purged_at in purged.values()):
+                return _cached_response(request, entry)
+
+        rendered_at = time.time()
+        response = view(request, *args, **kwargs)
+        if _is_cacheable_response(request, response):
+            cache.set(page_key, {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'keys': response[SURROGATE_KEY_HEADER].split(),
+                'headers': {name: response[name] for name in CACHED_HEADERS if name in response},
+                'rendered_at': rendered_at,
+            }, PAGE_CACHE_TIMEOUT)
+        return response
+
+    return wrapped
@@ -0,0 +1,124 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor can't be decoded for the current ordering"""
+
+
+class KeysetPage:
+    """One page of results plus the cursors needed to move around it"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Cursor based paginator. Instead of OFFSET it filters on the ordering
+    columns of the last row seen, so every page costs the same index range
+    scan no matter how deep the customer scrolls.
+
+    The ordering must end with a unique column (normally the pk) so that
+    rows sharing the same leading value are never skipped or repeated.
+    """
+
+    def __init__(self, queryset, ordering, per_page=24):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def page(self, cursor=None):
+        """Return the page that starts right after (or ends right before) the cursor"""
+        reverse = False
+        queryset = self.queryset
+
+        if cursor:
+            direction, values = self.decode_cursor(cursor)
+            reverse = direction == 'p'
+            queryset = queryset.filter(self._seek_filter(values, reverse))
+
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+        else:
+            ordering = self.ordering
+
+        # Fetch one extra row to find out whether there is another page
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            has_next = True
+            has_previous = has_more
+        else:
+            has_next = has_more
+            has_previous = bool(cursor)
+
+        next_cursor = self.encode_cursor('n', rows[-1]) if rows and has_next else None
+        previous_cursor = self.encode_cursor('p', rows[0]) if rows and has_previous else None
+        return KeysetPage(rows, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+    def _seek_filter(self, values, reverse):
+        # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), expanded for any
+        # number of columns and mixed directions
+        condition = Q()
+        for position, field in enumerate(self.fields):
+            descending = self.descending[position] != reverse
+            lookup = '%s__%s' % (field, 'lt' if descending else 'gt')
+            term = Q(**{lookup: values[position]})
+            for previous in range(position):
+                term &= Q(**{self.fields[previous]: values[previous]})
+            condition |= term
+        return condition
+
+    def encode_cursor(self, direction, obj):
+        values = []
+        for field in self.fields:
+            value = getattr(obj, field)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = json.dumps([direction] + values, separators=(',', ':'), default=str)
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        except (ValueError, TypeError):
+            raise InvalidCursor(cursor)
+
+        if not isinstance(payload, list) or len(payload) != len(self.fields) + 1 or payload[0] not in ('n', 'p'):
+            raise InvalidCursor(cursor)
+
+        model = self.queryset.model
+        values = []
+        for field_name, raw in zip(self.fields, payload[1:]):
+            field = model._meta.pk if field_name == 'pk' else model._meta.get_field(field_name)
+            try:
+                values.append(field.to_python(raw))
+            except (ValidationError, TypeError, ValueError):
+                # to_python() of date fields only expects strings
+                raise InvalidCursor(cursor)
+        return payload[0], values
@@ -0,0 +1,121 @@
+"""
+Resized copies of product images.
+
+Every uploaded ``Product.image`` gets a fixed set of renditions in WebP and
+JPEG, stored next to the original (``products/shoe.png`` ->
+``products/shoe__card.webp``). They are generated when the image is saved
+and the size of each is recorded on ``Product.image_renditions``, so
+templates build the ``<picture>`` markup without touching storage. Until
+an image's renditions are recorded (images uploaded before this existed,
+or whose generation failed) pages serve the original and the
+``generate_renditions`` command fills them in.
+"""
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import page_cache
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# name -> (width, height, crop). Cropped renditions are cut to exactly that
+# size; the others are scaled down to fit inside the box.
+RENDITIONS = {
+    'thumb': (100, 100, True),
+    'card': (600, 400, True),
+    'detail': (1200, 1200, False),
+}
+
+# extension -> (Pillow format, MIME type)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+
+QUALITY = 80
+
+
+def rendition_name(image_name, rendition, extension):
+    root, _ = posixpath.splitext(image_name)
+    return f'{root}__{rendition}.{extension}'
+
+
+def rendition_url(image, rendition, extension='jpg'):
+    return image.storage.url(rendition_name(image.name, rendition, extension))
+
+
+def renditions_from(rendition):
+    """The given rendition and every larger one, smallest first"""
+    names = sorted(RENDITIONS, key=lambda name: RENDITIONS[name][0])
+    return names[names.index(rendition):]
+
+
+def _encode(picture, pillow_format):
+    buffer = BytesIO()
+    if pillow_format == 'JPEG':
+        picture.save(buffer, pillow_format, quality=QUALITY, optimize=True, progressive=True)
+    else:
+        picture.save(buffer, pillow_format, quality=QUALITY)
+    return buffer.getvalue()
+
+
+def generate_renditions(image):
+    """
+    Write every rendition of ``image``; returns their sizes
+    (``{rendition: [width, height]}``), or None if it can't be decoded.
+    """
+    try:
+        with image.storage.open(image.name, 'rb') as original:
+            source = Image.open(original)
+            source = ImageOps.exif_transpose(source)
+            source.load()
+    except (FileNotFoundError, UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        logger.warning('Could not create renditions for %s', image.name, exc_info=True)
+        return None
+
+    if source.mode != 'RGB':
+        # JPEG has no alpha channel, so flatten transparent images onto white
+        background = Image.new('RGB', source.size, (255, 255, 255))
+        rgba = source.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        source = background
+
+    sizes = {}
+    for rendition, (width, height, crop) in RENDITIONS.items():
+        if crop:
+            picture = ImageOps.fit(source, (width, height), Image.Resampling.LANCZOS)
+        else:
+            picture = source.copy()
+            picture.thumbnail((width, height), Image.Resampling.LANCZOS)
+
+        for extension, (pillow_format, _) in FORMATS.items():
+            name = rendition_name(image.name, rendition, extension)
+            if image.storage.exists(name):
+                image.storage.delete(name)
+            image.storage.save(name, ContentFile(_encode(picture, pillow_format)))
+        sizes[rendition] = list(picture.size)
+    return sizes
+
+
+def build_renditions(product):
+    """Generate the renditions of a product's image and record them on the row"""
+    sizes = (generate_renditions(product.image) if product.image else None) or {}
+    product.image_renditions = sizes
+    # update() so that no save signals run again; updated_at changes the
+    # pages' validators, the purge drops cached copies of the old markup
+    Product.objects.filter(pk=product.pk).update(image_renditions=sizes, updated_at=timezone.now())
+    page_cache.purge('catalog', f'product:{product.pk}', f'category:{product.category_id}')
+    return bool(sizes)
+
+
+def delete_renditions(storage, image_name):
+    for rendition in RENDITIONS:
+        for extension in FORMATS:
+            name = rendition_name(image_name, rendition, extension)
+            if storage.exists(name):
+                storage.delete(name)
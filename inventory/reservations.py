@@ -0,0 +1,129 @@
+"""
+Time-limited stock reservations.
+
+Putting a product in a cart places a hold (``StockReservation``) for the
+cart's quantity that lapses after ``STOCK_RESERVATION_TTL`` seconds unless
+the cart is touched again. What a shopper can still add is the
+available-to-promise figure: stock minus everyone else's live holds.
+
+Holds are placed under a short row lock on the products involved, so two
+carts can't both be promised the last unit. Checkout
+(orders.services.place_order) then only has to turn holds it already owns
+into a stock deduction.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+RESERVATION_TTL = timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60))
+SWEEP_BATCH_SIZE = 1000
+
+
+def active_reservations():
+    return StockReservation.objects.filter(expires_at__gt=timezone.now())
+
+
+def with_available(queryset, holder=None):
+    """
+    Annotate products with ``held_quantity`` (live holds of other carts)
+    and ``available_quantity`` (stock minus those holds).
+    """
+    held = (
+        active_reservations()
+        .filter(product=OuterRef('pk'))
+        .exclude(holder=holder or '')
+        .order_by()
+        .values('product')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    return queryset.annotate(
+        held_quantity=Coalesce(Subquery(held, output_field=IntegerField()), Value(0))
+    )
+
+
+def hold(holder, quantities):
+    """
+    Set the holder's holds to ``{product id: quantity}`` as far as stock
+    allows and push their expiry out. Returns ``{product id: available}``
+    for the products that exist, where available is what this holder can
+    have; the hold placed is the smaller of that and the quantity asked.
+    """
+    quantities = {int(product_id): quantity for product_id, quantity in quantities.items()}
+    expires_at = timezone.now() + RESERVATION_TTL
+    with transaction.atomic():
+        # Lock in pk order so concurrent carts can't deadlock. The lock is
+        # taken on the primary explicitly so that a cart change isn't
+        # treated as a write that pins the visitor to the primary.
+        products = with_available(
+            Product.objects.using(DEFAULT_DB_ALIAS).select_for_update(of=('self',))
+            .filter(pk__in=quantities)
+            .order_by('pk'),
+            holder,
+        )
+        available = {
+            product.pk: max(product.stock_quantity - product.held_quantity, 0)
+            for product in products
+        }
+        existing = {
+            reservation.product_id: reservation
+            for reservation in StockReservation.objects.filter(holder=holder, product_id__in=available)
+        }
+
+        to_create, to_update, to_delete = [], [], []
+        for product_id, limit in available.items():
+            quantity = min(max(quantities[product_id], 0), limit)
+            reservation = existing.get(product_id)
+            if quantity == 0:
+                if reservation:
+                    to_delete.append(reservation.pk)
+            elif reservation:
+                reservation.quantity = quantity
+                reservation.expires_at = expires_at
+                to_update.append(reservation)
+            else:
+                to_create.append(
+                    StockReservation(
+                        product_id=product_id, holder=holder, quantity=quantity, expires_at=expires_at
+                    )
+                )
+
+        StockReservation.objects.filter(pk__in=to_delete).delete()
+        StockReservation.objects.bulk_update(to_update, ['quantity', 'expires_at'])
+        StockReservation.objects.bulk_create(to_create)
+    return available
+
+
+def release(holder, product_ids=None):
+    """Drop the holder's holds (on some products, or all of them)"""
+    reservations = StockReservation.objects.filter(holder=holder)
+    if product_ids is not None:
+        reservations = reservations.filter(product_id__in=product_ids)
+    reservations.delete()
+
+
+def transfer(holder, new_holder):
+    """Hand the holder's live holds to ``new_holder`` with a fresh expiry"""
+    active_reservations().filter(holder=holder).update(
+        holder=new_holder, expires_at=timezone.now() + RESERVATION_TTL
+    )
+
+
+def release_expired(batch_size=SWEEP_BATCH_SIZE):
+    """Delete lapsed holds in batches; returns how many were removed"""
+    removed = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(expires_at__lte=timezone.now())
+            .order_by('expires_at')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return removed
+        removed += StockReservation.objects.filter(pk__in=batch).delete()[0]
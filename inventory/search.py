@@ -0,0 +1,156 @@
+"""
+Full-text product search.
+
+On PostgreSQL every product carries a weighted ``search_vector`` (name,
+category name, description) backed by a GIN index. On SQLite, used for
+local runs and tests, the same columns are mirrored into an FTS5 table.
+Any other backend falls back to plain ``icontains`` matching.
+
+The index is refreshed from the Product/Category signal handlers, so
+callers only ever need ``search_products``.
+"""
+import re
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, router
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from .models import Category, Product
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'inventory_product_fts'
+
+# Upper bound on the products a single query returns, on every backend,
+# counted after the caller's filters
+SEARCH_MAX_RESULTS = 500
+
+# FTS5 bm25() column weights, in table column order: name, description, category
+FTS_WEIGHTS = (10.0, 2.0, 5.0)
+
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def _vector(category_name):
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(Value(category_name), weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def search_products(queryset, query):
+    """
+    Filter ``queryset`` down to products matching ``query`` and order them
+    by relevance. Every word is matched as a prefix, so partially typed
+    words still find results. At most SEARCH_MAX_RESULTS products are
+    returned, the best matches among those ``queryset`` allows.
+    """
+    terms = _terms(query)
+    if not terms:
+        return queryset.none()
+
+    # Read from whichever database the queryset is routed to
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            search_type='raw',
+            config=SEARCH_CONFIG,
+        )
+        rank = SearchRank(F('search_vector'), search_query)
+        best = (
+            queryset.filter(search_vector=search_query)
+            .annotate(search_rank=rank)
+            .order_by('-search_rank', '-id')
+            .values('pk')[:SEARCH_MAX_RESULTS]
+        )
+        # Capped in a subquery so callers can still filter and count the result
+        return queryset.filter(pk__in=best).annotate(search_rank=rank).order_by('-search_rank', '-id')
+
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        # The caller's filters go inside the FTS query, so the limit keeps
+        # the best matches among the products asked for
+        try:
+            scope, scope_params = queryset.order_by().values('pk').query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            return queryset.none()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid IN ({scope}) '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s',
+                [match, *scope_params, SEARCH_MAX_RESULTS],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return queryset.none()
+        # bm25 order is lost by the IN filter, so carry it over as a rank
+        rank = Case(
+            *[When(pk=pk, then=Value(len(ids) - position)) for position, pk in enumerate(ids)],
+            output_field=IntegerField(),
+        )
+        return queryset.filter(pk__in=ids).annotate(search_rank=rank).order_by('-search_rank')
+
+    condition = Q()
+    for term in terms:
+        condition &= (
+            Q(name__icontains=term)
+            | Q(description__icontains=term)
+            | Q(category__name__icontains=term)
+        )
+    # Not every backend allows LIMIT in an IN subquery
+    ids = list(queryset.filter(condition).order_by('-id').values_list('pk', flat=True)[:SEARCH_MAX_RESULTS])
+    return queryset.filter(pk__in=ids).order_by('-id')
+
+
+def _index_connection():
+    """The database product rows (and so their index entries) are written to"""
+    return connections[router.db_for_write(Product)]
+
+
+def index_products(category, product_ids=None):
+    """Refresh the search index for a category's products (or just some of them)"""
+    connection = _index_connection()
+    products = Product.objects.using(connection.alias).filter(category=category)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+
+    if connection.vendor == 'postgresql':
+        products.update(search_vector=_vector(category.name))
+    elif connection.vendor == 'sqlite':
+        rows = products.values_list('pk', 'name', 'description')
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, name, description, category) '
+                f'VALUES (%s, %s, %s, %s)',
+                [(pk, name, description, category.name) for pk, name, description in rows],
+            )
+
+
+def remove_products(product_ids):
+    """Drop deleted products from the FTS5 table (the tsvector goes with the row)"""
+    connection = _index_connection()
+    if connection.vendor == 'sqlite' and product_ids:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(pk,) for pk in product_ids],
+            )
+
+
+def rebuild_index():
+    """Reindex every product, one statement per category"""
+    connection = _index_connection()
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    for category in Category.objects.using(connection.alias):
+        index_products(category)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Product, Category
+from .models import Product, Category, StockMovement
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -11,4 +11,15 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ['id', 'category', 'category_name', 'name', 'description', 'price', 'stock_quantity', 'image', 'created_at', 'updated_at']
+        fields = ['id', 'category', 'category_name', 'name', 'sku', 'description', 'price', 'stock_quantity', 'reorder_threshold', 'is_low_stock', 'image', 'created_at', 'updated_at']
+
+    def validate_sku(self, value):
+        # Blank SKUs are stored as NULL so they don't collide
+        return value or None
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    user = serializers.ReadOnlyField(source='user.username', default=None)
+
+    class Meta:
+        model = StockMovement
+        fields = ['id', 'quantity', 'reason', 'order_id', 'user', 'note', 'applied', 'created_at']
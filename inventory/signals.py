@@ -1 +1,164 @@
-# Signals removed - Customer model no longer exists
+from collections import namedtuple
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from . import alerts, counters, facets, ledger, page_cache, renditions, search
+from .models import Category, Product
+
+# Stock updated with queryset.update(), which sends no post_save. Sent
+# with ``changes``, a list of StockChange; receivers below bring the
+# derived data (counters, facets, cached pages) up to date.
+stock_changed = Signal()
+StockChange = namedtuple('StockChange', 'product_id category_id price old_stock new_stock')
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    """Keep the full-text index in step with the product row"""
+    if raw:
+        return
+    search.index_products(instance.category, [instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, **kwargs):
+    """The category name is part of every product's search document"""
+    if raw or created:
+        return
+    search.index_products(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def purge_product_pages(sender, instance, **kwargs):
+    """Drop cached storefront pages showing this product"""
+    keys = ['catalog', f'product:{instance.pk}', f'category:{instance.category_id}']
+    previous_category_id = instance.loaded_value('category_id')
+    if previous_category_id and previous_category_id != instance.category_id:
+        keys.append(f'category:{previous_category_id}')
+    page_cache.purge(*keys)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def purge_category_pages(sender, instance, **kwargs):
+    page_cache.purge('catalog', 'categories', f'category:{instance.pk}')
+
+
+@receiver(post_save, sender=Product)
+def render_uploaded_image(sender, instance, raw=False, **kwargs):
+    """Build the image renditions as soon as a new image is uploaded"""
+    if raw:
+        return
+    previous_image = instance.loaded_value('image')
+    if previous_image == instance.image.name:
+        return
+    if previous_image:
+        renditions.delete_renditions(instance.image.storage, previous_image)
+    if instance.image or instance.image_renditions:
+        renditions.build_renditions(instance)
+
+
+@receiver(post_delete, sender=Product)
+def delete_image_renditions(sender, instance, **kwargs):
+    if instance.image:
+        renditions.delete_renditions(instance.image.storage, instance.image.name)
+
+
+@receiver(post_save, sender=Product)
+def record_saved_stock(sender, instance, created=False, raw=False, **kwargs):
+    """Stock changed with save() goes into the stock ledger"""
+    if raw and not created:
+        return
+    ledger.record_saved(instance, created)
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created=False, raw=False, **kwargs):
+    """Keep the category product counters in step"""
+    if raw:
+        return
+    if created:
+        counters.apply_product_change(None, 0, instance.category_id, instance.stock_quantity)
+        return
+
+    loaded = getattr(instance, '_loaded_values', {})
+    if 'category_id' not in loaded or 'stock_quantity' not in loaded:
+        # Saved without being fully loaded first, so the old values are unknown
+        counters.rebuild([instance.category_id])
+        return
+
+    old_category_id = loaded['category_id']
+    old_stock = loaded['stock_quantity']
+    if old_category_id != instance.category_id or (old_stock > 0) != (instance.stock_quantity > 0):
+        counters.apply_product_change(
+            old_category_id, old_stock, instance.category_id, instance.stock_quantity
+        )
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    counters.apply_product_change(instance.category_id, instance.stock_quantity, None, 0)
+
+
+@receiver(post_save, sender=Product)
+def update_saved_product_facets(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    new = (instance.category_id, instance.price, instance.stock_quantity)
+    if created:
+        facets.apply_product_change(None, new)
+        return
+
+    loaded = getattr(instance, '_loaded_values', {})
+    if not all(name in loaded for name in ('category_id', 'price', 'stock_quantity')):
+        facets.rebuild([instance.category_id])
+        return
+    old = (loaded['category_id'], loaded['price'], loaded['stock_quantity'])
+    facets.apply_product_change(old, new)
+
+
+@receiver(post_delete, sender=Product)
+def update_deleted_product_facets(sender, instance, **kwargs):
+    facets.apply_product_change((instance.category_id, instance.price, instance.stock_quantity), None)
+
+
+@receiver(post_save, sender=Product)
+def check_saved_product_stock(sender, instance, raw=False, **kwargs):
+    """Move the product in or out of the low-stock set"""
+    if raw:
+        return
+    if alerts.refresh(product_ids=[instance.pk]):
+        # Keep a later save() of this instance from writing the old flag back
+        instance.refresh_from_db(fields=['is_low_stock', 'low_stock_since', 'updated_at'])
+
+
+@receiver(post_save, sender=Category)
+def check_category_threshold(sender, instance, created=False, raw=False, **kwargs):
+    """The category's reorder threshold applies to its products"""
+    if raw or created:
+        return
+    alerts.refresh(category_ids=[instance.pk])
+
+
+@receiver(stock_changed)
+def refresh_after_stock_change(sender, changes, **kwargs):
+    keys = ['catalog']
+    for change in changes:
+        keys += [f'product:{change.product_id}', f'category:{change.category_id}']
+        if (change.old_stock > 0) != (change.new_stock > 0):
+            counters.apply_product_change(
+                change.category_id, change.old_stock, change.category_id, change.new_stock
+            )
+        facets.apply_product_change(
+            (change.category_id, change.price, change.old_stock),
+            (change.category_id, change.price, change.new_stock),
+        )
+    page_cache.purge(*keys)
+    alerts.refresh(product_ids=[change.product_id for change in changes])
@@ -4,5 +4,7 @@ register = template.Library()
 
 @register.filter
 def get_item(dictionary, key):
-    """Get an item from a dictionary using a key."""
+    """Get an item from a dictionary (or a cart's quantity) using a key."""
+    if hasattr(dictionary, 'quantity'):
+        return dictionary.quantity(key)
     return dictionary.get(key, 0)
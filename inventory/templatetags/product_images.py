@@ -0,0 +1,59 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from inventory.renditions import rendition_url, renditions_from
+
+register = template.Library()
+
+
+def _srcset(product, rendition, extension):
+    sizes = product.image_renditions
+    return format_html_join(
+        ', ', '{} {}w',
+        ((rendition_url(product.image, name, extension), sizes[name][0]) for name in renditions_from(rendition)),
+    )
+
+
+def _has_renditions(product, rendition):
+    return all(name in product.image_renditions for name in renditions_from(rendition))
+
+
+@register.simple_tag
+def rendition_srcset(product, rendition, extension='jpg'):
+    """srcset value listing the rendition and every larger one"""
+    if not _has_renditions(product, rendition):
+        return product.image.url
+    return _srcset(product, rendition, extension)
+
+
+@register.simple_tag
+def product_picture(product, rendition, sizes='100vw', css_class='', style='', lazy=True):
+    """
+    <picture> element serving WebP with a JPEG fallback, picking the
+    smallest rendition that covers the rendered size. Serves the original
+    image until the renditions are built.
+    """
+    loading = format_html(' loading="lazy"') if lazy else ''
+    if not _has_renditions(product, rendition):
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}"{}>',
+            product.image.url, product.name, css_class, style, loading,
+        )
+    width, height = product.image_renditions[rendition]
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" style="{}"{}>'
+        '</picture>',
+        _srcset(product, rendition, 'webp'),
+        sizes,
+        rendition_url(product.image, rendition, 'jpg'),
+        _srcset(product, rendition, 'jpg'),
+        sizes,
+        width,
+        height,
+        product.name,
+        css_class,
+        style,
+        loading,
+    )
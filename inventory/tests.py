@@ -1,3 +1,865 @@
-from django.test import TestCase
+import base64
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import router, transaction
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from core.db_router import ReplicaRoutingMiddleware
+from . import alerts, cart, counters, facets, ledger, page_cache, reservations
+from .models import CartLine, Category, FacetCount, Product, StockMovement, StockReservation, StockSnapshot
+from .pagination import InvalidCursor, KeysetPaginator
+from .search import search_products
+from .templatetags.product_images import product_picture
+
+
+def make_product(category, name='Product', price='10.00', stock=5, **fields):
+    return Product.objects.create(
+        category=category, name=name, price=Decimal(price), stock_quantity=stock, **fields
+    )
+
+
+def available(product_ids, holder=None):
+    """{product id: stock minus other carts' live holds}"""
+    return {
+        product.pk: product.stock_quantity - product.held_quantity
+        for product in reservations.with_available(Product.objects.filter(pk__in=product_ids), holder)
+    }
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Books')
+        for number in range(7):
+            make_product(cls.category, name=f'Book {number % 3}')
+        # Rows sharing the leading sort value are told apart by the id
+        Product.objects.update(created_at=timezone.now())
+
+    def setUp(self):
+        cache.clear()
+
+    def cursor(self, payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+    def walk(self, ordering, per_page=3):
+        paginator = KeysetPaginator(Product.objects.all(), ordering, per_page=per_page)
+        pages = [paginator.page()]
+        while pages[-1].has_next:
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return paginator, pages
+
+    def test_pages_cover_every_row_once_in_order(self):
+        for ordering in (('-created_at', '-id'), ('name', 'id')):
+            _, pages = self.walk(ordering)
+            ids = [product.pk for page in pages for product in page]
+            self.assertEqual(ids, list(Product.objects.order_by(*ordering).values_list('pk', flat=True)))
+            self.assertEqual([len(page) for page in pages], [3, 3, 1])
+            self.assertFalse(pages[0].has_previous)
+
+    def test_previous_cursor_returns_the_page_before(self):
+        paginator, pages = self.walk(('name', 'id'))
+        for before, after in zip(pages, pages[1:]):
+            previous = paginator.page(after.previous_cursor)
+            self.assertEqual(list(previous), list(before))
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('name', 'id'))
+        for cursor in ('not-base64!', 'WyJ4IiwiYSIsMV0', 'WyJuIl0'):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+        # Values of the wrong JSON type
+        paginator = KeysetPaginator(Product.objects.all(), ('-created_at', '-id'))
+        for payload in (['n', [1], 1], ['n', 5, 1], ['n', {}, 1]):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(self.cursor(payload))
+
+    def test_catalog_falls_back_to_the_first_page_on_a_bad_cursor(self):
+        response = self.client.get(reverse('product_catalog'), {'cursor': 'garbage', 'sort': 'name'})
+        self.assertEqual(response.status_code, 200)
+        first = list(Product.objects.order_by('name', 'id')[:len(response.context['page'])])
+        self.assertEqual(list(response.context['page']), first)
+        response = self.client.get(reverse('product_catalog'), {'cursor': self.cursor(['n', [1], 1])})
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.kitchen = Category.objects.create(name='Kitchen')
+        cls.garden = Category.objects.create(name='Garden')
+        cls.kettle = make_product(cls.kitchen, name='Steel kettle', description='Boils water')
+        cls.teapot = make_product(cls.kitchen, name='Teapot', description='Pairs well with a kettle')
+        cls.hose = make_product(cls.garden, name='Garden hose', description='Twenty metres')
+
+    def search(self, query, queryset=None):
+        return list(search_products(queryset if queryset is not None else Product.objects.all(), query))
+
+    def test_name_matches_rank_first_and_words_match_as_prefixes(self):
+        self.assertEqual(self.search('kett'), [self.kettle, self.teapot])
+        self.assertEqual(self.search('garden'), [self.hose])
+
+    def test_queries_without_words_match_nothing(self):
+        self.assertEqual(self.search('  !? '), [])
+
+    def test_filters_apply_before_the_result_limit(self):
+        for number in range(3):
+            make_product(self.garden, name=f'Kettle stand {number}')
+        with mock.patch('inventory.search.SEARCH_MAX_RESULTS', 2):
+            kitchen_only = self.search('kettle', Product.objects.filter(category=self.kitchen))
+        self.assertEqual(kitchen_only, [self.kettle, self.teapot])
+
+    def test_results_are_capped_and_stay_filterable(self):
+        for number in range(3):
+            make_product(self.garden, name=f'Kettle stand {number}')
+        with mock.patch('inventory.search.SEARCH_MAX_RESULTS', 2):
+            results = search_products(Product.objects.all(), 'kettle')
+            self.assertEqual(results.count(), 2)
+            garden = [product for product in results if product.category_id == self.garden.pk]
+            self.assertEqual(list(results.filter(category=self.garden)), garden)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.hose.name = 'Sprinkler hose'
+        self.hose.save()
+        self.assertEqual(self.search('sprinkler'), [self.hose])
+        self.kitchen.name = 'Cookware'
+        self.kitchen.save()
+        self.assertEqual(set(self.search('cookware')), {self.kettle, self.teapot})
+        self.teapot.delete()
+        self.assertEqual(self.search('cookware'), [self.kettle])
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Lamps')
+        cls.product = make_product(cls.category, name='Desk lamp')
+
+    def setUp(self):
+        cache.clear()
+
+    def detail(self):
+        return self.client.get(reverse('product_detail', args=[self.product.pk]))
+
+    def test_pages_are_tagged_with_surrogate_keys(self):
+        response = self.detail()
+        self.assertIn(f'product:{self.product.pk}', response[page_cache.SURROGATE_KEY_HEADER].split())
+
+    def test_cached_page_is_served_until_one_of_its_keys_is_purged(self):
+        self.assertContains(self.detail(), 'Desk lamp')
+        # update() sends no signals, so nothing purges the page yet
+        Product.objects.filter(pk=self.product.pk).update(name='Floor lamp')
+        with self.assertNumQueries(0):
+            self.assertContains(self.detail(), 'Desk lamp')
+        page_cache.purge(f'product:{self.product.pk}')
+        self.assertContains(self.detail(), 'Floor lamp')
+
+    def test_purge_markers_expire_after_the_pages_they_invalidate(self):
+        with mock.patch.object(page_cache._cache(), 'set_many') as set_many:
+            page_cache.purge('catalog')
+        self.assertEqual(set_many.call_args.kwargs['timeout'], page_cache.PURGE_TIMEOUT)
+        self.assertGreater(page_cache.PURGE_TIMEOUT, page_cache.PAGE_CACHE_TIMEOUT)
+
+    def test_saving_a_product_purges_its_pages(self):
+        self.detail()
+        self.product.name = 'Reading lamp'
+        self.product.save()
+        self.assertContains(self.detail(), 'Reading lamp')
+
+    def test_signed_in_users_bypass_the_cache(self):
+        self.detail()
+        Product.objects.filter(pk=self.product.pk).update(name='Floor lamp')
+        user = User.objects.create_user('shopper', password='secret-pass-1')
+        self.client.force_login(user)
+        self.assertContains(self.detail(), 'Floor lamp')
+
+
+class RenditionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.product = make_product(Category.objects.create(name='Posters'), name='Panorama')
+
+    def upload(self, size=(1600, 800)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'teal').save(buffer, 'PNG')
+        self.product.image.save('panorama.png', ContentFile(buffer.getvalue()))
+        self.product.refresh_from_db()
+
+    def test_upload_records_the_real_rendition_sizes(self):
+        self.upload()
+        self.assertEqual(
+            self.product.image_renditions, {'thumb': [100, 100], 'card': [600, 400], 'detail': [1200, 600]}
+        )
+        html = product_picture(self.product, 'detail')
+        self.assertIn('width="1200" height="600"', html)
+        self.assertIn('__detail.webp 1200w', html)
+
+    def test_rendering_never_touches_storage(self):
+        self.upload()
+        Product.objects.filter(pk=self.product.pk).update(image_renditions={})
+        self.product.refresh_from_db()
+        storage = self.product.image.storage
+        with mock.patch.object(storage, 'exists') as exists, mock.patch.object(storage, 'open') as open_file:
+            html = product_picture(self.product, 'card')
+            self.assertIn(f'src="{self.product.image.url}"', html)
+            self.assertNotIn('width=', html)
+            self.product.image_renditions = {'thumb': [100, 100], 'card': [600, 400], 'detail': [1200, 600]}
+            product_picture(self.product, 'card')
+        exists.assert_not_called()
+        open_file.assert_not_called()
+
+    def test_generate_renditions_fills_in_missing_ones(self):
+        self.upload()
+        Product.objects.filter(pk=self.product.pk).update(image_renditions={})
+        call_command('generate_renditions', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_renditions['detail'], [1200, 600])
+
+    def test_oversized_upload_is_served_as_is(self):
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000), self.assertLogs('inventory.renditions', 'WARNING'):
+            self.upload((400, 400))
+        self.assertEqual(self.product.image_renditions, {})
+        self.assertIn(f'src="{self.product.image.url}"', product_picture(self.product, 'card'))
+        self.assertEqual(self.client.get(reverse('product_detail', args=[self.product.pk])).status_code, 200)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Clocks')
+        cls.product = make_product(cls.category, name='Wall clock')
+        make_product(cls.category, name='Alarm clock')
+
+    def setUp(self):
+        cache.clear()
+
+    def assertRevalidates(self, url):
+        """Returns the ETag after checking that it answers a 304"""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        return etag
+
+    def test_product_page_changes_with_its_product_and_category(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        etag = self.assertRevalidates(url)
+        self.product.price = Decimal('12.50')
+        self.product.save()
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        etag = self.assertRevalidates(url)
+        self.category.name = 'Timepieces'
+        self.category.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_catalog_revalidates_with_one_query_and_follows_its_categories(self):
+        url = reverse('product_catalog')
+        etag = self.assertRevalidates(url)
+        # Past the page cache, only the validators are read
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.category.name = 'Timepieces'
+        self.category.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_api_list_changes_when_a_product_is_deleted(self):
+        url = '/api/products/'
+        etag = self.assertRevalidates(url)
+        Product.objects.filter(name='Alarm clock').delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_api_detail_revalidates_and_404s_for_missing_products(self):
+        self.assertRevalidates(f'/api/products/{self.product.pk}/')
+        self.assertEqual(self.client.get('/api/products/999999/').status_code, 404)
+
+
+class CategoryCounterTests(TestCase):
+    def setUp(self):
+        self.tools = Category.objects.create(name='Tools')
+        self.paint = Category.objects.create(name='Paint')
+
+    def assertCounts(self, category, expected):
+        category.refresh_from_db()
+        self.assertEqual((category.product_count, category.in_stock_count, category.out_of_stock_count), expected)
+
+    def test_counters_follow_product_changes(self):
+        hammer = make_product(self.tools, name='Hammer', stock=3)
+        make_product(self.tools, name='Saw', stock=0)
+        self.assertCounts(self.tools, (2, 1, 1))
+
+        hammer.stock_quantity = 0
+        hammer.save()
+        self.assertCounts(self.tools, (2, 0, 2))
+
+        hammer.category = self.paint
+        hammer.save()
+        self.assertCounts(self.tools, (1, 0, 1))
+        self.assertCounts(self.paint, (1, 0, 1))
+
+        hammer.delete()
+        self.assertCounts(self.paint, (0, 0, 0))
+
+    def test_partially_loaded_saves_recount(self):
+        make_product(self.tools, name='Drill', stock=4)
+        drill = Product.objects.only('pk', 'name').get()
+        drill.stock_quantity = 0
+        drill.save()
+        self.assertCounts(self.tools, (1, 0, 1))
+
+    def test_rebuild_repairs_drifted_counters(self):
+        make_product(self.tools, name='Level', stock=2)
+        Category.objects.filter(pk=self.tools.pk).update(product_count=9, in_stock_count=9, out_of_stock_count=9)
+        self.assertEqual(counters.rebuild(), 1)
+        self.assertCounts(self.tools, (1, 1, 0))
+        self.assertEqual(counters.rebuild(), 0)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.audio = Category.objects.create(name='Audio')
+        self.video = Category.objects.create(name='Video')
+        self.earbuds = make_product(self.audio, name='Earbuds', price='19.99', stock=4)
+        make_product(self.audio, name='Speaker', price='149.00', stock=0)
+        make_product(self.video, name='Projector', price='649.00', stock=2)
+
+    def cube(self):
+        return set(FacetCount.objects.filter(product_count__gt=0).values_list(
+            'category_id', 'price_bucket', 'in_stock', 'product_count'
+        ))
+
+    def test_each_facet_is_counted_without_its_own_filter(self):
+        counts = facets.facet_counts(facets.parse_filters({'category': str(self.audio.pk), 'in_stock': '1'}))
+        self.assertEqual(counts['total'], 1)
+        self.assertEqual(counts['categories'], {self.audio.pk: 1, self.video.pk: 1})
+        self.assertEqual([bucket['count'] for bucket in counts['prices']], [1, 0, 0, 0])
+        self.assertEqual(counts['in_stock'], 1)
+
+    def test_incremental_updates_match_a_rebuild(self):
+        self.earbuds.price = Decimal('79.00')
+        self.earbuds.stock_quantity = 0
+        self.earbuds.save()
+        self.earbuds.category = self.video
+        self.earbuds.save()
+        Product.objects.get(name='Speaker').delete()
+        maintained = self.cube()
+        facets.rebuild()
+        self.assertEqual(maintained, self.cube())
+
+    def test_deleting_a_category_with_products(self):
+        self.audio.delete()
+        self.assertFalse(FacetCount.objects.filter(category_id=self.audio.pk).exists())
+        self.assertEqual(self.cube(), {(self.video.pk, 3, True, 1)})
+
+    def test_decrementing_a_missing_cell_creates_nothing(self):
+        FacetCount.objects.all().delete()
+        facets.apply_product_change((self.audio.pk, Decimal('5'), 1), None)
+        self.assertFalse(FacetCount.objects.exists())
+
+    def test_api_facets(self):
+        response = self.client.get('/api/products/facets/', {'price': '3'})
+        self.assertEqual(response.json()['total'], 1)
+        self.assertEqual(response.json()['categories'], [{'id': self.video.pk, 'count': 1}])
+
+
+@mock.patch('core.db_router.replica_aliases', return_value=['replica_1'])
+class ReplicaRoutingTests(SimpleTestCase):
+    databases = {'default'}
+
+    def route(self, method, path, session=None, write=False):
+        """(read alias before, read alias after writing) seen by a view"""
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(Product))
+            if write:
+                router.db_for_write(Product)
+            seen.append(router.db_for_read(Product))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)(path)
+        request.session = session if session is not None else SessionStore()
+        ReplicaRoutingMiddleware(view)(request)
+        return tuple(seen)
+
+    def test_reads_go_to_a_replica_until_the_request_writes(self, replicas):
+        self.assertEqual(self.route('get', '/catalog/'), ('replica_1', 'replica_1'))
+        self.assertEqual(self.route('get', '/catalog/', write=True), ('replica_1', 'default'))
+
+    def test_writes_and_primary_paths_stay_on_the_primary(self, replicas):
+        self.assertEqual(self.route('post', '/catalog/'), ('default', 'default'))
+        self.assertEqual(self.route('get', '/cart/'), ('default', 'default'))
+
+    def test_a_write_pins_the_session_to_the_primary(self, replicas):
+        session = SessionStore()
+        self.route('post', '/cart/add/1/', session=session, write=True)
+        self.assertEqual(self.route('get', '/catalog/', session=session), ('default', 'default'))
+
+    def test_sessions_and_transactions_read_from_the_primary(self, replicas):
+        def view(request):
+            seen = [router.db_for_read(User)]
+            with transaction.atomic():
+                seen.append(router.db_for_read(Product))
+            seen.append(router.db_for_read(Product))
+            self.assertEqual(seen, ['default', 'default', 'replica_1'])
+            return HttpResponse()
+
+        request = RequestFactory().get('/catalog/')
+        request.session = SessionStore()
+        ReplicaRoutingMiddleware(view)(request)
+
+    def test_code_outside_requests_reads_from_the_primary(self, replicas):
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+
+def cart_request(session_items=None, user=None):
+    request = RequestFactory().get('/cart/')
+    request.session = SessionStore()
+    request.user = user or AnonymousUser()
+    if session_items is not None:
+        request.session[cart.SESSION_KEY] = session_items
+    return request
+
+
+class CartResolutionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Snacks')
+        cls.crisps = make_product(category, name='Crisps', price='1.50', stock=10)
+        cls.nuts = make_product(category, name='Nuts', price='4.00', stock=1)
+
+    def test_lines_are_resolved_in_one_query(self):
+        service = cart.CartService(cart.SessionCartStorage(
+            cart_request({str(self.crisps.pk): 2, str(self.nuts.pk): 3, '999999': 1})
+        ))
+        with self.assertNumQueries(1):
+            lines = service.lines
+            removed = service.removed_ids
+        self.assertEqual([line['product'] for line in lines], [self.crisps, self.nuts])
+        self.assertEqual(removed, ['999999'])
+        self.assertEqual([line['has_stock_issue'] for line in lines], [False, True])
+        # Only what's in stock is charged for
+        self.assertEqual(service.total_price, Decimal('7.00'))
+
+    def test_prune_drops_products_that_no_longer_exist(self):
+        request = cart_request({str(self.crisps.pk): 1, '999999': 1})
+        service = cart.CartService(cart.SessionCartStorage(request))
+        self.assertEqual(service.prune(), ['999999'])
+        self.assertEqual(request.session[cart.SESSION_KEY], {str(self.crisps.pk): 1})
+
+
+class CartStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Tea')
+        cls.green = make_product(category, name='Green tea', stock=10)
+        cls.black = make_product(category, name='Black tea', stock=10)
+
+    def add(self, client, product, ajax=True):
+        headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if ajax else {}
+        return client.get(reverse('add_to_cart', args=[product.pk]), **headers)
+
+    def items(self, client):
+        return client.get(reverse('cart_batch')).json()['items']
+
+    @override_settings(CART_STORAGE='inventory.cart.CookieCartStorage')
+    def test_cookie_carts_write_nothing_to_the_database(self):
+        client = Client()
+        self.add(client, self.green)
+        self.add(client, self.green)
+        self.assertEqual(self.items(client), {str(self.green.pk): 2})
+        self.assertFalse(CartLine.objects.exists())
+
+        client.cookies[cart.COOKIE_NAME] = client.cookies[cart.COOKIE_NAME].value.replace(':2', ':9')
+        self.assertEqual(self.items(client), {})
+
+    @override_settings(CART_STORAGE='inventory.cart.DatabaseCartStorage')
+    def test_database_carts_keep_one_row_per_product_and_merge_on_login(self):
+        client = Client()
+        self.add(client, self.green)
+        self.add(client, self.green)
+        line = CartLine.objects.get()
+        self.assertEqual((line.cart_key, line.quantity), (f'anon:{client.cookies[cart.CART_ID_COOKIE].value}', 2))
+
+        user = User.objects.create_user('taster', password='secret-pass-1')
+        CartLine.objects.create(cart_key=f'user:{user.pk}', product=self.green, quantity=1)
+        client.force_login(user)
+        self.assertEqual(self.items(client), {str(self.green.pk): 3})
+        self.assertEqual(list(CartLine.objects.values_list('cart_key', flat=True)), [f'user:{user.pk}'])
+
+    @override_settings(CART_STORAGE='inventory.cart.SessionCartStorage')
+    def test_session_carts(self):
+        client = Client()
+        self.add(client, self.black)
+        self.assertEqual(client.session[cart.SESSION_KEY], {str(self.black.pk): 1})
+        self.assertEqual(self.items(client), {str(self.black.pk): 1})
+
+
+class CartBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Stationery')
+        cls.pen = make_product(category, name='Pen', stock=10)
+        cls.ink = make_product(category, name='Ink', stock=4)
+
+    def post(self, body):
+        return self.client.post(reverse('cart_batch'), json.dumps(body), content_type='application/json')
+
+    def test_operations_are_folded_and_capped_to_stock(self):
+        response = self.post({'operations': [
+            {'product_id': self.pen.pk, 'delta': 2},
+            {'product_id': self.pen.pk, 'delta': 1},
+            {'product_id': self.ink.pk, 'quantity': 9},
+            {'product_id': 999999, 'delta': 1},
+        ]})
+        data = response.json()
+        self.assertFalse(data['success'])
+        self.assertEqual(
+            [(result['product_id'], result['success'], result['quantity']) for result in data['results']],
+            [(self.pen.pk, True, 3), (self.ink.pk, False, 4), (999999, False, 0)],
+        )
+        self.assertEqual(data['items'], {str(self.pen.pk): 3, str(self.ink.pk): 4})
+        self.assertEqual(data['cart_items'], 7)
+
+    def test_invalid_batches_are_rejected(self):
+        for body in (
+            {'operations': 'nope'},
+            {'operations': [{'product_id': True, 'delta': 1}]},
+            {'operations': [{'product_id': self.pen.pk, 'delta': 1}] * 101},
+            ['not', 'an', 'object'],
+            # Out of range values
+            {'operations': [{'product_id': 2**70, 'delta': 1}]},
+            {'operations': [{'product_id': 0, 'delta': 1}]},
+            {'operations': [{'product_id': self.pen.pk, 'quantity': 10**12}]},
+            {'operations': [{'product_id': self.pen.pk, 'quantity': -1}]},
+            {'operations': [{'product_id': self.pen.pk, 'delta': -2**70}]},
+        ):
+            self.assertEqual(self.post(body).status_code, 400)
+        self.assertEqual(self.client.get(reverse('cart_batch')).json()['items'], {})
+
+
+class ReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lamp = make_product(Category.objects.create(name='Lighting'), name='Lamp', stock=5)
+
+    def test_holds_limit_what_other_carts_can_have(self):
+        self.assertEqual(reservations.hold('cart-a', {self.lamp.pk: 3}), {self.lamp.pk: 5})
+        self.assertEqual(reservations.hold('cart-b', {self.lamp.pk: 4}), {self.lamp.pk: 2})
+        self.assertEqual(StockReservation.objects.get(holder='cart-b').quantity, 2)
+        self.assertEqual(available([self.lamp.pk], 'cart-c'), {self.lamp.pk: 0})
+        # A cart's own holds don't count against it
+        self.assertEqual(available([self.lamp.pk], 'cart-a'), {self.lamp.pk: 3})
+
+        reservations.release('cart-a')
+        self.assertEqual(available([self.lamp.pk], 'cart-c'), {self.lamp.pk: 3})
+
+    def test_lapsed_holds_stop_counting_and_are_swept(self):
+        reservations.hold('cart-a', {self.lamp.pk: 5})
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(available([self.lamp.pk], 'cart-b'), {self.lamp.pk: 5})
+        out = StringIO()
+        call_command('release_expired_reservations', stdout=out)
+        self.assertIn('Released 1 expired reservations', out.getvalue())
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_holds_for_missing_products_are_ignored(self):
+        self.assertEqual(reservations.hold('cart-a', {999999: 1}), {})
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class LedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cls.kettle = make_product(Category.objects.create(name='Kitchen'), name='Kettle', stock=5)
+
+    def stock(self):
+        self.kettle.refresh_from_db()
+        return self.kettle.stock_quantity
+
+    def test_saves_are_recorded_with_their_reason(self):
+        ledger.attribute(self.kettle, StockMovement.ADJUSTMENT, user=self.staff, note='Recount')
+        self.kettle.stock_quantity = 3
+        self.kettle.save()
+        self.assertEqual(
+            list(self.kettle.stock_movements.order_by('pk').values_list('quantity', 'reason', 'user')),
+            [(5, StockMovement.INITIAL, None), (-2, StockMovement.ADJUSTMENT, self.staff.pk)],
+        )
+        self.assertEqual(ledger.drift(), {})
+
+    def test_receipts_count_at_once_and_reach_the_cache_when_applied(self):
+        ledger.receive(self.kettle.pk, 4)
+        self.assertEqual((self.stock(), ledger.ledger_stock([self.kettle.pk])), (5, {self.kettle.pk: 9}))
+        self.assertEqual(ledger.drift(), {})
+        self.assertEqual(ledger.apply_pending(), 1)
+        self.assertEqual(self.stock(), 9)
+        self.assertEqual(ledger.apply_pending(), 0)
+        with self.assertRaises(ValueError):
+            ledger.receive(self.kettle.pk, -1)
+
+    def test_snapshots_keep_past_stock_readable(self):
+        self.kettle.stock_quantity = 8
+        self.kettle.save()
+        initial, restock = self.kettle.stock_movements.order_by('pk')
+        now = timezone.now()
+        StockMovement.objects.filter(pk=initial.pk).update(created_at=now - timedelta(hours=2))
+        StockMovement.objects.filter(pk=restock.pk).update(created_at=now - timedelta(hours=1))
+
+        self.assertEqual(ledger.compact(), 1)
+        self.assertEqual(StockSnapshot.objects.get().quantity, 8)
+        # Movements younger than the lag wait for the next run
+        self.kettle.stock_quantity = 6
+        self.kettle.save()
+        self.assertEqual(ledger.compact(), 0)
+
+        self.assertEqual(ledger.stock_as_of([self.kettle.pk], now - timedelta(minutes=90)), {self.kettle.pk: 5})
+        self.assertEqual(ledger.stock_as_of([self.kettle.pk], now - timedelta(minutes=30)), {self.kettle.pk: 8})
+        self.assertEqual(ledger.ledger_stock([self.kettle.pk]), {self.kettle.pk: 6})
+
+    def test_drift_is_reported_and_repaired(self):
+        Product.objects.filter(pk=self.kettle.pk).update(stock_quantity=7)
+        self.assertEqual(ledger.drift(), {self.kettle.pk: (7, 5)})
+        out = StringIO()
+        call_command('compact_stock_ledger', '--repair', stdout=out)
+        self.assertIn(f'Product {self.kettle.pk}: cached 7, ledger 5', out.getvalue())
+        self.assertEqual(ledger.drift(), {})
+        self.assertEqual(self.kettle.stock_movements.latest('pk').reason, StockMovement.CORRECTION)
+
+    def test_stock_api(self):
+        url = f'/api/products/{self.kettle.pk}/stock/'
+        self.client.force_login(User.objects.create_user('customer'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.post(url, {'quantity': 3, 'note': 'Delivery'}, content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['applied']), (202, False))
+        for quantity in (0, -2, '3', True):
+            response = self.client.post(url, {'quantity': quantity}, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+        data = self.client.get(url, {'at': (timezone.now() + timedelta(minutes=1)).isoformat()}).json()
+        self.assertEqual((data['stock_quantity'], data['ledger_stock'], data['stock_at']), (5, 8, 8))
+        self.assertEqual([movement['quantity'] for movement in data['movements']], [3, 5])
+        self.assertEqual(self.client.get(url, {'at': 'last week'}).status_code, 400)
+
+
+class CatalogImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tools = Category.objects.create(name='Tools')
+        cls.saw = make_product(cls.tools, name='Saw', price='20.00', stock=4, sku='SAW-1')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def run_import(self, name, content, **options):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w', encoding='utf-8') as feed:
+            feed.write(content)
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_csv_rows_are_upserted_by_sku(self):
+        out = self.run_import('feed.csv', (
+            'sku,name,category,price,stock_quantity\n'
+            'SAW-1,,,,0\n'
+            'DRILL-1,Cordless drill,Power tools,89.90,3\n'
+            'DRILL-1,,,79.90,\n'
+        ))
+        self.assertIn('(1 created, 1 updated, 0 rejected)', out)
+        self.saw.refresh_from_db()
+        self.assertEqual((self.saw.name, self.saw.price, self.saw.stock_quantity), ('Saw', Decimal('20.00'), 0))
+        drill = Product.objects.get(sku='DRILL-1')
+        self.assertEqual(
+            (drill.category.name, drill.price, drill.stock_quantity), ('Power tools', Decimal('79.90'), 3)
+        )
+        self.assertEqual(ledger.drift(), {})
+        self.assertEqual(
+            list(drill.stock_movements.values_list('quantity', 'reason')), [(3, StockMovement.IMPORT)]
+        )
+
+    def test_derived_data_is_rebuilt(self):
+        self.run_import('feed.ndjson', (
+            '{"sku": "SAW-1", "stock_quantity": 0}\n'
+            '{"sku": "AXE-1", "name": "Splitting axe", "category": "Tools", "price": "45", "stock_quantity": 2}\n'
+        ))
+        self.tools.refresh_from_db()
+        self.assertEqual(
+            (self.tools.product_count, self.tools.in_stock_count, self.tools.out_of_stock_count), (2, 1, 1)
+        )
+        self.assertEqual(facets.facet_counts(facets.parse_filters({}))['total'], 2)
+        # Both are below the category's reorder threshold of 10
+        self.assertEqual(Product.objects.filter(is_low_stock=True).count(), 2)
+        self.assertEqual([product.sku for product in search_products(Product.objects.all(), 'axe')], ['AXE-1'])
+
+    def test_bad_rows_are_rejected_with_their_line_number(self):
+        out = self.run_import('feed.ndjson', (
+            '{"sku": "SAW-1", "price": "cheap"}\n'
+            '\n'
+            '{"sku": "NEW-1", "name": "Chisel"}\n'
+            'not json\n'
+            '{"sku": "SAW-1", "stock_quantity": -1}\n'
+            '{"sku": "SAW-1", "stock_quantity": 6}\n'
+            '{"sku": "SAW-1%s", "stock_quantity": 9}\n'
+        ) % ('X' * 60))
+        self.assertIn('Line 1: Invalid price: cheap', out)
+        self.assertIn('Line 3: New product NEW-1 needs category, price.', out)
+        self.assertIn('Line 4: Invalid JSON', out)
+        self.assertIn('Line 5: stock_quantity must not be negative.', out)
+        self.assertIn('Line 7: sku must be at most 64 characters.', out)
+        self.assertIn('(0 created, 1 updated, 5 rejected)', out)
+        self.assertFalse(Product.objects.filter(sku='NEW-1').exists())
+
+    def test_unreadable_feeds_are_refused(self):
+        with self.assertRaises(CommandError):
+            self.run_import('feed.csv', 'name,price\nSaw,10\n')
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', f'{self.directory}/missing.csv', stdout=StringIO())
+
+
+class BulkStockTests(TestCase):
+    url = '/api/products/stock/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        category = Category.objects.create(name='Office')
+        cls.pen, cls.pad, cls.ink = (make_product(category, name=name, stock=20) for name in ('Pen', 'Pad', 'Ink'))
+
+    def patch(self, rows):
+        return self.client.patch(self.url, rows, content_type='application/json')
+
+    def test_figures_read_before_a_sale_are_not_applied(self):
+        Product.objects.filter(pk=self.pad.pk).update(stock_quantity=18)
+        changes, conflicts = ledger.set_stock(
+            {self.pen.pk: 25, self.pad.pk: 30, self.ink.pk: 5}, expected={self.pen.pk: 20, self.pad.pk: 20}
+        )
+        self.assertEqual(changes, {self.pen.pk: (20, 25), self.ink.pk: (20, 5)})
+        self.assertEqual(conflicts, {self.pad.pk: 18})
+        self.assertEqual(
+            dict(Product.objects.values_list('pk', 'stock_quantity')),
+            {self.pen.pk: 25, self.pad.pk: 18, self.ink.pk: 5},
+        )
+        self.assertFalse(StockMovement.objects.filter(product=self.pad, reason=StockMovement.ADJUSTMENT).exists())
+
+    def test_rows_the_guarded_update_skips_are_conflicts(self):
+        update = QuerySet.update
+
+        def sell_a_pad_first(queryset, **fields):
+            # A sale lands between the locked read and the UPDATE
+            if queryset.model is Product and 'stock_quantity' in fields:
+                update(Product.objects.filter(pk=self.pad.pk), stock_quantity=17)
+            return update(queryset, **fields)
+
+        with mock.patch.object(QuerySet, 'update', sell_a_pad_first), \
+                mock.patch.object(ledger.signals.stock_changed, 'send') as send:
+            changes, conflicts = ledger.set_stock({self.pen.pk: 25, self.pad.pk: 30})
+        self.assertEqual((changes, conflicts), ({self.pen.pk: (20, 25)}, {self.pad.pk: 17}))
+        self.assertEqual([change.product_id for change in send.call_args.kwargs['changes']], [self.pen.pk])
+        self.assertEqual(
+            list(StockMovement.objects.filter(reason=StockMovement.ADJUSTMENT).values_list('product_id', flat=True)),
+            [self.pen.pk],
+        )
+
+    def test_api_reports_conflicts_per_row(self):
+        self.client.force_login(self.staff)
+        self.pen.stock_quantity = 19
+        self.pen.save()
+        response = self.patch([
+            {'id': self.pen.pk, 'stock_quantity': 40, 'original_stock': 20},
+            {'id': self.pad.pk, 'stock_quantity': 12, 'original_stock': 20},
+            {'id': self.ink.pk, 'stock_quantity': 7},
+        ])
+        data = response.json()
+        self.assertEqual((response.status_code, data['updated'], data['conflicts']), (200, 2, 1))
+        self.assertEqual(
+            data['results'][0],
+            {'index': 0, 'id': self.pen.pk, 'success': False, 'conflict': True, 'stock_quantity': 19,
+             'error': 'Stock changed to 19 since it was read.'},
+        )
+        self.assertEqual((data['results'][1]['old_stock'], data['results'][1]['stock_quantity']), (20, 12))
+        self.assertEqual(ledger.drift(), {})
+
+    def test_api_applies_nothing_unless_every_row_is_valid(self):
+        self.client.force_login(self.staff)
+        response = self.patch([
+            {'id': self.pen.pk, 'stock_quantity': 1},
+            {'id': self.pad.pk, 'stock_quantity': 1, 'original_stock': -3},
+            {'id': 999999, 'stock_quantity': 1},
+            {'id': self.pen.pk, 'stock_quantity': 2},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [result['error'] for result in response.json()['results']],
+            [None, 'Original stock must be a whole number of at least 0.', 'Product 999999 not found.',
+             f'Product {self.pen.pk} is listed more than once.'],
+        )
+        self.assertEqual(set(Product.objects.values_list('stock_quantity', flat=True)), {20})
+        self.assertEqual(self.patch({'id': self.pen.pk}).status_code, 400)
+
+        self.client.force_login(User.objects.create_user('customer'))
+        self.assertEqual(self.patch([{'id': self.pen.pk, 'stock_quantity': 1}]).status_code, 403)
+
+
+class StockAlertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.paint = Category.objects.create(name='Paint', reorder_threshold=5)
+        cls.white = make_product(cls.paint, name='White', stock=6)
+        cls.blue = make_product(cls.paint, name='Blue', stock=6, reorder_threshold=8)
+
+    def flagged(self):
+        return list(alerts.low_stock().values_list('name', flat=True))
+
+    def test_products_enter_and_leave_the_set_as_stock_crosses_the_threshold(self):
+        # The product's own threshold overrides its category's
+        self.assertEqual(self.flagged(), ['Blue'])
+        self.white.stock_quantity = 4
+        self.white.save()
+        self.assertEqual(self.flagged(), ['White', 'Blue'])
+        self.white.refresh_from_db()
+        self.assertIsNotNone(self.white.low_stock_since)
+
+        ledger.set_stock({self.blue.pk: 8})
+        self.assertEqual(self.flagged(), ['White'])
+        self.blue.refresh_from_db()
+        self.assertIsNone(self.blue.low_stock_since)
+
+    def test_threshold_edits_re_evaluate_the_products(self):
+        self.paint.reorder_threshold = 7
+        self.paint.save()
+        self.assertEqual(sorted(self.flagged()), ['Blue', 'White'])
+        self.blue.reorder_threshold = 0
+        self.blue.save()
+        self.assertEqual(self.flagged(), ['White'])
+
+    def test_rebuild_repairs_flags_written_around_the_signals(self):
+        Product.objects.update(is_low_stock=False, low_stock_since=None)
+        Product.objects.filter(pk=self.white.pk).update(stock_quantity=0)
+        out = StringIO()
+        call_command('rebuild_stock_alerts', stdout=out)
+        self.assertIn('2 products changed state; 2 are low on stock', out.getvalue())
+        self.assertEqual(alerts.refresh(), 0)
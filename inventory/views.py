@@ -1,9 +1,33 @@
+import json
+import uuid
+
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Product, Category
-from orders.models import Order, OrderItem
+from .models import Product
+from orders.models import Order, OrderIntent
+from orders import idempotency, intake
+from orders.services import OrderPlacementError, place_order
 from .forms import UserRegisterForm
+from .pagination import KeysetPage, KeysetPaginator, InvalidCursor
+from .search import search_products
+from .page_cache import cache_storefront_page, tag_response
+from .conditional import conditional_storefront_page
+from . import facets
+
+
+# Keyset orderings available on the catalog; each ends with the pk so the
+# cursor always points at exactly one row
+CATALOG_SORTS = {
+    "newest": ("-created_at", "-id"),
+    "name": ("name", "id"),
+}
+CATALOG_PAGE_SIZE = 24
+# Search results are ranked by relevance, so only the best matches are shown
+CATALOG_SEARCH_LIMIT = 48
 
 
 def register(request):
@@ -21,188 +45,234 @@ def register(request):
     return render(request, "registration/register.html", {"form": form})
 
 
+def _home_querysets(request):
+    return [(Product.objects.all(), ("updated_at",))]
+
+
+def _catalog_querysets(request):
+    # Full pages also carry the category sidebar and facet counts, which
+    # depend on every product; their categories' timestamps come with the
+    # same aggregate (categories without products only add a zero count)
+    if request.headers.get("X-Requested-With") != "XMLHttpRequest":
+        return [(Product.objects.all(), ("updated_at", "category__updated_at"))]
+    filters = facets.parse_filters(request.GET)
+    return [(facets.filter_products(Product.objects.all(), filters), ("updated_at",))]
+
+
+def _product_detail_querysets(request, pk):
+    return [(Product.objects.filter(pk=pk), ("updated_at", "category__updated_at"))]
+
+
+@cache_storefront_page
+@conditional_storefront_page(_home_querysets)
 def store_home(request):
     featured_products = Product.objects.order_by("-created_at")[:4]
-    cart = request.session.get("cart", {})
-    return render(
+    cart = request.cart
+    response = render(
         request,
         "store/home.html",
         {"featured_products": featured_products, "cart": cart},
     )
+    return tag_response(response, "catalog")
 
 
+@cache_storefront_page
+@conditional_storefront_page(_catalog_querysets)
 def product_catalog(request):
-    category_id = request.GET.get("category")
-    if category_id:
-        products = Product.objects.filter(category_id=category_id)
+    filters = facets.parse_filters(request.GET)
+    products = facets.filter_products(Product.objects.all(), filters)
+
+    sort = request.GET.get("sort")
+    if sort not in CATALOG_SORTS:
+        sort = "newest"
+
+    search_query = request.GET.get("q", "").strip()
+    if search_query:
+        page = KeysetPage(
+            list(search_products(products, search_query)[:CATALOG_SEARCH_LIMIT])
+        )
+    else:
+        paginator = KeysetPaginator(
+            products, CATALOG_SORTS[sort], per_page=CATALOG_PAGE_SIZE
+        )
+        try:
+            page = paginator.page(request.GET.get("cursor"))
+        except InvalidCursor:
+            page = paginator.page()
+
+    cart = request.cart
+    context = {
+        "products": page,
+        "page": page,
+        "next_url": _catalog_page_url(request, cursor=page.next_cursor),
+        "previous_url": _catalog_page_url(request, cursor=page.previous_cursor),
+        "current_category": filters["category"],
+        "current_price": filters["price"],
+        "in_stock_only": filters["in_stock"],
+        "current_sort": sort,
+        "search_query": search_query,
+        "cart": cart,
+    }
+
+    # A plain category listing only changes with its own products;
+    # everything else (search results, price and stock filters) can change
+    # with any product
+    plain_listing = filters["price"] is None and not filters["in_stock"]
+    if filters["category"] is not None and plain_listing and not search_query:
+        surrogate_keys = [f"category:{filters['category']}"]
     else:
-        products = Product.objects.all()
+        surrogate_keys = ["catalog"]
 
-    categories = Category.objects.all()
-    cart = request.session.get("cart", {})
+    # Infinite scroll asks for the next page only, without the page chrome
+    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+        response = render(request, "store/_catalog_page.html", context)
+        return tag_response(response, *surrogate_keys)
 
-    return render(
-        request,
-        "store/catalog.html",
+    categories, counts = facets.category_options(filters)
+    for category in categories:
+        category.filter_url = _catalog_page_url(
+            request, category=None if category.pk == filters["category"] else category.pk
+        )
+    for bucket in counts["prices"]:
+        bucket["selected"] = bucket["id"] == filters["price"]
+        bucket["url"] = _catalog_page_url(
+            request, price=None if bucket["selected"] else bucket["id"]
+        )
+    context.update(
         {
-            "products": products,
             "categories": categories,
-            "current_category": int(category_id) if category_id else None,
-            "cart": cart,
-        },
+            "all_categories_url": _catalog_page_url(request, category=None),
+            "clear_search_url": _catalog_page_url(request, q=None),
+            "price_facets": counts["prices"],
+            "in_stock_facet": {
+                "count": counts["in_stock"],
+                "url": _catalog_page_url(
+                    request, in_stock=None if filters["in_stock"] else "1"
+                ),
+            },
+            "result_count": counts["total"],
+        }
+    )
+    response = render(request, "store/catalog.html", context)
+    return tag_response(
+        response, "categories", "category-counts", "facets", *surrogate_keys
     )
 
 
+_UNSET = object()
+
+
+def _catalog_page_url(request, cursor=_UNSET, **changes):
+    """
+    URL of the catalog with some parameters replaced (``None`` removes
+    one). Changing a filter restarts pagination from the first page.
+    """
+    params = request.GET.copy()
+    if cursor is _UNSET:
+        params.pop("cursor", None)
+    elif cursor is None:
+        return None
+    else:
+        params["cursor"] = cursor
+    for name, value in changes.items():
+        if value is None:
+            params.pop(name, None)
+        else:
+            params[name] = value
+    query = params.urlencode()
+    return f"{request.path}?{query}" if query else request.path
+
+
+@cache_storefront_page
+@conditional_storefront_page(_product_detail_querysets)
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
-    cart = request.session.get("cart", {})
-    return render(
+    product = get_object_or_404(Product.objects.select_related("category"), pk=pk)
+    cart = request.cart
+    response = render(
         request, "store/product_detail.html", {"product": product, "cart": cart}
     )
+    return tag_response(response, f"product:{product.pk}", "categories")
 
 
 def add_to_cart(request, pk):
-    from django.http import JsonResponse
-
     product = get_object_or_404(Product, pk=pk)
-    cart = request.session.get("cart", {})
+    cart = request.cart
+    success, message = cart.add(product)
 
-    # Check available stock
-    current_quantity = cart.get(str(pk), 0)
-    if current_quantity >= product.stock_quantity:
-        message = (
-            f"Only {product.stock_quantity} items available in stock. Cannot add more."
-        )
-        if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-            return JsonResponse(
-                {
-                    "success": False,
-                    "message": message,
-                    "quantity": current_quantity,
-                    "stock_quantity": product.stock_quantity,
-                }
-            )
-        messages.warning(request, message)
-        return redirect(request.META.get("HTTP_REFERER", "product_catalog"))
-
-    cart[str(pk)] = current_quantity + 1
-    request.session["cart"] = cart
-    request.session.modified = True
-
-    message = "Item added to cart"
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-        return JsonResponse(
-            {
-                "success": True,
-                "message": message,
-                "quantity": cart[str(pk)],
-                "stock_quantity": product.stock_quantity,
-                "product_id": pk,
-            }
-        )
+        data = {
+            "success": success,
+            "message": message,
+            "quantity": cart.quantity(pk),
+            "stock_quantity": product.stock_quantity,
+            **cart.as_json(),
+        }
+        if success:
+            data["product_id"] = pk
+        return JsonResponse(data)
 
-    messages.success(request, message)
+    if success:
+        messages.success(request, message)
+    else:
+        messages.warning(request, message)
     return redirect(request.META.get("HTTP_REFERER", "product_catalog"))
 
 
 def view_cart(request):
-    cart = request.session.get("cart", {})
-    cart_items = []
-    total_price = 0
-    has_stock_issues = False
-
-    for product_id, quantity in cart.items():
-        try:
-            product = Product.objects.get(pk=product_id)
-            available_stock = product.stock_quantity
-            requested_quantity = quantity
-
-            # Check if requested quantity exceeds available stock
-            if requested_quantity > available_stock:
-                has_stock_issues = True
-                messages.warning(
-                    request,
-                    f"{product.name}: Only {available_stock} available, but {requested_quantity} in cart. Please adjust quantity.",
-                )
-
-            subtotal = product.price * min(requested_quantity, available_stock)
-            total_price += subtotal
-            cart_items.append(
-                {
-                    "product": product,
-                    "quantity": requested_quantity,
-                    "available_stock": available_stock,
-                    "subtotal": subtotal,
-                    "has_stock_issue": requested_quantity > available_stock,
-                }
-            )
-        except Product.DoesNotExist:
-            # Product was deleted, remove from cart
-            if str(product_id) in cart:
-                del cart[str(product_id)]
-            messages.warning(
-                request,
-                f"Product with ID {product_id} no longer exists and was removed from cart.",
-            )
-
-    request.session["cart"] = cart
+    cart = request.cart
+    # Looking at the cart keeps its holds alive
+    cart.reserve()
+
+    for line in cart.stock_issues:
+        messages.warning(
+            request,
+            f"{line['product'].name}: Only {line['available_stock']} available, but {line['quantity']} in cart. Please adjust quantity.",
+        )
+    # Products deleted since they were added are dropped from the cart
+    for product_id in cart.prune():
+        messages.warning(
+            request,
+            f"Product with ID {product_id} no longer exists and was removed from cart.",
+        )
 
     return render(
         request,
         "store/cart.html",
         {
-            "cart_items": cart_items,
-            "total_price": total_price,
-            "has_stock_issues": has_stock_issues,
+            "cart_items": cart.lines,
+            "total_price": cart.total_price,
+            "has_stock_issues": cart.has_stock_issues,
+            # Sent back with the checkout form so a resubmitted form
+            # can't place the order twice
+            "checkout_key": uuid.uuid4().hex,
         },
     )
 
 
 def update_cart_quantity(request, pk, action):
-    from django.http import JsonResponse
-
     product = get_object_or_404(Product, pk=pk)
-    cart = request.session.get("cart", {})
-    product_key = str(pk)
-    current_quantity = cart.get(product_key, 0)
+    cart = request.cart
 
     success = False
     message = ""
-    new_quantity = current_quantity
 
     if action == "increase":
-        # Check if we can add more items
-        if current_quantity >= product.stock_quantity:
-            message = f"Only {product.stock_quantity} items available in stock. Cannot add more."
-            success = False
-        else:
-            cart[product_key] = current_quantity + 1
-            new_quantity = cart[product_key]
-            success = True
-            message = "Item added to cart"
+        success, message = cart.add(product)
     elif action == "decrease":
-        if product_key in cart:
-            cart[product_key] = cart[product_key] - 1
-            if cart[product_key] <= 0:
-                del cart[product_key]
-                new_quantity = 0
-            else:
-                new_quantity = cart[product_key]
-            success = True
+        success = cart.decrease(pk)
+        if success:
             message = "Quantity updated"
 
-    request.session["cart"] = cart
-    request.session.modified = True
-
     # Return JSON response for AJAX requests
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
         return JsonResponse(
             {
                 "success": success,
                 "message": message,
-                "quantity": new_quantity,
+                "quantity": cart.quantity(pk),
                 "stock_quantity": product.stock_quantity,
                 "product_id": pk,
+                **cart.as_json(),
             }
         )
 
@@ -215,63 +285,165 @@ def update_cart_quantity(request, pk, action):
 
 
 def remove_from_cart(request, pk):
-    cart = request.session.get("cart", {})
-    if str(pk) in cart:
-        del cart[str(pk)]
-        request.session["cart"] = cart
+    request.cart.remove(pk)
     return redirect("view_cart")
 
 
+# Upper bound on operations per batch request
+CART_BATCH_LIMIT = 100
+# Largest quantity (or change of quantity) one operation may ask for
+CART_MAX_QUANTITY = 10_000
+# Product ids are 64-bit signed integers
+MAX_PRODUCT_ID = 2**63 - 1
+
+
+def _parse_cart_operations(body):
+    """Validate a batch request body; returns the operations or None"""
+    try:
+        operations = json.loads(body).get("operations")
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(operations, list) or len(operations) > CART_BATCH_LIMIT:
+        return None
+    for operation in operations:
+        if not isinstance(operation, dict):
+            return None
+        product_id, quantity, delta = values = [
+            operation.get("product_id"), operation.get("quantity", 0), operation.get("delta", 0)
+        ]
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            return None
+        if not (
+            0 < product_id <= MAX_PRODUCT_ID
+            and 0 <= quantity <= CART_MAX_QUANTITY
+            and abs(delta) <= CART_MAX_QUANTITY
+        ):
+            return None
+    return operations
+
+
+@ensure_csrf_cookie
+@require_http_methods(["GET", "POST"])
+def cart_batch(request):
+    """
+    JSON cart endpoint. GET returns the cart; POST applies
+    ``{"operations": [{"product_id": 1, "delta": 2}, {"product_id": 5, "quantity": 0}]}``
+    and returns a result per product plus the new cart.
+    """
+    results = []
+    if request.method == "POST":
+        operations = _parse_cart_operations(request.body)
+        if operations is None:
+            return JsonResponse(
+                {"success": False, "message": "Invalid cart operations."}, status=400
+            )
+        results = request.cart.apply(operations)
+
+    return JsonResponse(
+        {
+            "success": all(result["success"] for result in results),
+            "results": results,
+            "items": request.cart.items,
+            **request.cart.as_json(),
+        }
+    )
+
+
 @login_required
 def checkout(request):
-    cart = request.session.get("cart", {})
-    if not cart:
-        messages.warning(request, "Your cart is empty")
-        return redirect("product_catalog")
+    # Orders are only placed from the cart page's checkout form
+    if request.method != "POST":
+        return redirect("view_cart")
 
-    # Validate stock availability before creating order
-    errors = []
-    cart_items_to_check = []
+    cart = request.cart
+    key = request.POST.get("idempotency_key", "")[: idempotency.MAX_KEY_LENGTH]
+    form_fingerprint = idempotency.fingerprint(
+        {name: value for name, value in request.POST.items() if name != "csrfmiddlewaretoken"}
+    )
 
-    for product_id, quantity in cart.items():
+    # A resubmitted form gets the order its first submission placed
+    record = None
+    if key:
         try:
-            product = Product.objects.get(pk=product_id)
-            if quantity > product.stock_quantity:
-                errors.append(
-                    f"{product.name}: Only {product.stock_quantity} available, but {quantity} requested."
-                )
-            elif quantity <= 0:
-                errors.append(f"{product.name}: Invalid quantity.")
-            else:
-                cart_items_to_check.append({"product": product, "quantity": quantity})
-        except Product.DoesNotExist:
-            errors.append(f"Product with ID {product_id} not found.")
+            stored = idempotency.replay(request.user, "checkout", key, form_fingerprint)
+            if stored and "intent_id" in stored["body"]:
+                return redirect("order_intent_status", pk=stored["body"]["intent_id"])
+            if stored:
+                messages.info(request, "This order has already been placed.")
+                return redirect("my_orders")
+            record = idempotency.claim(request.user, "checkout", key, form_fingerprint)
+        except idempotency.KeyInUse:
+            messages.info(request, "Your order is being placed.")
+            return redirect("my_orders")
+        except idempotency.KeyReused:
+            return redirect("view_cart")
+
+    try:
+        order = _place_cart_order(request, cart)
+    except Exception:
+        if record:
+            idempotency.release(record)
+        raise
+    if order is None:
+        if record:
+            idempotency.release(record)
+        return redirect("product_catalog" if not cart else "view_cart")
+    if isinstance(order, OrderIntent):
+        # Queued intake: the worker places it, the customer waits on the
+        # status page
+        if record:
+            idempotency.complete(record, None, 303, {"intent_id": order.pk})
+        cart.clear()
+        return redirect("order_intent_status", pk=order.pk)
+    if record:
+        idempotency.complete(record, order.pk, 303, {"order_id": order.pk})
+
+    # Clear cart
+    cart.clear()
+    messages.success(request, "Order placed successfully!")
+    return redirect("my_orders")
+
+
+def _place_cart_order(request, cart):
+    """
+    Place the order for the cart, or queue it in queued intake mode (an
+    ``OrderIntent``); returns None after flashing errors
+    """
+    if not cart:
+        messages.warning(request, "Your cart is empty")
+        return None
+
+    # Validate stock availability before creating order; other carts'
+    # holds count against it, this cart's own holds don't
+    errors = [
+        f"Product with ID {product_id} not found." for product_id in cart.removed_ids
+    ]
+    for line in cart.lines:
+        product, quantity = line["product"], line["quantity"]
+        if line["has_stock_issue"]:
+            errors.append(
+                f"{product.name}: Only {line['available_stock']} available, but {quantity} requested."
+            )
+        elif quantity <= 0:
+            errors.append(f"{product.name}: Invalid quantity.")
 
     # If there are errors, show them and redirect back to cart
     if errors:
         for error in errors:
             messages.error(request, error)
-        return redirect("view_cart")
-
-    # All validations passed, create order
-    order = Order.objects.create(user=request.user, status="pending")
+        return None
 
-    for item in cart_items_to_check:
-        product = item["product"]
-        quantity = item["quantity"]
+    lines = [(product_id, quantity) for product_id, quantity in cart.items.items()]
+    if intake.queued_intake():
+        return intake.enqueue(request.user, lines, holder=cart.holder)
 
-        OrderItem.objects.create(
-            order=order, product=product, price=product.price, quantity=quantity
-        )
-
-        # Deduct stock - ensure it doesn't go negative
-        product.stock_quantity = max(0, product.stock_quantity - quantity)
-        product.save()
-
-    # Clear cart
-    request.session["cart"] = {}
-    messages.success(request, "Order placed successfully!")
-    return redirect("my_orders")
+    # All validations passed: turn the cart's holds into the order
+    try:
+        return place_order(request.user, lines, holder=cart.holder)
+    except OrderPlacementError as error:
+        for message in error.messages:
+            messages.error(request, message)
+        return None
 
 
 @login_required
@@ -285,7 +457,7 @@ def order_history(request):
     orders = (
         Order.objects.filter(user=request.user)
         .select_related("user")
-        .prefetch_related("items__product")
+        .prefetch_related("items")
         .order_by("-created_at")
     )
 
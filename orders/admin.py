@@ -40,5 +40,10 @@ class OrderAdmin(admin.ModelAdmin):
     status_badge.short_description = 'Status'
 
     def total_amount(self, obj):
-        return f"${obj.total_price}"
+        return f"${obj.total_amount}"
     total_amount.short_description = 'Total'
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Items may have been added, edited or removed inline
+        form.instance.refresh_totals()
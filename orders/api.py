@@ -1,9 +1,169 @@
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from django.contrib.auth.models import User
 from .models import Order
-from .serializers import OrderSerializer
-from rest_framework.permissions import IsAuthenticated
+from .serializers import OrderBatchEntrySerializer, OrderListSerializer, OrderSerializer
+from .services import (
+    ORDER_BATCH_LIMIT, STATUS_BATCH_LIMIT, BatchConflict, OrderStatusError, change_status, place_orders,
+)
+from . import idempotency
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+
+class OrderCursorPagination(CursorPagination):
+    # Newest first, walking the (user, created_at) index page by page
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
 
 class OrderViewSet(viewsets.ModelViewSet):
+    """
+    Customers see their own orders; staff see everyone's and can narrow
+    the list with ``?user=<id>``. Lists are cursor-paginated and compact
+    (``?fields=id,status,total``, ``?expand=items``).
+    """
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset().select_related('user')
+        user = self.request.user
+        if not user.is_staff:
+            queryset = queryset.filter(user=user)
+        elif self.action == 'list' and self.request.query_params.get('user', '').isdigit():
+            queryset = queryset.filter(user_id=self.request.query_params['user'])
+
+        if self.action != 'list' or 'items' in self.request.query_params.get('expand', '').split(','):
+            queryset = queryset.prefetch_related('items')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderListSerializer
+        return super().get_serializer_class()
+
+    def perform_create(self, serializer):
+        # Only staff may place orders for someone else
+        if self.request.user.is_staff:
+            serializer.save()
+        else:
+            serializer.save(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        """Honour an ``Idempotency-Key`` header so retried POSTs create one order"""
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > idempotency.MAX_KEY_LENGTH:
+            return Response({'detail': 'Idempotency-Key is too long.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        request_fingerprint = idempotency.fingerprint(request.data)
+        try:
+            stored = idempotency.replay(request.user, 'api-orders', key, request_fingerprint)
+            if stored is not None:
+                return Response(stored['body'], status=stored['status'], headers={'Idempotent-Replayed': 'true'})
+            record = idempotency.claim(request.user, 'api-orders', key, request_fingerprint)
+        except idempotency.IdempotencyError as error:
+            return Response({'detail': str(error)}, status=error.status_code)
+
+        try:
+            response = super().create(request, *args, **kwargs)
+        except Exception:
+            # Nothing was created; let the client fix the request and retry
+            idempotency.release(record)
+            raise
+        idempotency.complete(record, response.data.get('id'), response.status_code, response.data)
+        return response
+
+    @action(detail=False, methods=['post'], url_path='bulk-status', permission_classes=[IsAdminUser])
+    def bulk_status(self, request):
+        """
+        Move many orders to one status: ``{"ids": [1, 2, 3], "status": "cancelled"}``.
+        Cancelling restores the stock of every order with one UPDATE per batch.
+        """
+        ids = request.data.get('ids')
+        new_status = request.data.get('status')
+        if new_status not in dict(Order.STATUS_CHOICES):
+            return Response({'status': ['Invalid status.']}, status=status.HTTP_400_BAD_REQUEST)
+        if (
+            not isinstance(ids, list)
+            or not ids
+            or len(ids) > STATUS_BATCH_LIMIT
+            or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids)
+        ):
+            return Response(
+                {'ids': [f'Expected a list of 1 to {STATUS_BATCH_LIMIT} order ids.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            updated = change_status(ids, new_status, user=request.user)
+        except OrderStatusError as error:
+            return Response({'ids': error.failures}, status=status.HTTP_409_CONFLICT)
+        return Response({'status': new_status, 'updated': updated})
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        """
+        Place many orders in one request:
+        ``{"orders": [{"reference": "A-1", "items_data": [{"product": 1, "quantity": 2}]}, ...]}``.
+        Staff may set ``user`` per order. Every order gets a result; one
+        failing order doesn't stop the others.
+        """
+        entries = request.data.get('orders') if isinstance(request.data, dict) else None
+        if not isinstance(entries, list) or not entries or len(entries) > ORDER_BATCH_LIMIT:
+            return Response(
+                {'orders': [f'Expected a list of 1 to {ORDER_BATCH_LIMIT} orders.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = [None] * len(entries)
+        accepted = []
+        for index, entry in enumerate(entries):
+            serializer = OrderBatchEntrySerializer(data=entry)
+            if not serializer.is_valid():
+                reference = entry.get('reference', '') if isinstance(entry, dict) else ''
+                results[index] = {'index': index, 'reference': reference, 'success': False, 'errors': serializer.errors}
+                continue
+            data = serializer.validated_data
+            user_id = data.get('user', request.user.pk) if request.user.is_staff else request.user.pk
+            lines = [(item['product'], item['quantity']) for item in data['items_data']]
+            accepted.append((index, data.get('reference', ''), user_id, lines))
+
+        # Every customer of the batch is looked up with one query
+        known_users = set(
+            User.objects.filter(pk__in={user_id for _, _, user_id, _ in accepted}).values_list('pk', flat=True)
+        )
+        to_place = []
+        for index, reference, user_id, lines in accepted:
+            if user_id in known_users:
+                to_place.append((index, reference, user_id, lines))
+            else:
+                results[index] = {
+                    'index': index, 'reference': reference, 'success': False,
+                    'errors': {'user': [f'User with ID {user_id} not found.']},
+                }
+
+        try:
+            placed = place_orders([(user_id, lines, None) for _, _, user_id, lines in to_place])
+        except BatchConflict as error:
+            return Response({'detail': str(error)}, status=status.HTTP_409_CONFLICT)
+
+        for (index, reference, _, _), (order, failures) in zip(to_place, placed):
+            if order is None:
+                results[index] = {
+                    'index': index, 'reference': reference, 'success': False,
+                    'errors': {'items_data': failures},
+                }
+            else:
+                results[index] = {
+                    'index': index, 'reference': reference, 'success': True,
+                    'order_id': order.pk, 'total': str(order.total_amount), 'item_count': order.item_count,
+                }
+
+        created = sum(1 for result in results if result['success'])
+        return Response({'created': created, 'failed': len(results) - created, 'results': results})
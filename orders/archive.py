@@ -0,0 +1,82 @@
+"""
+Archival of old orders.
+
+Completed and cancelled orders older than ``ORDER_ARCHIVE_DAYS`` days
+rarely change and are rarely looked at, but every listing and dashboard
+query has to step over them. ``archive_orders`` moves them, in batches,
+into ``ArchivedOrder``: one compact row per order with its items inline,
+under the original order id. The live tables then only hold recent and
+open orders; the archive is read only when someone asks for it (the
+"archived orders" view of a customer or of a shopper's order history).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, OrderItem
+
+ARCHIVE_AFTER = timedelta(days=getattr(settings, 'ORDER_ARCHIVE_DAYS', 365))
+ARCHIVE_STATUSES = ('completed', 'cancelled')
+BATCH_SIZE = 500
+
+
+def archivable(before=None):
+    """Closed orders created before ``before`` (default: the archive horizon)"""
+    before = before or timezone.now() - ARCHIVE_AFTER
+    return Order.objects.filter(status__in=ARCHIVE_STATUSES, created_at__lt=before)
+
+
+def _archive_batch(order_ids):
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update()
+            .filter(pk__in=order_ids, status__in=ARCHIVE_STATUSES)
+            .order_by('pk')
+        )
+        items = {}
+        for order_id, product_id, name, price, quantity in (
+            OrderItem.objects.filter(order__in=orders)
+            .order_by('pk')
+            .values_list('order_id', 'product_id', 'product_name', 'price', 'quantity')
+        ):
+            items.setdefault(order_id, []).append([product_id, name, str(price), quantity])
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=order.pk,
+                user_id=order.user_id,
+                status=order.status,
+                total_amount=order.total_amount,
+                item_count=order.item_count,
+                line_count=order.line_count,
+                items=items.get(order.pk, []),
+                created_at=order.created_at,
+                updated_at=order.updated_at,
+            )
+            for order in orders
+        ])
+        OrderItem.objects.filter(order__in=orders).delete()
+        Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+    return len(orders)
+
+
+def archive_orders(before=None, batch_size=BATCH_SIZE):
+    """Move closed orders created before ``before`` into the archive; returns how many"""
+    archived = 0
+    while True:
+        batch = list(archivable(before).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return archived
+        archived += _archive_batch(batch)
+
+
+def summary(user):
+    """Order count and completed spend of the user's archived orders"""
+    return ArchivedOrder.objects.filter(user=user).aggregate(
+        count=Count('id'),
+        completed=Count('id', filter=Q(status='completed')),
+        spent=Sum('total_amount', filter=Q(status='completed')),
+    )
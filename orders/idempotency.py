@@ -0,0 +1,142 @@
+"""
+Idempotency keys for order creation.
+
+Clients send a key with each order-creating request (the
+``Idempotency-Key`` header on the API, a hidden ``idempotency_key`` field
+on the checkout form). The first request with a key claims it; once the
+order is placed its response is stored with the key and in the cache. A
+retry with the same key and the same request gets the stored response
+back from the cache, so it never reaches the order write path. Reusing a
+key for a different request is refused.
+
+Keys expire after ``IDEMPOTENCY_KEY_TTL`` seconds; ``clear_idempotency_keys``
+deletes expired rows.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+MAX_KEY_LENGTH = 255
+CLEANUP_BATCH_SIZE = 1000
+
+
+class IdempotencyError(Exception):
+    status_code = 409
+
+
+class KeyInUse(IdempotencyError):
+    """The first request with this key hasn't finished yet"""
+    status_code = 409
+
+
+class KeyReused(IdempotencyError):
+    """The key was already used for a different request"""
+    status_code = 422
+
+
+def fingerprint(payload):
+    """Stable hash of the request body a key was used with"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _cache_key(user, scope, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'idempotency:{user.pk}:{scope}:{digest}'
+
+
+def _check(stored_fingerprint, request_fingerprint):
+    if stored_fingerprint != request_fingerprint:
+        raise KeyReused('This idempotency key was already used for a different request.')
+
+
+def replay(user, scope, key, request_fingerprint):
+    """
+    The stored response for a completed key as ``{'status', 'body',
+    'order_id'}``, or None if the key is new. Raises ``KeyReused`` or
+    ``KeyInUse``.
+    """
+    cached = cache.get(_cache_key(user, scope, key))
+    if cached is not None:
+        _check(cached['fingerprint'], request_fingerprint)
+        return cached
+
+    record = IdempotencyKey.objects.filter(
+        user=user, scope=scope, key=key, expires_at__gt=timezone.now()
+    ).first()
+    if record is None:
+        return None
+    _check(record.fingerprint, request_fingerprint)
+    if not record.completed:
+        raise KeyInUse('A request with this idempotency key is still being processed.')
+    stored = _stored(record)
+    cache.set(_cache_key(user, scope, key), stored, IDEMPOTENCY_TTL)
+    return stored
+
+
+def _stored(record):
+    return {
+        'fingerprint': record.fingerprint,
+        'status': record.response_status,
+        'body': record.response_body,
+        'order_id': record.order_id,
+    }
+
+
+def claim(user, scope, key, request_fingerprint):
+    """
+    Reserve the key for this request. Returns the new ``IdempotencyKey``,
+    or raises ``KeyInUse``/``KeyReused`` when another request got there
+    first.
+    """
+    now = timezone.now()
+    # An expired key may be used again
+    IdempotencyKey.objects.filter(user=user, scope=scope, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user,
+                scope=scope,
+                key=key,
+                fingerprint=request_fingerprint,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL),
+            )
+    except IntegrityError:
+        if replay(user, scope, key, request_fingerprint) is not None:
+            raise KeyInUse('This request was already processed.')
+        raise KeyInUse('A request with this idempotency key is still being processed.')
+
+
+def complete(record, order_id, status, body):
+    """Store the response for replays"""
+    record.order_id = order_id
+    record.response_status = status
+    record.response_body = body
+    record.save(update_fields=['order', 'response_status', 'response_body'])
+    cache.set(_cache_key(record.user, record.scope, record.key), _stored(record), IDEMPOTENCY_TTL)
+
+
+def release(record):
+    """Give the key back after a failed attempt so the client can retry it"""
+    record.delete()
+
+
+def clear_expired(batch_size=CLEANUP_BATCH_SIZE):
+    """Delete expired keys in batches; returns how many were removed"""
+    removed = 0
+    while True:
+        batch = list(
+            IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return removed
+        removed += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
@@ -0,0 +1,79 @@
+"""
+Queued order intake for traffic spikes.
+
+With ``ORDER_INTAKE_MODE = 'queued'`` checkout doesn't place the order
+itself. It stores an ``OrderIntent`` (the cart lines plus the cart's stock
+holds, handed over to the intent) and shows a page that polls for the
+outcome. The ``process_orders`` worker drains the queue with
+``process_batch``: each batch locks its products once, settles the
+intents in queue order against the stock in memory, then writes one stock
+UPDATE for all of them and bulk-inserts the orders and their items. A
+flash sale then costs one lock wait per batch instead of one per
+checkout.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from inventory import reservations
+from inventory.models import StockReservation
+
+from .models import OrderIntent
+from .services import _merge_lines, place_orders
+
+BATCH_SIZE = 100
+
+
+def queued_intake():
+    return getattr(settings, 'ORDER_INTAKE_MODE', 'direct') == 'queued'
+
+
+def enqueue(user, lines, holder=None):
+    """
+    Queue an order for ``lines`` (pairs of product id and quantity). The
+    holder's live stock holds move to the intent, so they keep counting
+    while it waits and the cart can be emptied straight away.
+    """
+    intent = OrderIntent.objects.create(
+        user=user,
+        lines=[[int(product_id), quantity] for product_id, quantity in _merge_lines(lines).items()],
+    )
+    if holder:
+        intent.holder = f'intent:{intent.pk}'
+        reservations.transfer(holder, intent.holder)
+        intent.save(update_fields=['holder'])
+    return intent
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """
+    Turn up to ``batch_size`` queued intents into orders (or failures), in
+    queue order. Returns how many intents were processed. Raises
+    ``services.BatchConflict`` when the batch had to be rolled back; it
+    stays queued.
+    """
+    with transaction.atomic():
+        # Several workers can share the queue: each takes intents the
+        # others haven't locked
+        intents = list(
+            OrderIntent.objects.select_for_update(skip_locked=True)
+            .filter(status='queued')
+            .order_by('pk')[:batch_size]
+        )
+        if not intents:
+            return 0
+
+        results = place_orders([(intent.user_id, intent.lines, intent.holder) for intent in intents])
+        now = timezone.now()
+        for intent, (order, failures) in zip(intents, results):
+            intent.processed_at = now
+            intent.status = 'placed' if order else 'failed'
+            intent.order = order
+            intent.errors = failures
+
+        # Holds handed to failed intents are no longer needed
+        holders = [intent.holder for intent in intents if intent.holder and intent.status == 'failed']
+        if holders:
+            StockReservation.objects.filter(holder__in=holders).delete()
+        OrderIntent.objects.bulk_update(intents, ['status', 'order', 'errors', 'processed_at'])
+    return len(intents)
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders import archive
+
+
+class Command(BaseCommand):
+    help = 'Move completed and cancelled orders past the archive horizon into the order archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=archive.ARCHIVE_AFTER.days,
+            help='Archive closed orders created more than this many days ago (default: ORDER_ARCHIVE_DAYS)',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=archive.BATCH_SIZE,
+            help='Orders moved per transaction',
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        archived = archive.archive_orders(before=before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders created before {before:%Y-%m-%d}'))
@@ -0,0 +1,71 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from inventory.models import Product
+from orders.models import Order, OrderItem
+
+
+def _item_total(expression, output_field):
+    """Subquery summing ``expression`` over the outer order's items"""
+    return Coalesce(
+        Subquery(
+            OrderItem.objects.filter(order=OuterRef('pk'))
+            .order_by()
+            .values('order')
+            .annotate(total=expression)
+            .values('total'),
+            output_field=output_field,
+        ),
+        Value(0),
+        output_field=output_field,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Fill in stored order totals, line summaries and item product names for existing orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Orders updated per statement',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        named = OrderItem.objects.filter(product_name='').update(
+            product_name=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('name')[:1])
+        )
+
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Order.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            updated += Order.objects.filter(pk__in=batch).update(
+                total_amount=_item_total(
+                    Sum(F('price') * F('quantity')), DecimalField(max_digits=12, decimal_places=2)
+                ),
+                item_count=_item_total(Sum('quantity'), IntegerField()),
+                line_count=_item_total(Count('id'), IntegerField()),
+            )
+            summaries = defaultdict(list)
+            for order_id, quantity, name in (
+                OrderItem.objects.filter(order__in=batch).order_by('order', 'pk')
+                .values_list('order', 'quantity', 'product_name')
+            ):
+                if len(summaries[order_id]) < Order.SUMMARY_LINES:
+                    summaries[order_id].append([quantity, name])
+            Order.objects.bulk_update(
+                [Order(pk=pk, item_summary=summaries[pk]) for pk in batch], ['item_summary']
+            )
+            last_pk = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated totals for {updated} orders and names for {named} order items'
+        ))
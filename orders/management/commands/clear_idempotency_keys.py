@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from orders import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete expired idempotency keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=idempotency.CLEANUP_BATCH_SIZE,
+            help='Keys deleted per statement',
+        )
+
+    def handle(self, *args, **options):
+        removed = idempotency.clear_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {removed} expired idempotency keys'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.db_router import read_from_replica
+from orders import exports
+
+
+class Command(BaseCommand):
+    help = 'Stream orders (or order lines) to a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write; "-" for standard output')
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--lines', action='store_true', help='One row per order line instead of per order')
+        parser.add_argument('--from', dest='date_from', help='First order date to include (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', help='Last order date to include (YYYY-MM-DD)')
+        parser.add_argument('--status', help='Only orders with this status')
+        parser.add_argument('--customer', help='Only orders of this user (id, username or email)')
+        parser.add_argument('--archived', action='store_true', help='Include archived orders')
+
+    def handle(self, *args, **options):
+        try:
+            filters = exports.parse_filters(options)
+        except exports.ExportFilterError as error:
+            raise CommandError(error)
+
+        chunks = exports.export(
+            options['format'], lines=options['lines'], filters=filters, archived=options['archived']
+        )
+        # A long export shouldn't load the primary
+        with read_from_replica():
+            if options['output'] == '-':
+                for chunk in chunks:
+                    self.stdout.write(chunk, ending='')
+                return
+            rows = -1 if options['format'] == 'csv' else 0
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+                    rows += 1
+        self.stdout.write(self.style.SUCCESS(f'Wrote {rows} rows to {options["output"]}'))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders import intake
+from orders.services import BatchConflict
+
+
+class Command(BaseCommand):
+    help = 'Place queued checkouts (ORDER_INTAKE_MODE = "queued") in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=intake.BATCH_SIZE,
+            help='Queued checkouts placed per transaction',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to wait when the queue is empty',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the queue and exit instead of waiting for more',
+        )
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            try:
+                count = intake.process_batch(batch_size=options['batch_size'])
+            except BatchConflict as error:
+                self.stderr.write(f'{error} Retrying.')
+                continue
+            processed += count
+            if count:
+                self.stdout.write(f'Processed {count} queued orders')
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} queued orders in total'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_summary',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,4 +1,8 @@
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Count, F, Sum
 from django.contrib.auth.models import User
 from inventory.models import Product
 
@@ -12,24 +16,72 @@ class Order(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Totals of the items, kept up to date by every code path that writes
+    # items (see refresh_totals) so listings don't have to load them
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    # The first SUMMARY_LINES lines as [[quantity, product name], ...]
+    item_summary = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    SUMMARY_LINES = 3
+
+    class Meta:
+        # Listings, dashboards and archive_orders all read recent or old
+        # orders by date, so they scan a range of these instead of the table
+        indexes = [
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"Order #{self.id} - {self.user.get_full_name() or self.user.username}"
     
     @property
     def total_price(self):
-        return sum(item.get_cost() for item in self.items.all())
+        return self.total_amount
+
+    @property
+    def more_lines(self):
+        """Lines not in the stored summary"""
+        return self.line_count - len(self.item_summary)
+
+    def set_totals(self, items):
+        """Set the stored totals from ``items`` (OrderItem instances)"""
+        self.total_amount = sum((item.get_cost() for item in items), Decimal('0'))
+        self.item_count = sum(item.quantity for item in items)
+        self.line_count = len(items)
+        self.item_summary = [[item.quantity, item.product_name] for item in items[:self.SUMMARY_LINES]]
+
+    def refresh_totals(self):
+        """Recompute the stored totals from the items in the database"""
+        totals = self.items.aggregate(
+            total_amount=Sum(F('price') * F('quantity')),
+            item_count=Sum('quantity'),
+            line_count=Count('id'),
+        )
+        self.total_amount = totals['total_amount'] or 0
+        self.item_count = totals['item_count'] or 0
+        self.line_count = totals['line_count']
+        self.item_summary = [
+            list(line)
+            for line in self.items.order_by('pk').values_list('quantity', 'product_name')[:self.SUMMARY_LINES]
+        ]
+        self.save(update_fields=['total_amount', 'item_count', 'line_count', 'item_summary', 'updated_at'])
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, related_name='order_items', on_delete=models.CASCADE)
+    # Name at the time of ordering, so order pages don't need the product
+    product_name = models.CharField(max_length=200, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     quantity = models.PositiveIntegerField(default=1)
     
     def __str__(self):
-        return f"{self.quantity}x {self.product.name}"
+        return f"{self.quantity}x {self.product_name}"
     
     def get_cost(self):
         return self.price * self.quantity
@@ -37,4 +89,105 @@ class OrderItem(models.Model):
     def save(self, *args, **kwargs):
         if not self.price:
             self.price = self.product.price
+        if not self.product_name:
+            self.product_name = self.product.name
         super().save(*args, **kwargs)
+
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied key for an order-creating request, so a retried
+    request gets the original response instead of a second order.
+    Maintained by orders.idempotency.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    scope = models.CharField(max_length=20)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} ({self.user_id})"
+
+    @property
+    def completed(self):
+        return self.response_status is not None
+
+class OrderIntent(models.Model):
+    """
+    A checkout waiting in the queue for the process_orders worker (queued
+    intake mode, see orders.intake). Becomes an order or a list of errors.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('placed', 'Placed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='order_intents')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # [[product id, quantity], ...]
+    lines = models.JSONField()
+    # Reservation holder whose holds the intent was given
+    holder = models.CharField(max_length=64, blank=True)
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    errors = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='order_intent_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Intent #{self.id} ({self.status})"
+
+
+class ArchivedOrder(models.Model):
+    """
+    A completed or cancelled order moved out of the live tables by
+    archive_orders (see orders.archive). Keeps the original order id and
+    stores its items inline as ``[[product id, name, price, quantity], ...]``.
+    """
+    id = models.PositiveBigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    item_count = models.PositiveIntegerField()
+    line_count = models.PositiveIntegerField()
+    items = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archived_order_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order #{self.id}"
+
+    @property
+    def total_price(self):
+        return self.total_amount
+
+    @property
+    def lines(self):
+        """The items as dicts, like OrderItem fields"""
+        return [
+            {'product_id': product_id, 'product_name': name, 'price': Decimal(price), 'quantity': quantity}
+            for product_id, name, price, quantity in self.items
+        ]
@@ -1,16 +1,97 @@
 from rest_framework import serializers
 from .models import Order, OrderItem
-from inventory.models import Product
+from .services import OrderPlacementError, OrderStatusError, change_status, place_order
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    product_name = serializers.ReadOnlyField(source='product.name')
-
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'product_name', 'quantity', 'price']
-        read_only_fields = ['price']
+        read_only_fields = ['product_name', 'price']
+
+def validate_items(value):
+    """Structure check of an ``items_data`` list: [{"product": id, "quantity": n}, ...]"""
+    # Handle both list and JSON string
+    if isinstance(value, str):
+        import json
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise serializers.ValidationError("Invalid JSON format for items_data.")
+    
+    if not isinstance(value, list):
+        raise serializers.ValidationError("items_data must be a list/array.")
+    
+    if not value or len(value) == 0:
+        raise serializers.ValidationError("Order must have at least one item.")
+    
+    # Validate structure of each item
+    validated_items = []
+    for idx, item_data in enumerate(value):
+        if not isinstance(item_data, dict):
+            raise serializers.ValidationError(f"Item {idx + 1} must be an object/dictionary.")
+        
+        product_id = item_data.get('product')
+        quantity = item_data.get('quantity')
+        
+        if not product_id:
+            raise serializers.ValidationError(f"Item {idx + 1} must have a 'product' field.")
+        
+        if not str(product_id).isdigit():
+            raise serializers.ValidationError(f"Item {idx + 1} must have a numeric 'product' id.")
+        
+        if not isinstance(quantity, int) or quantity <= 0:
+            raise serializers.ValidationError(f"Item {idx + 1} must have a 'quantity' greater than 0.")
+        
+        # Existence and stock are checked when the order is placed
+        validated_items.append({
+            'product': int(product_id),
+            'quantity': quantity
+        })
+    
+    return validated_items
+
+class SparseFieldsMixin:
+    """
+    Trim the representation to ``?fields=a,b,c`` when the request asks for
+    it; names that aren't fields are ignored.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = request.query_params.get('fields') if request else None
+        if requested:
+            keep = {name.strip() for name in requested.split(',')}
+            for name in set(self.fields) - keep:
+                if not self.fields[name].write_only:
+                    self.fields.pop(name)
+
+class OrderListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Compact order for list responses: stored totals instead of items,
+    which are only included with ``?expand=items``.
+    """
+    customer_name = serializers.SerializerMethodField()
+    total = serializers.DecimalField(source='total_amount', max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'user', 'customer_name', 'status', 'total', 'item_count', 'line_count',
+            'created_at', 'updated_at',
+        ]
+        read_only_fields = fields
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request and 'items' in request.query_params.get('expand', '').split(','):
+            fields['items'] = OrderItemSerializer(many=True, read_only=True)
+        return fields
 
-class OrderSerializer(serializers.ModelSerializer):
+    def get_customer_name(self, obj):
+        return obj.user.get_full_name() or obj.user.username
+
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     items_data = serializers.JSONField(
         write_only=True,
@@ -22,67 +103,27 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'customer_name', 'status', 'created_at', 'updated_at', 'total_price', 'items', 'items_data']
-        read_only_fields = ['created_at', 'updated_at']
+        fields = [
+            'id', 'user', 'customer_name', 'status', 'created_at', 'updated_at',
+            'total_price', 'item_count', 'line_count', 'items', 'items_data',
+        ]
+        read_only_fields = ['created_at', 'updated_at', 'item_count', 'line_count']
+        # Defaults to the requesting user
+        extra_kwargs = {'user': {'required': False}}
     
     def get_customer_name(self, obj):
         return obj.user.get_full_name() or obj.user.username
     
     def validate_items_data(self, value):
         """Validate that order has at least one item"""
-        # Handle both list and JSON string
-        if isinstance(value, str):
-            import json
-            try:
-                value = json.loads(value)
-            except json.JSONDecodeError:
-                raise serializers.ValidationError("Invalid JSON format for items_data.")
-        
-        if not isinstance(value, list):
-            raise serializers.ValidationError("items_data must be a list/array.")
-        
-        if not value or len(value) == 0:
-            raise serializers.ValidationError("Order must have at least one item.")
-        
-        # Validate structure of each item
-        validated_items = []
-        for idx, item_data in enumerate(value):
-            if not isinstance(item_data, dict):
-                raise serializers.ValidationError(f"Item {idx + 1} must be an object/dictionary.")
-            
-            product_id = item_data.get('product')
-            quantity = item_data.get('quantity')
-            
-            if not product_id:
-                raise serializers.ValidationError(f"Item {idx + 1} must have a 'product' field.")
-            
-            if not quantity or quantity <= 0:
-                raise serializers.ValidationError(f"Item {idx + 1} must have a 'quantity' greater than 0.")
-            
-            # Get product object
-            try:
-                product = Product.objects.get(pk=product_id)
-            except Product.DoesNotExist:
-                raise serializers.ValidationError(f"Product with ID {product_id} does not exist.")
-            
-            # Check stock availability
-            if quantity > product.stock_quantity:
-                raise serializers.ValidationError(
-                    f"Insufficient stock for {product.name}. Available: {product.stock_quantity}, Requested: {quantity}."
-                )
-            
-            validated_items.append({
-                'product': product,
-                'quantity': quantity
-            })
-        
-        return validated_items
+        return validate_items(value)
     
     def validate(self, data):
         """Validate items and stock availability"""
         items_data = data.get('items_data', [])
         
-        if not items_data:
+        # Updates only change the status; items are required on create
+        if self.instance is None and not items_data:
             raise serializers.ValidationError({"items_data": "Order must have at least one item."})
         
         return data
@@ -98,30 +139,15 @@ class OrderSerializer(serializers.ModelSerializer):
         if 'user' not in validated_data:
             validated_data['user'] = self.context['request'].user
         
-        # Create order
-        order = Order.objects.create(**validated_data)
-        
-        # Create order items and update stock
-        for item_data in items_data:
-            product = item_data['product']
-            quantity = item_data['quantity']
-            
-            # Get current price from product
-            price = product.price
-            
-            # Create order item
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                price=price
+        # Create order and items and take the stock in one transaction
+        try:
+            return place_order(
+                validated_data['user'],
+                [(item['product'], item['quantity']) for item in items_data],
+                status=validated_data.get('status', 'pending'),
             )
-            
-            # Update stock
-            product.stock_quantity = max(0, product.stock_quantity - quantity)
-            product.save()
-        
-        return order
+        except OrderPlacementError as error:
+            raise serializers.ValidationError({"items_data": error.failures})
     
     def update(self, instance, validated_data):
         """Update order - only allow status changes"""
@@ -133,9 +159,25 @@ class OrderSerializer(serializers.ModelSerializer):
                 "items_data": "Cannot modify order items after creation. Only status can be updated."
             })
         
-        # Update status if provided
+        # Update status if provided; cancelling restores stock
         if 'status' in validated_data:
-            instance.status = validated_data['status']
-            instance.save()
+            try:
+                change_status([instance.pk], validated_data['status'], user=self.context['request'].user)
+            except OrderStatusError as error:
+                raise serializers.ValidationError({"status": error.messages})
+            instance.refresh_from_db()
         
         return instance
+
+class OrderBatchEntrySerializer(serializers.Serializer):
+    """
+    One order of a ``POST /api/orders/batch/`` payload. ``user`` is only
+    honoured for staff; products, stock and users are checked for the
+    whole batch at once by the view.
+    """
+    reference = serializers.CharField(required=False, allow_blank=True, max_length=100)
+    user = serializers.IntegerField(required=False, min_value=1)
+    items_data = serializers.JSONField()
+
+    def validate_items_data(self, value):
+        return validate_items(value)
@@ -0,0 +1,397 @@
+"""
+Order placement shared by the storefront checkout and the orders API.
+
+``place_order`` does the whole job in one transaction with a fixed number
+of queries however many lines the order has: lock the products in pk
+order, check every line, take the stock with a single conditional UPDATE
+(``stock_quantity >= quantity`` is part of the WHERE clause, so stock can
+never go negative even where row locks aren't available) and insert the
+items with ``bulk_create``. ``place_orders`` does the same for a whole
+batch of orders at once (the batch API and the queued checkout worker).
+
+``change_status`` moves any number of orders to a new status the same
+way: stock for cancelled orders is put back (and taken again for orders
+brought back from cancelled) with one aggregated UPDATE per call.
+
+Each of them appends the matching movements to the stock ledger
+(inventory.ledger) in the same transaction.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from inventory import ledger, reservations
+from inventory.models import Product, StockMovement, StockReservation
+from inventory.signals import StockChange, stock_changed
+
+from .models import Order, OrderItem
+
+# Most orders one change_status call may touch
+STATUS_BATCH_LIMIT = 1000
+# Most orders one batch API request may place
+ORDER_BATCH_LIMIT = 500
+
+
+class OrderPlacementError(Exception):
+    """
+    The order couldn't be placed. ``failures`` has one dict per failing
+    line: ``product_id``, ``product_name``, ``requested``, ``available``
+    and a readable ``message``.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__('; '.join(failure['message'] for failure in failures))
+
+    @property
+    def messages(self):
+        return [failure['message'] for failure in self.failures]
+
+
+class OrderStatusError(OrderPlacementError):
+    """Cancelled orders couldn't be reopened for lack of stock"""
+
+
+def _failure(product_id, requested, message, product=None, available=0):
+    return {
+        'product_id': product_id,
+        'product_name': product.name if product else '',
+        'requested': requested,
+        'available': available,
+        'message': message,
+    }
+
+
+def _merge_lines(lines):
+    """{product id: quantity} from (product id, quantity) pairs"""
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[int(product_id)] = quantities.get(int(product_id), 0) + quantity
+    return quantities
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _order_items(products, quantities):
+    """Unsaved OrderItems for ``{product id: quantity}``"""
+    return [
+        OrderItem(
+            product=products[product_id],
+            product_name=products[product_id].name,
+            price=products[product_id].price,
+            quantity=quantity,
+        )
+        for product_id, quantity in quantities.items()
+    ]
+
+
+def place_order(user, lines, holder=None, status='pending'):
+    """
+    Create an order for ``lines`` (pairs of product id and quantity) and
+    take the stock. Stock held for other carts is not available; stock
+    held by ``holder`` is, and those holds are used up. Raises
+    ``OrderPlacementError`` naming every line that can't be fulfilled, in
+    which case nothing is written.
+    """
+    quantities = _merge_lines(lines)
+    if not quantities:
+        raise OrderPlacementError([_failure(None, 0, 'Order must have at least one item.')])
+
+    with transaction.atomic():
+        products = {
+            product.pk: product
+            for product in reservations.with_available(
+                Product.objects.select_for_update(of=('self',))
+                .filter(pk__in=quantities)
+                .order_by('pk'),
+                holder,
+            )
+        }
+
+        failures = []
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None:
+                failures.append(_failure(product_id, quantity, f'Product with ID {product_id} not found.'))
+                continue
+            available = max(product.stock_quantity - product.held_quantity, 0)
+            if quantity <= 0:
+                failures.append(_failure(product_id, quantity, f'{product.name}: Invalid quantity.', product, available))
+            elif quantity > available:
+                failures.append(_failure(
+                    product_id, quantity,
+                    f'{product.name}: Only {available} available, but {quantity} requested.',
+                    product, available,
+                ))
+        if failures:
+            raise OrderPlacementError(failures)
+
+        per_product = _per_product(quantities)
+        updated = (
+            Product.objects.filter(pk__in=quantities, stock_quantity__gte=per_product)
+            .update(stock_quantity=F('stock_quantity') - per_product, updated_at=timezone.now())
+        )
+        if updated != len(quantities):
+            # Only reachable without row locks (e.g. SQLite under concurrent
+            # writers): report the lines whose stock ran out meanwhile
+            current = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'stock_quantity'))
+            raise OrderPlacementError([
+                _failure(
+                    product_id, quantity,
+                    f'{products[product_id].name}: Only {current.get(product_id, 0)} available, '
+                    f'but {quantity} requested.',
+                    products[product_id], current.get(product_id, 0),
+                )
+                for product_id, quantity in quantities.items()
+                if current.get(product_id, 0) < quantity
+            ])
+
+        items = _order_items(products, quantities)
+        order = Order(user=user, status=status)
+        order.set_totals(items)
+        order.save()
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+        ledger.record([
+            StockMovement(
+                product_id=product_id, quantity=-quantity, reason=StockMovement.SALE,
+                order_id=order.pk, user=user,
+            )
+            for product_id, quantity in quantities.items()
+        ])
+        if holder:
+            reservations.release(holder, list(quantities))
+
+        stock_changed.send(sender=Product, changes=[
+            StockChange(
+                product_id, products[product_id].category_id, products[product_id].price,
+                products[product_id].stock_quantity, products[product_id].stock_quantity - quantity,
+            )
+            for product_id, quantity in quantities.items()
+        ])
+    return order
+
+
+class BatchConflict(Exception):
+    """Stock changed while a batch was being placed; it was rolled back"""
+
+
+def _settle(quantities, holder, products, stock, holds, held_total):
+    """
+    Check one order's ``{product id: quantity}`` against the running stock
+    figures of a batch. On success take its stock from them and return no
+    failures.
+    """
+    if not quantities:
+        return [_failure(None, 0, 'Order must have at least one item.')]
+
+    failures = []
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            failures.append(_failure(product_id, quantity, f'Product with ID {product_id} not found.'))
+            continue
+        own = holds.get((holder, product_id), 0)
+        available = max(stock[product_id] - (held_total[product_id] - own), 0)
+        if quantity <= 0:
+            failures.append(_failure(product_id, quantity, f'{product.name}: Invalid quantity.', product, available))
+        elif quantity > available:
+            failures.append(_failure(
+                product_id, quantity,
+                f'{product.name}: Only {available} available, but {quantity} requested.',
+                product, available,
+            ))
+    if failures:
+        return failures
+
+    for product_id, quantity in quantities.items():
+        stock[product_id] -= quantity
+        held_total[product_id] -= holds.pop((holder, product_id), 0)
+    return []
+
+
+def place_orders(requests, status='pending'):
+    """
+    Place many orders at once. ``requests`` is a list of ``(user id,
+    lines, holder)``; the result has one ``(order, failures)`` pair per
+    request, in the same order, with ``order`` None when it failed. Orders
+    are settled first come first served and a failing order doesn't stop
+    the others.
+
+    The whole batch costs a fixed number of queries: one lock on every
+    product involved, one read of the live holds, one UPDATE taking the
+    stock of all placed orders and one insert each for orders and items.
+    Holds of the holders whose order was placed are released. Raises
+    ``BatchConflict`` (nothing written) if stock moved under the batch,
+    which can only happen without row locks.
+    """
+    requests = [(user_id, _merge_lines(lines), holder or '') for user_id, lines, holder in requests]
+    with transaction.atomic():
+        product_ids = {product_id for _, quantities, _ in requests for product_id in quantities}
+        products = {
+            product.pk: product
+            for product in Product.objects.select_for_update(of=('self',))
+            .filter(pk__in=product_ids)
+            .order_by('pk')
+        }
+        stock = {product_id: product.stock_quantity for product_id, product in products.items()}
+        holds = {}
+        held_total = defaultdict(int)
+        for holder, product_id, quantity in (
+            reservations.active_reservations()
+            .filter(product_id__in=products)
+            .values_list('holder', 'product_id', 'quantity')
+        ):
+            holds[(holder, product_id)] = quantity
+            held_total[product_id] += quantity
+
+        results = []
+        placed = []
+        taken = defaultdict(int)
+        for user_id, quantities, holder in requests:
+            failures = _settle(quantities, holder, products, stock, holds, held_total)
+            if failures:
+                results.append((None, failures))
+                continue
+            items = _order_items(products, quantities)
+            order = Order(user_id=user_id, status=status)
+            order.set_totals(items)
+            results.append((order, []))
+            placed.append((order, items, holder, quantities))
+            for product_id, quantity in quantities.items():
+                taken[product_id] += quantity
+
+        if placed:
+            per_product = _per_product(taken)
+            updated = (
+                Product.objects.filter(pk__in=taken, stock_quantity__gte=per_product)
+                .update(stock_quantity=F('stock_quantity') - per_product, updated_at=timezone.now())
+            )
+            if updated != len(taken):
+                raise BatchConflict('Stock changed while the batch was being placed.')
+
+            Order.objects.bulk_create([order for order, _, _, _ in placed])
+            for order, items, _, _ in placed:
+                for item in items:
+                    item.order = order
+            OrderItem.objects.bulk_create([item for _, items, _, _ in placed for item in items])
+            ledger.record([
+                StockMovement(
+                    product_id=product_id, quantity=-quantity, reason=StockMovement.SALE,
+                    order_id=order.pk, user_id=order.user_id,
+                )
+                for order, _, _, quantities in placed
+                for product_id, quantity in quantities.items()
+            ])
+
+            holders = {holder for _, _, holder, _ in placed if holder}
+            if holders:
+                StockReservation.objects.filter(holder__in=holders, product_id__in=taken).delete()
+
+            stock_changed.send(sender=Product, changes=[
+                StockChange(
+                    product_id, products[product_id].category_id, products[product_id].price,
+                    products[product_id].stock_quantity, products[product_id].stock_quantity - quantity,
+                )
+                for product_id, quantity in taken.items()
+            ])
+    return results
+
+
+def change_status(order_ids, status, user=None):
+    """
+    Move the orders in ``order_ids`` to ``status`` in one transaction and
+    return how many changed. Cancelling returns the items to stock;
+    reopening a cancelled order takes them again, and raises
+    ``OrderStatusError`` (changing nothing) if there isn't enough that
+    isn't held for a cart.
+    ``user`` is recorded on the stock movements.
+    """
+    if status not in dict(Order.STATUS_CHOICES):
+        raise ValueError(f'Unknown order status: {status}')
+
+    with transaction.atomic():
+        orders = dict(
+            Order.objects.select_for_update()
+            .filter(pk__in=order_ids)
+            .exclude(status=status)
+            .order_by('pk')
+            .values_list('pk', 'status')
+        )
+        if not orders:
+            return 0
+
+        # Stock each product gets back (positive) or gives up (negative)
+        sign = {
+            order_id: 1 if status == 'cancelled' else -1
+            for order_id, old_status in orders.items()
+            if (status == 'cancelled') != (old_status == 'cancelled')
+        }
+        reason = StockMovement.CANCELLATION if status == 'cancelled' else StockMovement.REOPEN
+        deltas = {}
+        movements = []
+        for order_id, product_id, quantity in (
+            OrderItem.objects.filter(order_id__in=sign)
+            .values('order_id', 'product_id')
+            .annotate(quantity=Sum('quantity'))
+            .values_list('order_id', 'product_id', 'quantity')
+        ):
+            deltas[product_id] = deltas.get(product_id, 0) + sign[order_id] * quantity
+            movements.append(StockMovement(
+                product_id=product_id, quantity=sign[order_id] * quantity, reason=reason,
+                order_id=order_id, user=user,
+            ))
+        deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+
+        products = {}
+        if deltas:
+            products = {
+                product.pk: product
+                for product in reservations.with_available(
+                    Product.objects.select_for_update(of=('self',))
+                    .filter(pk__in=deltas)
+                    .order_by('pk')
+                )
+            }
+            # Stock held for carts isn't available to reopened orders either
+            available = {
+                product_id: max(product.stock_quantity - product.held_quantity, 0)
+                for product_id, product in products.items()
+            }
+            failures = [
+                _failure(
+                    product_id, -deltas[product_id],
+                    f'{product.name}: Only {available[product_id]} available, '
+                    f'but {-deltas[product_id]} needed to reopen the cancelled orders.',
+                    product, available[product_id],
+                )
+                for product_id, product in products.items()
+                if available[product_id] + deltas[product_id] < 0
+            ]
+            if failures:
+                raise OrderStatusError(failures)
+
+            per_product = _per_product(deltas)
+            Product.objects.filter(pk__in=deltas).update(
+                stock_quantity=F('stock_quantity') + per_product, updated_at=timezone.now()
+            )
+        ledger.record(movements)
+
+        changed = Order.objects.filter(pk__in=orders).update(status=status, updated_at=timezone.now())
+
+        if products:
+            stock_changed.send(sender=Product, changes=[
+                StockChange(
+                    product_id, product.category_id, product.price,
+                    product.stock_quantity, product.stock_quantity + deltas[product_id],
+                )
+                for product_id, product in products.items()
+            ])
+    return changed
@@ -1,3 +1,405 @@
-from django.test import TestCase
+import csv
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from inventory import ledger, reservations
+from inventory.models import Category, Product, StockMovement, StockReservation
+
+from . import archive, intake
+from .models import ArchivedOrder, IdempotencyKey, Order, OrderIntent
+from .services import OrderPlacementError, OrderStatusError, change_status, place_order
+
+
+def make_product(category, name='Product', price='10.00', stock=5):
+    return Product.objects.create(category=category, name=name, price=Decimal(price), stock_quantity=stock)
+
+
+def available(product_ids, holder=None):
+    """{product id: stock minus other carts' live holds}"""
+    return {
+        product.pk: product.stock_quantity - product.held_quantity
+        for product in reservations.with_available(Product.objects.filter(pk__in=product_ids), holder)
+    }
+
+
+class OrderTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', password='secret-pass-1')
+        cls.category = Category.objects.create(name='Games')
+        cls.chess = make_product(cls.category, name='Chess set', price='25.00', stock=5)
+        cls.dice = make_product(cls.category, name='Dice', price='2.50', stock=2)
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.stock_quantity
+
+
+class PlaceOrderTests(OrderTestCase):
+    def test_order_takes_stock_and_records_sales(self):
+        reservations.hold('cart-1', {self.chess.pk: 3})
+        order = place_order(
+            self.customer, [(self.chess.pk, 2), (self.dice.pk, 2), (self.chess.pk, 1)], holder='cart-1'
+        )
+        self.assertEqual((self.stock(self.chess), self.stock(self.dice)), (2, 0))
+        self.assertEqual(
+            (order.total_amount, order.item_count, order.line_count), (Decimal('80.00'), 5, 2)
+        )
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(order_id=order.pk).values_list('product_id', 'quantity', 'reason')),
+            [(self.chess.pk, -3, StockMovement.SALE), (self.dice.pk, -2, StockMovement.SALE)],
+        )
+        self.assertEqual(ledger.drift(), {})
+        # The cart's holds were turned into the order
+        self.assertEqual(available([self.chess.pk], 'cart-2'), {self.chess.pk: 2})
+
+    def test_failing_lines_are_all_reported_and_nothing_is_written(self):
+        with self.assertRaises(OrderPlacementError) as raised:
+            place_order(self.customer, [(self.chess.pk, 1), (self.dice.pk, 3), (999999, 1)])
+        self.assertEqual(
+            [(failure['product_id'], failure['available']) for failure in raised.exception.failures],
+            [(self.dice.pk, 2), (999999, 0)],
+        )
+        self.assertEqual((self.stock(self.chess), self.stock(self.dice)), (5, 2))
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(StockMovement.objects.filter(reason=StockMovement.SALE).exists())
+
+    def test_stock_held_for_other_carts_cannot_be_sold(self):
+        reservations.hold('cart-other', {self.chess.pk: 4})
+        with self.assertRaises(OrderPlacementError):
+            place_order(self.customer, [(self.chess.pk, 2)], holder='cart-mine')
+        place_order(self.customer, [(self.chess.pk, 1)], holder='cart-mine')
+        self.assertEqual(self.stock(self.chess), 4)
+
+    def test_empty_orders_are_refused(self):
+        with self.assertRaises(OrderPlacementError):
+            place_order(self.customer, [])
+
+
+class IdempotencyTests(OrderTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.customer)
+
+    def post_order(self, key, quantity=1):
+        return self.client.post(
+            '/api/orders/', {'items_data': [{'product': self.chess.pk, 'quantity': quantity}]},
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_api_retries_replay_the_first_response(self):
+        first = self.post_order('order-1')
+        retry = self.post_order('order-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.stock(self.chess), 4)
+
+    def test_api_key_reused_for_another_request(self):
+        self.post_order('order-1')
+        self.assertEqual(self.post_order('order-1', quantity=2).status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_requests_give_the_key_back(self):
+        self.assertEqual(self.post_order('order-1', quantity=50).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post_order('order-1', quantity=2).status_code, 201)
+
+    def test_resubmitted_checkout_form_places_one_order(self):
+        self.client.get(reverse('add_to_cart', args=[self.dice.pk]))
+        form = {'idempotency_key': 'checkout-form-1'}
+        self.assertRedirects(self.client.post(reverse('checkout'), form), reverse('my_orders'))
+        response = self.client.post(reverse('checkout'), form, follow=True)
+        self.assertContains(response, 'This order has already been placed.')
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.stock(self.dice), 1)
+
+
+class QueuedIntakeTests(OrderTestCase):
+    def test_intents_take_over_the_cart_holds(self):
+        reservations.hold('cart-1', {self.chess.pk: 4})
+        intent = intake.enqueue(self.customer, [(self.chess.pk, 4)], holder='cart-1')
+        self.assertEqual(list(StockReservation.objects.values_list('holder', flat=True)), [f'intent:{intent.pk}'])
+        self.assertEqual(available([self.chess.pk], 'cart-2'), {self.chess.pk: 1})
+
+    def test_batches_settle_intents_in_queue_order(self):
+        others = [User.objects.create_user(f'shopper{number}') for number in range(2)]
+        first = intake.enqueue(self.customer, [(self.dice.pk, 1), (self.chess.pk, 1)])
+        second = intake.enqueue(others[0], [(self.dice.pk, 2)])
+        third = intake.enqueue(others[1], [(self.dice.pk, 1)], holder='cart-3')
+
+        self.assertEqual(intake.process_batch(), 3)
+        for intent in (first, second, third):
+            intent.refresh_from_db()
+        self.assertEqual([first.status, second.status, third.status], ['placed', 'failed', 'placed'])
+        self.assertIn('Only 1 available', second.errors[0]['message'])
+        self.assertEqual(first.order.total_amount, Decimal('27.50'))
+        self.assertEqual((self.stock(self.dice), self.stock(self.chess)), (0, 4))
+        self.assertEqual(ledger.drift(), {})
+        self.assertEqual(intake.process_batch(), 0)
+
+    @override_settings(ORDER_INTAKE_MODE='queued')
+    def test_queued_checkout_reports_its_outcome(self):
+        self.client.force_login(self.customer)
+        self.client.get(reverse('add_to_cart', args=[self.chess.pk]))
+        response = self.client.post(reverse('checkout'), {'idempotency_key': 'queued-1'})
+        intent = OrderIntent.objects.get()
+        self.assertRedirects(response, reverse('order_intent_status', args=[intent.pk]))
+        self.assertFalse(Order.objects.exists())
+
+        url = reverse('order_intent_status', args=[intent.pk])
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').json()['status'], 'queued')
+        call_command('process_orders', once=True, stdout=StringIO())
+        data = self.client.get(url, HTTP_ACCEPT='application/json').json()
+        self.assertEqual((data['status'], data['order_id']), ('placed', Order.objects.get().pk))
+
+        self.client.force_login(User.objects.create_user('stranger'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class OrderTotalsTests(OrderTestCase):
+    def test_items_keep_the_name_they_were_ordered_under(self):
+        order = place_order(self.customer, [(self.chess.pk, 1)])
+        self.chess.name = 'Deluxe chess set'
+        self.chess.save()
+        self.assertEqual(order.items.get().product_name, 'Chess set')
+
+    def test_removing_an_item_updates_totals_and_restores_stock(self):
+        order = place_order(self.customer, [(self.chess.pk, 2), (self.dice.pk, 1)])
+        item = order.items.get(product=self.dice)
+        self.client.force_login(self.customer)
+        self.client.post(reverse('order_item_delete', args=[order.pk, item.pk]))
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount, order.item_count, order.line_count), (Decimal('50.00'), 2, 1))
+        self.assertEqual(order.item_summary, [[2, 'Chess set']])
+        self.assertEqual(self.stock(self.dice), 2)
+        self.assertEqual(
+            StockMovement.objects.filter(order_id=order.pk, reason=StockMovement.ORDER_EDIT).get().quantity, 1
+        )
+
+    def test_backfill_fills_in_totals_and_names(self):
+        order = place_order(self.customer, [(self.chess.pk, 2), (self.dice.pk, 2)])
+        self.assertEqual(order.item_summary, [[2, 'Chess set'], [2, 'Dice']])
+        Order.objects.update(total_amount=0, item_count=0, line_count=0, item_summary=[])
+        order.items.update(product_name='')
+        call_command('backfill_order_totals', stdout=StringIO())
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount, order.item_count, order.line_count), (Decimal('55.00'), 4, 2))
+        self.assertEqual(order.item_summary, [[2, 'Chess set'], [2, 'Dice']])
+        self.assertEqual(sorted(order.items.values_list('product_name', flat=True)), ['Chess set', 'Dice'])
+
+
+class ChangeStatusTests(OrderTestCase):
+    def setUp(self):
+        self.first = place_order(self.customer, [(self.chess.pk, 2), (self.dice.pk, 1)])
+        self.second = place_order(self.customer, [(self.chess.pk, 1)])
+
+    def test_cancelling_returns_stock_and_reopening_takes_it_again(self):
+        self.assertEqual(change_status([self.first.pk, self.second.pk], 'cancelled'), 2)
+        self.assertEqual((self.stock(self.chess), self.stock(self.dice)), (5, 2))
+        # Already cancelled orders are left alone
+        self.assertEqual(change_status([self.first.pk], 'cancelled'), 0)
+        self.assertEqual(change_status([self.second.pk], 'processing'), 1)
+        self.assertEqual(self.stock(self.chess), 4)
+        self.assertEqual(ledger.drift(), {})
+
+    def test_reopening_without_stock_changes_nothing(self):
+        change_status([self.first.pk], 'cancelled')
+        Product.objects.filter(pk=self.dice.pk).update(stock_quantity=0)
+        with self.assertRaises(OrderStatusError) as raised:
+            change_status([self.first.pk, self.second.pk], 'completed')
+        self.assertEqual(raised.exception.failures[0]['product_id'], self.dice.pk)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.status, self.second.status), ('cancelled', 'pending'))
+        self.assertEqual(self.stock(self.chess), 4)
+
+    def test_reopening_leaves_cart_holds_alone(self):
+        change_status([self.first.pk], 'cancelled')
+        # 4 chess sets in stock, 3 of them held for a cart
+        reservations.hold('cart-1', {self.chess.pk: 3})
+        with self.assertRaises(OrderStatusError) as raised:
+            change_status([self.first.pk], 'pending')
+        self.assertEqual(raised.exception.failures[0]['product_id'], self.chess.pk)
+        self.assertEqual(self.stock(self.chess), 4)
+
+        reservations.hold('cart-1', {self.chess.pk: 2})
+        self.assertEqual(change_status([self.first.pk], 'pending'), 1)
+        self.assertEqual(self.stock(self.chess), 2)
+
+    def test_bulk_status_api(self):
+        url = '/api/orders/bulk-status/'
+        body = {'ids': [self.first.pk, self.second.pk], 'status': 'cancelled'}
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 403)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        for invalid in ({**body, 'status': 'lost'}, {**body, 'ids': []}, {**body, 'ids': [True]}):
+            self.assertEqual(self.client.post(url, invalid, content_type='application/json').status_code, 400)
+        response = self.client.post(url, body, content_type='application/json')
+        self.assertEqual(response.json(), {'status': 'cancelled', 'updated': 2})
+
+        Product.objects.filter(pk=self.chess.pk).update(stock_quantity=0)
+        response = self.client.post(url, {**body, 'status': 'pending'}, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+
+
+class ArchiveTests(OrderTestCase):
+    def setUp(self):
+        long_ago = timezone.now() - timedelta(days=400)
+        self.old = place_order(self.customer, [(self.chess.pk, 2), (self.dice.pk, 1)])
+        self.old_open = place_order(self.customer, [(self.chess.pk, 1)])
+        self.recent = place_order(self.customer, [(self.dice.pk, 1)])
+        Order.objects.filter(pk=self.old.pk).update(status='completed', created_at=long_ago)
+        Order.objects.filter(pk=self.old_open.pk).update(created_at=long_ago)
+        Order.objects.filter(pk=self.recent.pk).update(status='completed')
+
+    def test_only_old_closed_orders_move_under_their_own_id(self):
+        call_command('archive_orders', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            sorted(Order.objects.values_list('pk', flat=True)), sorted([self.old_open.pk, self.recent.pk])
+        )
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual(
+            (archived.pk, archived.status, archived.total_amount), (self.old.pk, 'completed', Decimal('52.50'))
+        )
+        self.assertEqual(
+            sorted((line['product_name'], line['quantity']) for line in archived.lines), [('Chess set', 2), ('Dice', 1)]
+        )
+        self.assertEqual(archive.summary(self.customer)['spent'], Decimal('52.50'))
+        # Nothing left to archive
+        self.assertEqual(archive.archive_orders(), 0)
+
+    def test_archived_orders_are_listed_only_on_request(self):
+        archive.archive_orders()
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('my_orders'))
+        self.assertNotIn('archived_orders', response.context)
+        response = self.client.get(reverse('my_orders'), {'archived': 1})
+        self.assertEqual([order.pk for order in response.context['archived_orders']], [self.old.pk])
+
+        self.client.force_login(User.objects.create_user('stranger'))
+        response = self.client.get(reverse('my_orders'), {'archived': 1})
+        self.assertEqual(list(response.context['archived_orders']), [])
+
+
+class OrderApiTests(OrderTestCase):
+    def setUp(self):
+        self.other = User.objects.create_user('other')
+        self.own = [place_order(self.customer, [(self.chess.pk, 1)]) for _ in range(3)]
+        self.theirs = place_order(self.other, [(self.dice.pk, 1)])
+
+    def test_customers_only_see_their_own_orders(self):
+        self.client.force_login(self.customer)
+        data = self.client.get('/api/orders/', {'user': self.other.pk}).json()
+        self.assertEqual([order['id'] for order in data['results']], [order.pk for order in reversed(self.own)])
+        self.assertEqual(self.client.get(f'/api/orders/{self.theirs.pk}/').status_code, 404)
+
+    def test_staff_can_narrow_the_list_by_customer(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(len(self.client.get('/api/orders/').json()['results']), 4)
+        data = self.client.get('/api/orders/', {'user': self.other.pk}).json()
+        self.assertEqual([order['id'] for order in data['results']], [self.theirs.pk])
+
+    def test_list_is_compact_and_cursor_paginated(self):
+        self.client.force_login(self.customer)
+        first = self.client.get('/api/orders/', {'page_size': 2, 'fields': 'id,total'}).json()
+        self.assertEqual(first['results'][0], {'id': self.own[2].pk, 'total': '25.00'})
+        self.assertNotIn('count', first)
+        second = self.client.get(first['next']).json()
+        self.assertEqual([order['id'] for order in second['results']], [self.own[0].pk])
+        self.assertIsNone(second['next'])
+
+        data = self.client.get('/api/orders/', {'expand': 'items', 'fields': 'id,items'}).json()
+        self.assertEqual(data['results'][0]['items'][0]['quantity'], 1)
+
+    def test_anonymous_requests_are_refused(self):
+        self.client.logout()
+        self.assertIn(self.client.get('/api/orders/').status_code, (401, 403))
+
+
+class BatchOrderTests(OrderTestCase):
+    url = '/api/orders/batch/'
+
+    def post(self, orders):
+        return self.client.post(self.url, {'orders': orders}, content_type='application/json')
+
+    def test_each_order_gets_its_own_result(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.post([
+            {'reference': 'A-1', 'user': self.customer.pk, 'items_data': [{'product': self.chess.pk, 'quantity': 2}]},
+            {'reference': 'A-2', 'items_data': [{'product': self.dice.pk, 'quantity': 3}]},
+            {'reference': 'A-3', 'user': 999999, 'items_data': [{'product': self.dice.pk, 'quantity': 1}]},
+            {'reference': 'A-4', 'items_data': []},
+            {'reference': 'A-5', 'user': self.customer.pk, 'items_data': [{'product': self.dice.pk, 'quantity': 2}]},
+        ])
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (2, 3))
+        self.assertEqual([result['success'] for result in data['results']], [True, False, False, False, True])
+        self.assertEqual(data['results'][0]['total'], '50.00')
+        self.assertIn('items_data', data['results'][1]['errors'])
+        self.assertIn('user', data['results'][2]['errors'])
+        self.assertEqual(set(Order.objects.values_list('user_id', flat=True)), {self.customer.pk})
+        self.assertEqual((self.stock(self.chess), self.stock(self.dice)), (3, 0))
+        self.assertEqual(ledger.drift(), {})
+
+    def test_customers_order_for_themselves(self):
+        other = User.objects.create_user('other')
+        self.client.force_login(self.customer)
+        response = self.post([{'user': other.pk, 'items_data': [{'product': self.chess.pk, 'quantity': 1}]}])
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(Order.objects.get().user, self.customer)
+
+    def test_malformed_payloads_are_refused(self):
+        self.client.force_login(self.customer)
+        for payload in ({}, {'orders': []}, {'orders': 'A-1'}):
+            response = self.client.post(self.url, payload, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class ExportTests(OrderTestCase):
+    def setUp(self):
+        self.first = place_order(self.customer, [(self.chess.pk, 2), (self.dice.pk, 1)])
+        self.second = place_order(User.objects.create_user('other'), [(self.dice.pk, 1)])
+        change_status([self.second.pk], 'completed')
+
+    def export(self, *args, **options):
+        out = StringIO()
+        call_command('export_orders', '-', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_orders_as_csv(self):
+        rows = list(csv.reader(StringIO(self.export())))
+        self.assertEqual(rows[0][:3], ['order_id', 'created_at', 'status'])
+        self.assertEqual(
+            [(row[0], row[2], row[-1]) for row in rows[1:]],
+            [(str(self.first.pk), 'pending', '52.50'), (str(self.second.pk), 'completed', '2.50')],
+        )
+
+    def test_filtered_lines_as_ndjson_include_the_archive(self):
+        Order.objects.filter(pk=self.second.pk).update(created_at=timezone.now() - timedelta(days=400))
+        archive.archive_orders()
+        self.assertEqual(self.export('--lines', format='ndjson', customer='other'), '')
+        output = self.export('--lines', '--archived', format='ndjson', customer='other')
+        lines = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(
+            [(line['order_id'], line['product_name'], line['line_total']) for line in lines],
+            [(self.second.pk, 'Dice', '2.50')],
+        )
+
+    def test_invalid_filters_are_refused(self):
+        with self.assertRaises(CommandError):
+            self.export(date_from='yesterday')
+        with self.assertRaises(CommandError):
+            self.export(status='lost')
@@ -5,5 +5,6 @@ urlpatterns = [
     path('', views.order_list, name='order_list'),
     path('my-orders/', views.my_orders, name='my_orders'),
     path('<int:pk>/', views.order_detail, name='order_detail'),
+    path('queued/<int:pk>/', views.order_intent_status, name='order_intent_status'),
     path('<int:order_pk>/item/<int:item_pk>/delete/', views.order_item_delete, name='order_item_delete'),
 ]
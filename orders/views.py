@@ -1,22 +1,55 @@
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from .models import Order, OrderItem
+from .models import ArchivedOrder, Order, OrderIntent, OrderItem
 from .forms import OrderItemForm
-from inventory.models import Product
+from inventory import ledger
+from inventory.models import Product, StockMovement
+
+def _with_archive(request, context):
+    # Archived orders are only read when asked for (?archived=1)
+    context['show_archived'] = bool(request.GET.get('archived'))
+    if context['show_archived']:
+        context['archived_orders'] = ArchivedOrder.objects.filter(user=request.user).order_by('-created_at')
+    return context
 
 @login_required
 def order_list(request):
     # Client-side: ALWAYS show only current user's orders
     # For viewing all orders, use /panel/orders/ (panel:order_management)
     # This ensures separation between client and admin views
-    orders = Order.objects.filter(user=request.user).select_related('user').prefetch_related('items__product').order_by('-created_at')
-    return render(request, 'orders/order_list.html', {'orders': orders})
+    orders = Order.objects.filter(user=request.user).select_related('user').order_by('-created_at')
+    return render(request, 'orders/order_list.html', _with_archive(request, {'orders': orders}))
 
 @login_required
 def my_orders(request):
     # Show only current user's orders - filtered at database level
-    orders = Order.objects.filter(user=request.user).select_related('user').prefetch_related('items__product').order_by('-created_at')
-    return render(request, 'orders/order_list.html', {'orders': orders})
+    orders = Order.objects.filter(user=request.user).select_related('user').order_by('-created_at')
+    return render(request, 'orders/order_list.html', _with_archive(request, {'orders': orders}))
+
+@login_required
+def order_intent_status(request, pk):
+    # Outcome of a queued checkout; the page refreshes itself until the
+    # process_orders worker has dealt with it. JSON for pollers.
+    intent = get_object_or_404(OrderIntent, pk=pk, user=request.user)
+    if request.headers.get('Accept', '').startswith('application/json'):
+        return JsonResponse({
+            'status': intent.status,
+            'order_id': intent.order_id,
+            'errors': [error['message'] for error in intent.errors],
+        })
+
+    if intent.status == 'placed':
+        messages.success(request, 'Order placed successfully!')
+        return redirect('my_orders')
+    if intent.status == 'failed' and request.method == 'POST':
+        # Put the lines back in the cart, as far as stock allows
+        request.cart.apply([
+            {'product_id': product_id, 'delta': quantity} for product_id, quantity in intent.lines
+        ])
+        return redirect('view_cart')
+    return render(request, 'orders/intent_status.html', {'intent': intent})
 
 @login_required
 def order_detail(request, pk):
@@ -37,8 +70,10 @@ def order_item_delete(request, order_pk, item_pk):
         # Restore stock
         product = item.product
         product.stock_quantity += item.quantity
+        ledger.attribute(product, StockMovement.ORDER_EDIT, user=request.user, order_id=order_pk)
         product.save()
         
         item.delete()
+        item.order.refresh_totals()
         return redirect('order_detail', pk=order_pk)
     return render(request, 'orders/order_item_confirm_delete.html', {'item': item, 'order': item.order})
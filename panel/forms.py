@@ -46,21 +46,24 @@ class StaffUpdateForm(forms.ModelForm):
 class CategoryForm(forms.ModelForm):
     class Meta:
         model = Category
-        fields = ('name', 'description')
+        fields = ('name', 'description', 'reorder_threshold')
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Category name'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Category description (optional)'}),
+            'reorder_threshold': forms.NumberInput(attrs={'class': 'form-control', 'min': '0'}),
         }
 
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ('category', 'name', 'description', 'price', 'stock_quantity', 'image')
+        fields = ('category', 'name', 'sku', 'description', 'price', 'stock_quantity', 'reorder_threshold', 'image')
         widgets = {
             'category': forms.Select(attrs={'class': 'form-select'}),
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Product name'}),
+            'sku': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'SKU (optional)'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'Product description'}),
             'price': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'placeholder': '0.00'}),
             'stock_quantity': forms.NumberInput(attrs={'class': 'form-control', 'min': '0', 'placeholder': '0'}),
+            'reorder_threshold': forms.NumberInput(attrs={'class': 'form-control', 'min': '0', 'placeholder': 'Category default'}),
             'image': forms.FileInput(attrs={'class': 'form-control', 'accept': 'image/*'}),
         }
@@ -1,3 +1,187 @@
+import csv
+import json
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from inventory import ledger
+from inventory.models import Category, Product
+from orders.services import place_order
+
+
+def make_product(category, name='Product', price='10.00', stock=5, **fields):
+    return Product.objects.create(
+        category=category, name=name, price=Decimal(price), stock_quantity=stock, **fields
+    )
+
+
+class PanelTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cls.customer = User.objects.create_user('customer', email='customer@example.com')
+        cls.category = Category.objects.create(name='Garden')
+        cls.hose = make_product(cls.category, name='Hose', price='12.00', stock=10)
+        cls.rake = make_product(cls.category, name='Rake', price='8.50', stock=4)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+
+class OrderExportTests(PanelTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = place_order(self.customer, [(self.hose.pk, 1), (self.rake.pk, 2)])
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_orders_stream_as_csv(self):
+        response = self.client.get(reverse('panel:order_export'), {'customer': 'customer@example.com'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(self.content(response))))
+        self.assertEqual([(row[0], row[-1]) for row in rows[1:]], [(str(self.order.pk), '29.00')])
+
+    def test_lines_stream_as_ndjson(self):
+        response = self.client.get(reverse('panel:order_export'), {'format': 'ndjson', 'lines': 1})
+        lines = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual(
+            [(line['product_name'], line['quantity']) for line in lines], [('Hose', 1), ('Rake', 2)]
+        )
+
+    def test_invalid_filters_go_back_to_the_order_list(self):
+        response = self.client.get(reverse('panel:order_export'), {'date_to': '2026-13-01'})
+        self.assertRedirects(response, reverse('panel:order_management'))
+
+    def test_customers_cannot_export(self):
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(reverse('panel:order_export')).status_code, 302)
+
+
+class OrderListTests(PanelTestCase):
+    def test_orders_are_listed_from_their_stored_summaries(self):
+        extra = [make_product(self.category, name=f'Seeds {number}', price='1.00') for number in range(3)]
+        order = place_order(self.customer, [(self.hose.pk, 1), (self.rake.pk, 2)] + [(product.pk, 1) for product in extra])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('panel:order_management'))
+        self.assertFalse([query for query in queries if 'orders_orderitem' in query['sql']])
+        self.assertContains(response, '1x Hose')
+        self.assertContains(response, '2x Rake')
+        self.assertContains(response, '+2 more...')
+        self.assertEqual(list(response.context['orders']), [order])
+
+    def test_list_is_paginated(self):
+        for _ in range(3):
+            place_order(self.customer, [(self.hose.pk, 1)])
+        with mock.patch('panel.views.ORDER_PAGE_SIZE', 2):
+            first = self.client.get(reverse('panel:order_management'), {'status': 'pending'})
+            second = self.client.get(reverse('panel:order_management'), {'status': 'pending', 'page': 2})
+        self.assertEqual((len(first.context['orders']), len(second.context['orders'])), (2, 1))
+        self.assertContains(first, '?status=pending&page=2')
+
+
+class BulkStockTests(PanelTestCase):
+    def post(self, data):
+        return self.client.post(reverse('panel:bulk_update_stock'), data, follow=True)
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.stock_quantity
+
+    def test_changed_rows_are_saved_together(self):
+        response = self.post({
+            f'stock_{self.hose.pk}': '15', f'original_{self.hose.pk}': '10',
+            f'stock_{self.rake.pk}': '0', f'original_{self.rake.pk}': '4',
+        })
+        self.assertContains(response, 'Stock updated for 2 products')
+        self.assertEqual((self.stock(self.hose), self.stock(self.rake)), (15, 0))
+        self.assertEqual(ledger.drift(), {})
+
+    def test_rows_sold_since_the_page_was_rendered_are_not_overwritten(self):
+        self.client.get(reverse('panel:inventory_management'))
+        place_order(self.customer, [(self.hose.pk, 3)])
+        response = self.post({
+            f'stock_{self.hose.pk}': '12', f'original_{self.hose.pk}': '10',
+            f'stock_{self.rake.pk}': '6', f'original_{self.rake.pk}': '4',
+        })
+        self.assertEqual([str(message) for message in response.context['messages']], [
+            'Stock updated for 1 product',
+            f'#{self.hose.pk}: stock changed to 7 since the page was loaded; not saved',
+        ])
+        self.assertEqual((self.stock(self.hose), self.stock(self.rake)), (7, 6))
+
+    def test_invalid_rows_save_nothing(self):
+        response = self.post({
+            f'stock_{self.hose.pk}': '12', f'original_{self.hose.pk}': '10',
+            f'stock_{self.rake.pk}': 'lots', f'original_{self.rake.pk}': '4',
+        })
+        self.assertContains(response, f'#{self.rake.pk}: Stock must be a whole number of at least 0.')
+        response = self.post({f'stock_{self.hose.pk}': '12', f'original_{self.hose.pk}': ''})
+        self.assertContains(response, 'Original stock must be a whole number of at least 0.')
+        self.assertEqual(self.stock(self.hose), 10)
+
+    def test_rows_without_an_original_are_saved_regardless(self):
+        place_order(self.customer, [(self.hose.pk, 3)])
+        response = self.post({f'stock_{self.hose.pk}': '12'})
+        self.assertContains(response, 'Stock updated for 1 product')
+        self.assertEqual(self.stock(self.hose), 12)
+
+    def test_inventory_table_carries_the_original_figures(self):
+        response = self.client.get(reverse('panel:inventory_management'))
+        self.assertContains(response, f'name="original_{self.hose.pk}" value="10"')
+
+
+class StockOverviewTests(PanelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tools = Category.objects.create(name='Tools', reorder_threshold=2)
+        make_product(cls.tools, name='Spade', stock=0)
+        make_product(cls.tools, name='Trowel', stock=1)
+        make_product(cls.category, name='Hose reel', stock=0)
+
+    def test_inventory_counts(self):
+        response = self.client.get(reverse('panel:inventory_management'))
+        # Hose reel and Spade are out of stock; Rake and Trowel below their threshold
+        self.assertEqual(
+            (response.context['total_products'], response.context['out_of_stock'], response.context['low_stock']),
+            (5, 2, 2),
+        )
+        response = self.client.get(reverse('panel:inventory_management'), {'category': self.tools.pk})
+        self.assertEqual((response.context['out_of_stock'], response.context['low_stock']), (1, 1))
+        response = self.client.get(reverse('panel:inventory_management'), {'search': 'hose'})
+        self.assertEqual((response.context['total_products'], response.context['out_of_stock']), (2, 1))
+
+    def test_out_of_stock_count_comes_from_the_category_counters(self):
+        Category.objects.filter(pk=self.tools.pk).update(out_of_stock_count=40)
+        response = self.client.get(reverse('panel:inventory_management'))
+        self.assertEqual(response.context['out_of_stock'], 41)
+
+    def test_alerts_page_lists_the_low_stock_set(self):
+        response = self.client.get(reverse('panel:stock_alerts'))
+        self.assertEqual(
+            sorted(product.name for product in response.context['products']),
+            ['Hose reel', 'Rake', 'Spade', 'Trowel'],
+        )
+        response = self.client.get(reverse('panel:stock_alerts'), {'category': self.tools.pk})
+        self.assertEqual(sorted(product.name for product in response.context['products']), ['Spade', 'Trowel'])
+
+    def test_dashboard_reads_the_low_stock_set(self):
+        response = self.client.get(reverse('panel:dashboard'))
+        self.assertEqual(response.context['low_stock_count'], 4)
+        # Emptiest first
+        self.assertEqual(
+            sorted(product.name for product in response.context['low_stock_products'][:2]), ['Hose reel', 'Spade']
+        )
 
-# Create your tests here.
+    def test_customers_cannot_see_the_stock_pages(self):
+        self.client.force_login(self.customer)
+        for name in ('panel:inventory_management', 'panel:stock_alerts'):
+            self.assertEqual(self.client.get(reverse(name)).status_code, 302)
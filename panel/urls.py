@@ -10,10 +10,14 @@ urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('profile/', views.profile, name='profile'),
     path('orders/', views.order_management, name='order_management'),
+    path('orders/export/', views.order_export, name='order_export'),
+    path('orders/bulk-status/', views.bulk_update_order_status, name='bulk_update_order_status'),
     path('orders/<int:pk>/', views.order_detail_panel, name='order_detail'),
     path('orders/<int:pk>/status/<str:status>/', views.update_order_status, name='update_order_status'),
     path('inventory/', views.inventory_management, name='inventory_management'),
     path('inventory/<int:pk>/update-stock/', views.update_stock, name='update_stock'),
+    path('inventory/bulk-stock/', views.bulk_update_stock, name='bulk_update_stock'),
+    path('alerts/', views.stock_alerts, name='stock_alerts'),
     path('products/', views.product_management, name='product_management'),
     path('products/create/', views.product_create, name='product_create'),
     path('products/<int:pk>/edit/', views.product_edit, name='product_edit'),
@@ -1,3 +1,5 @@
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
@@ -5,10 +7,21 @@ from django.contrib import messages
 from django.db.models import Count, Sum, Q
 from django.utils import timezone
 from datetime import timedelta
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import require_POST
 from orders.models import Order, OrderItem
-from inventory.models import Product, Category
+from orders import archive, exports
+from orders.services import STATUS_BATCH_LIMIT, OrderStatusError, change_status
+from inventory import alerts, ledger
+from inventory.models import Product, Category, StockMovement
+from inventory.search import search_products
 from .forms import StaffCreationForm, StaffUpdateForm, ProductForm, CategoryForm
 
+# Products per page of the inventory table
+INVENTORY_PAGE_SIZE = 200
+# Orders per page of the order list
+ORDER_PAGE_SIZE = 100
+
 def staff_required(user):
     """Check if user is staff member"""
     return user.is_staff
@@ -32,20 +45,21 @@ def dashboard(request):
     today_revenue = Order.objects.filter(
         created_at__date=today,
         status='completed'
-    ).aggregate(total=Sum('items__price'))['total'] or 0
+    ).aggregate(total=Sum('total_amount'))['total'] or 0
     
     # Week statistics
     week_orders = Order.objects.filter(created_at__date__gte=week_ago).count()
     week_revenue = Order.objects.filter(
         created_at__date__gte=week_ago,
         status='completed'
-    ).aggregate(total=Sum('items__price'))['total'] or 0
+    ).aggregate(total=Sum('total_amount'))['total'] or 0
     
     # Recent orders
-    recent_orders = Order.objects.all().order_by('-created_at')[:10]
+    recent_orders = Order.objects.select_related('user').order_by('-created_at')[:10]
     
-    # Low stock products (less than 10 items)
-    low_stock_products = Product.objects.filter(stock_quantity__lt=10).order_by('stock_quantity')[:5]
+    # Low stock products, from the maintained low-stock set (inventory.alerts)
+    low_stock_products = alerts.low_stock().select_related('category').order_by('stock_quantity', 'id')[:5]
+    low_stock_count = alerts.low_stock().count()
     
     # Top selling products - count by quantity sold from completed orders only
     from django.db.models import Q
@@ -67,6 +81,7 @@ def dashboard(request):
         'week_revenue': week_revenue,
         'recent_orders': recent_orders,
         'low_stock_products': low_stock_products,
+        'low_stock_count': low_stock_count,
         'top_products': top_products,
     }
     
@@ -78,25 +93,54 @@ def order_management(request):
     """View for managing all orders"""
     status_filter = request.GET.get('status', '')
     
-    orders = Order.objects.all()
+    # Totals and a summary of the first lines are stored on the order, so
+    # the list never reads OrderItem
+    orders = Order.objects.select_related('user')
     
     if status_filter:
         orders = orders.filter(status=status_filter)
     
-    orders = orders.order_by('-created_at')
+    orders = orders.order_by('-created_at', '-id')
+    page = Paginator(orders, ORDER_PAGE_SIZE).get_page(request.GET.get('page'))
     
     context = {
-        'orders': orders,
+        'orders': page,
+        'page_obj': page,
         'current_status': status_filter,
     }
     
     return render(request, 'panel/order_management.html', context)
 
+@login_required
+@user_passes_test(staff_required)
+def order_export(request):
+    """Stream orders (or order lines with ?lines=1) as CSV or NDJSON"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in exports.FORMATS:
+        export_format = 'csv'
+    try:
+        filters = exports.parse_filters(request.GET)
+    except exports.ExportFilterError as error:
+        messages.error(request, str(error))
+        return redirect('panel:order_management')
+    
+    lines = bool(request.GET.get('lines'))
+    content_type, extension = exports.FORMATS[export_format]
+    filename = f'{"order-lines" if lines else "orders"}-{timezone.now():%Y%m%d}.{extension}'
+    response = StreamingHttpResponse(
+        exports.export(export_format, lines=lines, filters=filters, archived=bool(request.GET.get('archived'))),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @login_required
 @user_passes_test(staff_required)
 def order_detail_panel(request, pk):
     """Detailed view of an order with management options"""
-    order = get_object_or_404(Order, pk=pk)
+    order = get_object_or_404(
+        Order.objects.select_related('user').prefetch_related('items__product__category'), pk=pk
+    )
     
     context = {
         'order': order,
@@ -110,24 +154,47 @@ def update_order_status(request, pk, status):
     """Update order status"""
     order = get_object_or_404(Order, pk=pk)
     
-    if status in ['pending', 'processing', 'completed', 'cancelled']:
-        old_status = order.status
-        order.status = status
-        order.save()
-        
-        # If order is cancelled, restore stock
-        if status == 'cancelled' and old_status != 'cancelled':
-            for item in order.items.all():
-                product = item.product
-                product.stock_quantity += item.quantity
-                product.save()
-        
-        messages.success(request, f'Order #{order.id} status updated to {status}')
+    if status in dict(Order.STATUS_CHOICES):
+        # Cancelling restores stock (reopening takes it again)
+        try:
+            change_status([order.pk], status, user=request.user)
+            messages.success(request, f'Order #{order.id} status updated to {status}')
+        except OrderStatusError as error:
+            for message in error.messages:
+                messages.error(request, message)
     else:
         messages.error(request, 'Invalid status')
     
     return redirect('panel:order_detail', pk=pk)
 
+@login_required
+@user_passes_test(staff_required)
+@require_POST
+def bulk_update_order_status(request):
+    """Move the selected orders to a new status in one go"""
+    status = request.POST.get('status', '')
+    order_ids = [pk for pk in request.POST.getlist('order_ids') if pk.isdigit()]
+    
+    if status not in dict(Order.STATUS_CHOICES):
+        messages.error(request, 'Invalid status')
+    elif not order_ids:
+        messages.warning(request, 'No orders selected')
+    elif len(order_ids) > STATUS_BATCH_LIMIT:
+        messages.error(request, f'Select at most {STATUS_BATCH_LIMIT} orders at a time')
+    else:
+        try:
+            changed = change_status(order_ids, status, user=request.user)
+            messages.success(request, f'{changed} order{"s" if changed != 1 else ""} updated to {status}')
+        except OrderStatusError as error:
+            for message in error.messages:
+                messages.error(request, message)
+    
+    # Back to the list as it was filtered
+    next_url = request.POST.get('next', '')
+    if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect('panel:order_management')
+
 @login_required
 @user_passes_test(staff_required)
 def inventory_management(request):
@@ -135,27 +202,37 @@ def inventory_management(request):
     category_filter = request.GET.get('category', '')
     search_query = request.GET.get('search', '')
     
-    products = Product.objects.all()
+    products = Product.objects.select_related('category')
     
     if category_filter:
         products = products.filter(category_id=category_filter)
     
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
-    
-    products = products.order_by('name')
+        # Ranked by relevance
+        products = search_products(products, search_query)
+    else:
+        products = products.order_by('name', 'id')
     categories = Category.objects.all()
     
+    paginator = Paginator(products, INVENTORY_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('page'))
+    
     # Calculate statistics
-    total_products = products.count()
-    out_of_stock = products.filter(stock_quantity=0).count()
-    low_stock = products.filter(stock_quantity__lt=10, stock_quantity__gt=0).count()
+    total_products = paginator.count
+    if search_query:
+        # The counters can't see search matches, so count them; search_products
+        # caps them at SEARCH_MAX_RESULTS on every backend, so the count stays
+        # small, though it re-runs the text match
+        out_of_stock = products.filter(stock_quantity=0).count()
+    else:
+        # From the per-category counters (inventory.counters), not a product scan
+        counted = Category.objects.filter(pk=category_filter) if category_filter else categories
+        out_of_stock = counted.aggregate(total=Sum('out_of_stock_count'))['total'] or 0
+    low_stock = products.filter(is_low_stock=True, stock_quantity__gt=0).count()
     
     context = {
-        'products': products,
+        'products': page,
+        'page_obj': page,
         'categories': categories,
         'current_category': category_filter,
         'search_query': search_query,
@@ -166,6 +243,26 @@ def inventory_management(request):
     
     return render(request, 'panel/inventory_management.html', context)
 
+@login_required
+@user_passes_test(staff_required)
+def stock_alerts(request):
+    """Products below their reorder threshold, most recent first"""
+    products = alerts.low_stock().select_related('category')
+    category_filter = request.GET.get('category', '')
+    if category_filter:
+        products = products.filter(category_id=category_filter)
+    
+    page = Paginator(products, INVENTORY_PAGE_SIZE).get_page(request.GET.get('page'))
+    
+    context = {
+        'products': page,
+        'page_obj': page,
+        'categories': Category.objects.all(),
+        'current_category': category_filter,
+    }
+    
+    return render(request, 'panel/stock_alerts.html', context)
+
 @login_required
 @user_passes_test(staff_required)
 def update_stock(request, pk):
@@ -176,6 +273,7 @@ def update_stock(request, pk):
         
         if new_stock and new_stock.isdigit():
             product.stock_quantity = int(new_stock)
+            ledger.attribute(product, StockMovement.ADJUSTMENT, user=request.user)
             product.save()
             messages.success(request, f'Stock updated for {product.name}')
         else:
@@ -183,6 +281,51 @@ def update_stock(request, pk):
     
     return redirect('panel:inventory_management')
 
+@login_required
+@user_passes_test(staff_required)
+@require_POST
+def bulk_update_stock(request):
+    """
+    Save every stock figure changed in the inventory table at once. Each
+    row carries the stock it showed (original_<id>); rows whose product
+    sold since the page was rendered are reported, not overwritten. A row
+    without one is saved regardless, as in the API.
+    """
+    entries = [
+        (name.removeprefix('stock_'), value, request.POST.get(name.replace('stock_', 'original_', 1)))
+        for name, value in request.POST.items()
+        if name.startswith('stock_')
+    ]
+    
+    if not entries:
+        messages.warning(request, 'No stock changes to save')
+    elif len(entries) > ledger.STOCK_BATCH_LIMIT:
+        messages.error(request, f'Change at most {ledger.STOCK_BATCH_LIMIT} products at a time')
+    else:
+        levels, expected, errors = ledger.validate_levels(entries)
+        if any(errors):
+            # All or nothing: report the bad rows, change nothing
+            failed = [(product_id, error) for (product_id, _, _), error in zip(entries, errors) if error]
+            for product_id, error in failed[:10]:
+                messages.error(request, f'#{product_id}: {error}')
+            if len(failed) > 10:
+                messages.error(request, f'...and {len(failed) - 10} more invalid rows. Nothing was saved.')
+        else:
+            changes, conflicts = ledger.set_stock(levels, user=request.user, expected=expected)
+            changed = sum(1 for old, new in changes.values() if old != new)
+            messages.success(request, f'Stock updated for {changed} product{"s" if changed != 1 else ""}')
+            for product_id, current in sorted(conflicts.items())[:10]:
+                messages.warning(
+                    request, f'#{product_id}: stock changed to {current} since the page was loaded; not saved'
+                )
+            if len(conflicts) > 10:
+                messages.warning(request, f'...and {len(conflicts) - 10} more products changed meanwhile.')
+    
+    next_url = request.POST.get('next', '')
+    if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect('panel:inventory_management')
+
 @login_required
 @user_passes_test(staff_required)
 def staff_management(request):
@@ -303,7 +446,7 @@ def customer_management(request):
     # Get order statistics for each customer
     customers = customers_base.annotate(
         total_orders=Count('orders'),
-        total_spent=Sum('orders__items__price', filter=Q(orders__status='completed'))
+        total_spent=Sum('orders__total_amount', filter=Q(orders__status='completed'))
     ).order_by('-date_joined')
     
     context = {
@@ -325,11 +468,18 @@ def customer_detail(request, pk):
     # Get customer's orders
     orders = Order.objects.filter(user=customer).order_by('-created_at')
     
-    # Calculate statistics
-    total_orders = orders.count()
-    completed_orders = orders.filter(status='completed').count()
+    # Calculate statistics (archived orders included)
+    archived = archive.summary(customer)
+    total_orders = orders.count() + archived['count']
+    completed_orders = orders.filter(status='completed').count() + archived['completed']
     pending_orders = orders.filter(status='pending').count()
-    total_spent = sum(order.total_price for order in orders.filter(status='completed'))
+    total_spent = (
+        (orders.filter(status='completed').aggregate(total=Sum('total_amount'))['total'] or 0)
+        + (archived['spent'] or 0)
+    )
+    
+    # Archived orders are only listed when asked for
+    show_archived = bool(request.GET.get('archived'))
     
     context = {
         'customer': customer,
@@ -338,6 +488,9 @@ def customer_detail(request, pk):
         'completed_orders': completed_orders,
         'pending_orders': pending_orders,
         'total_spent': total_spent,
+        'archived_count': archived['count'],
+        'show_archived': show_archived,
+        'archived_orders': customer.archived_orders.order_by('-created_at') if show_archived else None,
     }
     
     return render(request, 'panel/customer_detail.html', context)
@@ -390,7 +543,7 @@ def product_management(request):
     # Search functionality
     search_query = request.GET.get('search', '')
     if search_query:
-        products = products.filter(name__icontains=search_query)
+        products = search_products(products, search_query)
     
     # Category filter
     category_filter = request.GET.get('category', '')
@@ -415,6 +568,7 @@ def product_create(request):
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES)
         if form.is_valid():
+            ledger.attribute(form.instance, StockMovement.INITIAL, user=request.user)
             product = form.save()
             messages.success(request, f'Product "{product.name}" created successfully!')
             return redirect('panel:product_management')
@@ -432,6 +586,7 @@ def product_edit(request, pk):
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES, instance=product)
         if form.is_valid():
+            ledger.attribute(product, StockMovement.ADJUSTMENT, user=request.user)
             product = form.save()
             messages.success(request, f'Product "{product.name}" updated successfully!')
             return redirect('panel:product_management')
@@ -459,9 +614,7 @@ def product_delete(request, pk):
 @user_passes_test(staff_required)
 def category_management(request):
     """View for managing categories"""
-    categories = Category.objects.annotate(
-        product_count=Count('products')
-    ).order_by('name')
+    categories = Category.objects.order_by('name')
     
     return render(request, 'panel/category_management.html', {'categories': categories})
 
@@ -1,192 +1,163 @@
 // AJAX cart quantity update
 document.addEventListener('DOMContentLoaded', function() {
-    // Handle cart quantity update buttons
-    document.querySelectorAll('a[data-cart-action]').forEach(function(link) {
+    bindCartControls(document);
+});
+
+const CART_BATCH_URL = '/cart/batch/';
+// Clicks arriving within this window are sent as one batch request
+const CART_BATCH_DELAY = 400;
+
+// Pending quantity changes per product id, waiting to be sent
+const pendingCartDeltas = new Map();
+let cartBatchTimer = null;
+let cartBatchInFlight = null;
+
+// Attach the AJAX cart handlers to every cart control inside root.
+// Called again for product cards appended by infinite scroll.
+function bindCartControls(root) {
+    // +/- buttons
+    root.querySelectorAll('a[data-cart-action]').forEach(function(link) {
         link.addEventListener('click', function(e) {
             e.preventDefault();
-            
-            const action = this.getAttribute('data-cart-action');
             const productId = this.getAttribute('data-product-id');
-            const url = this.getAttribute('href');
-            
-            // Disable all buttons in the same group and save their original HTML FIRST
-            const group = this.closest('[data-cart-controls]');
-            const buttonOriginals = new Map();
-            if (group) {
-                group.querySelectorAll('a').forEach(btn => {
-                    buttonOriginals.set(btn, btn.innerHTML);
-                    btn.style.pointerEvents = 'none';
-                });
-            }
-            
-            // Show loading state AFTER saving originals
-            const originalHTML = this.innerHTML;
-            this.innerHTML = '<i class="bi bi-arrow-repeat spin"></i>';
-            this.style.pointerEvents = 'none';
-            
-            // Make AJAX request
-            fetch(url, {
-                method: 'GET',
-                headers: {
-                    'X-Requested-With': 'XMLHttpRequest',
-                }
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Update quantity display
-                    const quantityElements = document.querySelectorAll(`[data-product-quantity="${productId}"]`);
-                    quantityElements.forEach(quantityElement => {
-                        if (data.quantity > 0) {
-                            quantityElement.textContent = data.quantity;
-                        } else {
-                            quantityElement.textContent = '0';
-                        }
-                    });
-                    
-                    // Handle cart controls visibility
-                    const cartControls = document.querySelector(`[data-cart-controls="${productId}"]`);
-                    const addButton = document.querySelector(`[data-add-button="${productId}"]`);
-                    
-                    if (data.quantity > 0) {
-                        if (cartControls) cartControls.style.display = '';
-                        if (addButton) addButton.style.display = 'none';
-                    } else {
-                        if (cartControls) {
-                            cartControls.style.display = 'none';
-                            // Restore all buttons in cartControls
-                            cartControls.querySelectorAll('a').forEach(btn => {
-                                btn.style.pointerEvents = 'auto';
-                            });
-                        }
-                        if (addButton) {
-                            // Remove inline display style to show the button
-                            addButton.style.removeProperty('display');
-                            addButton.style.pointerEvents = 'auto';
-                            addButton.style.cursor = 'pointer';
-                            // Ensure addButton has correct content (in case it was modified)
-                            if (!addButton.innerHTML.includes('Add to Cart')) {
-                                addButton.innerHTML = 'Add to Cart';
-                            }
-                            // Remove any disabled attribute if present
-                            addButton.removeAttribute('disabled');
-                        }
-                    }
-                    
-                    // Restore button after visibility changes
-                    // First restore the clicked button
-                    this.innerHTML = originalHTML;
-                    this.style.pointerEvents = 'auto';
-                    
-                    // Then restore all other buttons in the group (but not the clicked one)
-                    if (group) {
-                        group.querySelectorAll('a').forEach(btn => {
-                            btn.style.pointerEvents = 'auto';
-                            // Restore original content for all buttons except the one we clicked
-                            if (btn !== this && buttonOriginals.has(btn)) {
-                                btn.innerHTML = buttonOriginals.get(btn);
-                            }
-                        });
-                    }
-                    
-                    // If on cart page, reload to update totals
-                    if (window.location.pathname.includes('/cart/')) {
-                        setTimeout(() => {
-                            window.location.reload();
-                        }, 500);
-                    }
-                    
-                    // Show success message
-                    showNotification(data.message, 'success');
-                } else {
-                    // Restore button on error
-                    this.innerHTML = originalHTML;
-                    this.style.pointerEvents = 'auto';
-                    if (group) {
-                        group.querySelectorAll('a').forEach(btn => {
-                            btn.style.pointerEvents = 'auto';
-                            // Restore original content for all buttons except the one we clicked
-                            if (btn !== this && buttonOriginals.has(btn)) {
-                                btn.innerHTML = buttonOriginals.get(btn);
-                            }
-                        });
-                    }
-                    // Show warning message
-                    showNotification(data.message, 'warning');
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                this.innerHTML = originalHTML;
-                this.style.pointerEvents = 'auto';
-                if (group) {
-                    group.querySelectorAll('a').forEach(btn => {
-                        btn.style.pointerEvents = 'auto';
-                        // Restore original content for all buttons except the one we clicked
-                        if (btn !== this && buttonOriginals.has(btn)) {
-                            btn.innerHTML = buttonOriginals.get(btn);
-                        }
-                    });
-                }
-                showNotification('An error occurred. Please try again.', 'danger');
-            });
+            const delta = this.getAttribute('data-cart-action') === 'increase' ? 1 : -1;
+            queueCartChange(productId, delta);
         });
     });
-    
-    // Handle "Add to Cart" buttons
-    document.querySelectorAll('a[data-add-button]').forEach(function(link) {
+
+    // "Add to Cart" buttons
+    root.querySelectorAll('a[data-add-button]').forEach(function(link) {
         if (!link.hasAttribute('data-cart-action')) {
             link.addEventListener('click', function(e) {
                 e.preventDefault();
-                
-                const productId = this.getAttribute('data-add-button');
-                const url = this.getAttribute('href');
-                
-                // Show loading state
-                const originalHTML = this.innerHTML;
-                this.innerHTML = '<i class="bi bi-arrow-repeat spin"></i>';
-                this.style.pointerEvents = 'none';
-                
-                // Make AJAX request
-                fetch(url, {
-                    method: 'GET',
-                    headers: {
-                        'X-Requested-With': 'XMLHttpRequest',
-                    }
-                })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        // Hide "Add to Cart" button and show quantity controls
-                        const cartControls = document.querySelector(`[data-cart-controls="${productId}"]`);
-                        const addButton = document.querySelector(`[data-add-button="${productId}"]`);
-                        
-                        if (cartControls) {
-                            cartControls.style.display = '';
-                            const quantityElement = cartControls.querySelector(`[data-product-quantity="${productId}"]`);
-                            if (quantityElement) {
-                                quantityElement.textContent = data.quantity;
-                            }
-                        }
-                        if (addButton) addButton.style.display = 'none';
-                        
-                        showNotification(data.message, 'success');
-                    } else {
-                        this.innerHTML = originalHTML;
-                        this.style.pointerEvents = 'auto';
-                        showNotification(data.message, 'warning');
-                    }
-                })
-                .catch(error => {
-                    console.error('Error:', error);
-                    this.innerHTML = originalHTML;
-                    this.style.pointerEvents = 'auto';
-                    showNotification('An error occurred. Please try again.', 'danger');
-                });
+                queueCartChange(this.getAttribute('data-add-button'), 1);
             });
         }
     });
-});
+}
+
+// Record a click, show its effect straight away and (re)start the timer
+function queueCartChange(productId, delta) {
+    const quantity = Math.max(0, displayedQuantity(productId) + delta);
+    pendingCartDeltas.set(productId, (pendingCartDeltas.get(productId) || 0) + delta);
+    showCartQuantity(productId, quantity);
+
+    clearTimeout(cartBatchTimer);
+    cartBatchTimer = setTimeout(flushCartChanges, CART_BATCH_DELAY);
+}
+
+function displayedQuantity(productId) {
+    const controls = document.querySelector(`[data-cart-controls="${productId}"]`);
+    if (controls && controls.style.display === 'none') return 0;
+    const element = document.querySelector(`[data-product-quantity="${productId}"]`);
+    return element ? parseInt(element.textContent, 10) || 0 : 0;
+}
+
+// Send every pending change in one request
+function flushCartChanges() {
+    if (cartBatchInFlight) {
+        // Wait for the request in flight so changes reach the server in order
+        cartBatchInFlight.then(flushCartChanges);
+        return;
+    }
+    if (pendingCartDeltas.size === 0) return;
+
+    const operations = Array.from(pendingCartDeltas, ([productId, delta]) => ({
+        product_id: parseInt(productId, 10),
+        delta: delta,
+    })).filter(operation => operation.delta !== 0);
+    pendingCartDeltas.clear();
+    if (operations.length === 0) return;
+
+    cartBatchInFlight = getCsrfToken()
+        .then(token => fetch(CART_BATCH_URL, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': token,
+                'X-Requested-With': 'XMLHttpRequest',
+            },
+            body: JSON.stringify({operations: operations}),
+        }))
+        .then(response => response.json())
+        .then(data => {
+            applyCartState(data);
+            const failures = (data.results || []).filter(result => !result.success);
+            if (failures.length) {
+                failures.forEach(result => showNotification(result.message, 'warning'));
+            } else if (data.results) {
+                showNotification('Cart updated', 'success');
+            }
+            // The cart page shows totals computed on the server
+            if (window.location.pathname.includes('/cart/') && pendingCartDeltas.size === 0) {
+                setTimeout(() => {
+                    window.location.reload();
+                }, 500);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            showNotification('An error occurred. Please try again.', 'danger');
+            return fetch(CART_BATCH_URL, {headers: {'X-Requested-With': 'XMLHttpRequest'}})
+                .then(response => response.json())
+                .then(applyCartState)
+                .catch(() => {});
+        })
+        .finally(() => {
+            cartBatchInFlight = null;
+        });
+}
+
+// Show the server's view of the cart, keeping clicks that are still pending
+function applyCartState(data) {
+    if (!data.items) return;
+    updateCartBadge(data.cart_count);
+    document.querySelectorAll('[data-cart-controls]').forEach(controls => {
+        const productId = controls.getAttribute('data-cart-controls');
+        const quantity = (data.items[productId] || 0) + (pendingCartDeltas.get(productId) || 0);
+        showCartQuantity(productId, Math.max(0, quantity));
+    });
+}
+
+// Toggle between the quantity controls and the "Add to Cart" button
+function showCartQuantity(productId, quantity) {
+    document.querySelectorAll(`[data-product-quantity="${productId}"]`).forEach(element => {
+        element.textContent = quantity;
+    });
+    document.querySelectorAll(`[data-cart-controls="${productId}"]`).forEach(controls => {
+        controls.style.display = quantity > 0 ? '' : 'none';
+    });
+    document.querySelectorAll(`[data-add-button="${productId}"]`).forEach(button => {
+        if (quantity > 0) {
+            button.style.display = 'none';
+        } else {
+            button.style.removeProperty('display');
+        }
+    });
+}
+
+// The CSRF cookie may be missing on cached pages; asking the batch
+// endpoint for the cart sets it
+function getCsrfToken() {
+    const token = readCookie('csrftoken');
+    if (token) return Promise.resolve(token);
+    return fetch(CART_BATCH_URL, {headers: {'X-Requested-With': 'XMLHttpRequest'}})
+        .then(() => readCookie('csrftoken'));
+}
+
+function readCookie(name) {
+    const match = document.cookie.match(new RegExp('(?:^|; )' + name + '=([^;]*)'));
+    return match ? decodeURIComponent(match[1]) : null;
+}
+
+// Keep the header cart badge in step with the session cart
+function updateCartBadge(count) {
+    if (count === undefined) return;
+    document.querySelectorAll('[data-cart-badge]').forEach(badge => {
+        badge.textContent = count;
+        badge.classList.toggle('d-none', count === 0);
+    });
+}
 
 // Show notification function
 function showNotification(message, type) {
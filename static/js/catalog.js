@@ -0,0 +1,76 @@
+// Infinite scroll for the catalog: when the pager scrolls into view, fetch
+// the next keyset page and append its cards to the grid. The pager links
+// keep working as plain next/previous navigation without JavaScript.
+document.addEventListener('DOMContentLoaded', function() {
+    const grid = document.querySelector('[data-catalog-grid]');
+    if (!grid || !('IntersectionObserver' in window)) {
+        return;
+    }
+
+    let loading = false;
+
+    const observer = new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+            if (entry.isIntersecting) {
+                loadNextPage(entry.target);
+            }
+        });
+    }, { rootMargin: '400px 0px' });
+
+    function watchPager() {
+        const pager = document.querySelector('[data-catalog-pager][data-next-url]');
+        if (pager) {
+            observer.observe(pager);
+        }
+    }
+
+    function loadNextPage(pager) {
+        const url = pager.getAttribute('data-next-url');
+        if (loading || !url) {
+            return;
+        }
+        loading = true;
+        observer.unobserve(pager);
+
+        fetch(url, {
+            method: 'GET',
+            headers: {
+                'X-Requested-With': 'XMLHttpRequest',
+            }
+        })
+        .then(response => response.text())
+        .then(html => {
+            const fragment = document.createElement('div');
+            fragment.innerHTML = html;
+
+            const cards = fragment.querySelector('[data-catalog-cards]');
+            const newNodes = [];
+            if (cards) {
+                Array.from(cards.children).forEach(node => {
+                    grid.appendChild(node);
+                    newNodes.push(node);
+                });
+            }
+            newNodes.forEach(node => bindCartControls(node));
+
+            // Swap in the new pager so the next cursor is picked up
+            const newPager = fragment.querySelector('[data-catalog-pager]');
+            if (newPager) {
+                pager.replaceWith(newPager);
+            } else {
+                pager.remove();
+            }
+
+            // Keep the address bar on a URL that reloads the same position
+            window.history.replaceState(null, '', url);
+            loading = false;
+            watchPager();
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            loading = false;
+        });
+    }
+
+    watchPager();
+});